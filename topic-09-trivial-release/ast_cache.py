@@ -0,0 +1,135 @@
+import gc
+import hashlib
+import marshal
+import os
+import tempfile
+
+from tokenizer import tokenize, tokenize_stream
+from parser import parse
+
+# An on-disk cache of parsed programs, like Python's __pycache__.
+#
+# The AST of a program file is kept in __trivialcache__/<file name>.ast next
+# to it, marshalled together with a key: a hash of the source and of the
+# tokenizer and parser sources, so changing either the program or the parser
+# invalidates it. A cache that is missing, stale, unreadable or unwritable is
+# never an error; the program is just parsed.
+
+cache_directory = "__trivialcache__"
+
+
+def parser_version():
+    """A hash of the modules that turn source into an AST."""
+    digest = hashlib.sha256()
+    for module in ["tokenizer.py", "parser.py"]:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), module), "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+version = parser_version()
+
+
+def cache_key(source_code):
+    return hashlib.sha256((version + "\0" + source_code).encode("utf-8")).hexdigest()
+
+
+def cache_path(path):
+    directory, name = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, cache_directory, name + ".ast")
+
+
+def load(path, source_code):
+    """The cached AST of the program at path, or None if there is no valid one."""
+    # the AST is only containers of constants, so the cyclic garbage collector,
+    # which would otherwise run over and over as they are created, is held off
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        # marshal.load() reads a file in small pieces; loads() of the whole is far quicker
+        with open(cache_path(path), "rb") as f:
+            key, ast = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    finally:
+        if collecting:
+            gc.enable()
+    if key != cache_key(source_code):
+        return None
+    return ast
+
+
+def save(path, source_code, ast):
+    """Caches the AST of the program at path, if the cache directory is writable."""
+    target = cache_path(path)
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # written aside and renamed, so a reader never sees a partial file
+        descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(target))
+    except OSError:
+        return
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            marshal.dump((cache_key(source_code), ast), f)
+        # mkstemp() makes the file private; give it the mode open() would have
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary, 0o666 & ~umask)
+        os.replace(temporary, target)
+    except (OSError, ValueError):
+        # an AST marshal cannot write, or a full disk, leaves no stray file behind
+        os.unlink(temporary)
+
+
+def parse_file(path, source_code):
+    """The AST of the program at path, from the cache when it is valid."""
+    ast = load(path, source_code)
+    if ast is None:
+        ast = parse(tokenize_stream(source_code))
+        save(path, source_code, ast)
+    return ast
+
+
+def test_parse_file():
+    print("testing parse file...")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.t")
+        source_code = "x = [1, 2.5, true]; function f(a) { return a + 1 }; print f(x[0])"
+        assert load(path, source_code) is None
+        ast = parse_file(path, source_code)
+        assert ast == parse(tokenize(source_code))
+        assert os.path.exists(os.path.join(directory, "__trivialcache__", "program.t.ast"))
+        # with the permissions of any file written with open()
+        with open(os.path.join(directory, "other"), "w"):
+            pass
+        assert os.stat(cache_path(path)).st_mode == os.stat(os.path.join(directory, "other")).st_mode
+        assert load(path, source_code) == ast
+        # a cached AST is returned as it was stored
+        save(path, source_code, {"tag": "program", "statements": []})
+        assert parse_file(path, source_code) == {"tag": "program", "statements": []}
+        # a changed program is parsed again
+        assert parse_file(path, source_code + "; 3") == parse(tokenize(source_code + "; 3"))
+        assert load(path, source_code) is None
+        # a damaged cache file is ignored
+        with open(cache_path(path), "wb") as f:
+            f.write(b"\x00garbage")
+        assert load(path, source_code) is None
+        assert parse_file(path, source_code) == ast
+        # a cache that cannot be written is skipped, and leaves nothing behind
+        entries = sorted(os.listdir(os.path.dirname(cache_path(path))))
+        save(path, source_code, {"tag": "program", "statements": [object()]})
+        assert sorted(os.listdir(os.path.dirname(cache_path(path)))) == entries
+        assert load(path, source_code) == ast
+
+
+def test_cache_key():
+    print("testing cache key...")
+    assert cache_key("x = 1") == cache_key("x = 1")
+    assert cache_key("x = 1") != cache_key("x = 2")
+    assert len(version) == 64
+
+
+if __name__ == "__main__":
+    test_parse_file()
+    test_cache_key()
+    print("done.")
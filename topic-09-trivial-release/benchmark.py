@@ -0,0 +1,677 @@
+#!/usr/bin/env python
+
+# Benchmarks for the trivial implementation.
+#
+# usage: python benchmark.py [benchmark ...]
+#
+# With no arguments every benchmark is run.
+
+import contextlib
+import gc
+import io
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from tokenizer import Token, tokenize, tokenize_stream, patterns, keywords, master_pattern
+from parser import parse, parse_program
+import evaluator
+from evaluator import evaluate
+import closure_compiler
+import stack_evaluator
+import ast_cache
+import program_file
+import sink
+import tracing
+from optimizer import optimize, hoist_invariants
+import compiler
+import vm
+from objects import Object
+import lists
+
+sample_code = """
+// compute a running total over a list of records
+function total(records, limit) {
+    sum = 0;
+    i = 0;
+    while (i < limit && records[i].amount != 0) {
+        if (records[i].amount >= 10.5) {
+            sum = sum + records[i].amount * 2
+        } else {
+            sum = sum - 1
+        };
+        i = i + 1
+    };
+    return sum
+};
+data = [{"amount": 12.5, "name": "a ""quoted"" name"}, {"amount": 3, "name": "b"}];
+print total(data, 2) / 4
+"""
+
+
+loop_program = """
+    i = 0;
+    total = 0;
+    while (i < 200000) {
+        total = total + i * 2 - 1;
+        i = i + 1
+    };
+    total
+"""
+
+call_program = """
+    function fib(n) {
+        if (n < 2) {
+            return n
+        };
+        return fib(n - 1) + fib(n - 2)
+    };
+    fib(21)
+"""
+
+
+def sample_program(size):
+    """Returns about `size` characters of trivial source code."""
+    copies = max(1, size // len(sample_code))
+    return ";".join([sample_code] * copies)
+
+
+def sample_tokens(count):
+    """Returns a token list for a program of about `count` tokens."""
+    per_copy = len(tokenize(sample_code)) - 1
+    return tokenize(";".join([sample_code] * max(1, count // per_copy)))
+
+
+def timed(function, *arguments):
+    start = time.perf_counter()
+    result = function(*arguments)
+    return result, time.perf_counter() - start
+
+
+def retained_memory(function, *arguments):
+    tracemalloc.start()
+    try:
+        result = function(*arguments)
+        return result, tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+
+
+def peak_memory(function, *arguments):
+    tracemalloc.start()
+    try:
+        function(*arguments)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def allocated_blocks(function, *arguments):
+    """The memory blocks a run leaves allocated: traced by tracemalloc, and counted by the allocator."""
+    gc.collect()
+    before = sys.getallocatedblocks()
+    tracemalloc.start()
+    try:
+        function(*arguments)
+        traced = sum(statistic.count for statistic in tracemalloc.take_snapshot().statistics("filename"))
+    finally:
+        tracemalloc.stop()
+    gc.collect()
+    return traced, sys.getallocatedblocks() - before
+
+
+def report(label, count, unit, seconds):
+    print(f"  {label:<24} {count / seconds:>14,.0f} {unit}/s  ({seconds:.3f}s)")
+
+
+def sequential_tokenize(characters):
+    """The original tokenizer loop: try each pattern in turn at every position."""
+    compiled = [(re.compile(pattern), tag) for pattern, tag in patterns]
+    tokens = []
+    position = 0
+    while position < len(characters):
+        for pattern, tag in compiled:
+            match = pattern.match(characters, position)
+            if match:
+                break
+        if tag == "identifier":
+            tag = keywords.get(match.group(0), "identifier")
+        token = {"tag": tag, "value": match.group(0), "position": position}
+        if tag == "string":
+            token["value"] = token["value"][1:-1].replace('""', '"')
+        if tag == "number":
+            if "." in token["value"]:
+                token["value"] = float(token["value"])
+            else:
+                token["value"] = int(token["value"])
+        if tag == "boolean":
+            token["value"] = 1 if token["value"] == "true" else 0
+        if tag not in ["comment", "whitespace"]:
+            tokens.append(token)
+        position = match.end()
+    tokens.append({"tag": None, "value": None, "position": position})
+    return tokens
+
+
+def benchmark_tokenize():
+    source = sample_program(4_000_000)
+    print(f"tokenize: {len(source):,} characters")
+    before, before_seconds = timed(sequential_tokenize, source)
+    after, after_seconds = timed(tokenize, source)
+    assert before == after, "token streams differ"
+    report("sequential patterns", len(after), "tokens", before_seconds)
+    report("master pattern", len(after), "tokens", after_seconds)
+
+
+def benchmark_keywords():
+    words = "format iffy counter printer order android total x y value width"
+    source = " ".join([words] * 100_000)
+    print(f"keywords: {len(source):,} characters of identifiers")
+    # the previous layout: one prefix pattern per keyword ahead of identifier
+    prefix_patterns = [[re.escape(word), tag] for word, tag in keywords.items()]
+    layout = patterns[:4] + prefix_patterns + patterns[4:]
+    prefix_pattern = re.compile(
+        "|".join(f"(?P<t{index}>{pattern})" for index, (pattern, _) in enumerate(layout))
+    )
+
+    def scan_with_prefixes():
+        return [group_tags[m.lastgroup] for m in prefix_pattern.finditer(source)]
+
+    identifier_group = [f"t{i}" for i, (_, tag) in enumerate(patterns) if tag == "identifier"][0]
+
+    def scan_with_table():
+        return [
+            keywords.get(m.group(0), "identifier") if m.lastgroup == identifier_group else m.lastgroup
+            for m in master_pattern.finditer(source)
+        ]
+
+    group_tags = {f"t{index}": tag for index, (_, tag) in enumerate(layout)}
+    _, before_seconds = timed(scan_with_prefixes)
+    _, after_seconds = timed(scan_with_table)
+    report("keyword prefix patterns", len(source), "chars", before_seconds)
+    report("keyword table", len(source), "chars", after_seconds)
+
+
+def benchmark_stream():
+    source = sample_program(60_000)
+    print(f"stream: peak memory to tokenize and parse {len(source):,} characters")
+    for label, tokenizer in [("token list", tokenize), ("token stream", tokenize_stream)]:
+        peak = peak_memory(lambda: parse(tokenizer(source)))
+        print(f"  {label:<24} {peak / 1e6:>10.1f} MB")
+
+
+def benchmark_tokens():
+    tokens = tokenize(sample_program(4_200_000))
+    print(f"tokens: memory held by {len(tokens):,} tokens (values shared, not counted)")
+    for label, build in [
+        ("dict tokens", lambda: [token.as_dict() for token in tokens]),
+        ("slotted tokens", lambda: [Token(t.tag, t.value, t.position) for t in tokens]),
+    ]:
+        _, size = retained_memory(build)
+        print(f"  {label:<24} {size / 1e6:>10.1f} MB  ({size / len(tokens):.0f} bytes/token)")
+
+
+def benchmark_parse():
+    print("parse: seconds to parse programs of increasing size")
+    for count in [10_000, 100_000, 1_000_000]:
+        tokens = sample_tokens(count)
+        _, seconds = timed(parse, tokens)
+        report(f"cursor, {count:,} tokens", len(tokens), "tokens", seconds)
+    # parse_program on a plain list slices it at every token
+    for count in [10_000, 30_000]:
+        tokens = sample_tokens(count)
+        _, seconds = timed(parse_program, tokens)
+        report(f"slicing, {count:,} tokens", len(tokens), "tokens", seconds)
+
+
+def benchmark_expressions():
+    statement = "y = (a + b * c - d / e < f * (g - h) && i == j || !k) + x[i] * -y.z"
+    tokens = tokenize(";".join([statement] * 20_000))
+    print(f"expressions: parsing {len(tokens):,} tokens of expression statements")
+    _, seconds = timed(parse, tokens)
+    report("parse", len(tokens), "tokens", seconds)
+
+
+def run_closures(ast, environment):
+    return closure_compiler.execute(closure_compiler.compile(ast), environment)
+
+
+def run_vm(ast, environment):
+    return vm.execute(compiler.compile(ast), environment)
+
+
+backends = {
+    "evaluate": evaluate,
+    "stack": stack_evaluator.evaluate,
+    "closures": run_closures,
+    "vm": run_vm,
+}
+
+
+def benchmark_backends():
+    print("backends: seconds to compile and run, per backend")
+    for name, code in [("loop", loop_program), ("call", call_program)]:
+        ast = parse(tokenize(code))
+        expected = None
+        line = f"  {name:<8}"
+        for backend, run in backends.items():
+            (result, _), seconds = timed(run, ast, {})
+            assert expected in [None, result]
+            expected = result
+            line += f" {backend} {seconds:.3f}s "
+        print(line)
+
+
+def benchmark_lookup():
+    print("lookup: microseconds per call of a recursion that reads a global at each level")
+    code = """
+        step = 1;
+        function down(n) {
+            if (n == 0) { return 0 };
+            return step + down(n - 1)
+        };
+        down(DEPTH)
+    """
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(100_000)
+    try:
+        for depth in [250, 500, 1000, 2000]:
+            ast = parse(tokenize(code.replace("DEPTH", str(depth))))
+            line = f"  depth {depth:<6}"
+            for backend, run in backends.items():
+                (result, _), seconds = timed(run, ast, {})
+                assert result == depth
+                line += f" {backend} {seconds / depth * 1e6:>6.1f} us "
+            print(line)
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+guard_program = """
+    function expensive(i) {
+        j = 0;
+        while (j < 20) { j = j + 1 };
+        return i
+    };
+    i = 0;
+    found = 0;
+    while (i < 20000) {
+        if (i < 100 && expensive(i) > 50 || i > 19990 && expensive(i) > 0) {
+            found = found + 1
+        };
+        i = i + 1
+    };
+    found
+"""
+
+
+def benchmark_guards():
+    print("guards: seconds for a loop whose && guards skip an expensive call")
+    ast = parse(tokenize(guard_program))
+    line = "  guards  "
+    for backend, run in backends.items():
+        (result, _), seconds = timed(run, ast, {})
+        assert result == 58
+        line += f" {backend} {seconds:.3f}s "
+    print(line)
+
+
+def benchmark_returns():
+    print("returns: evaluate() seconds (best of 5), peak traced memory and blocks left allocated")
+    for name, code in [("loop", loop_program), ("call", call_program)]:
+        ast = parse(tokenize(code))
+        seconds = min(timed(evaluate, ast, {})[1] for _ in range(5))
+        peak = peak_memory(evaluate, ast, {})
+        traced, blocks = allocated_blocks(evaluate, ast, {})
+        print(
+            f"  {name:<8} {seconds:.3f}s  peak {peak / 1e3:>8.1f} kB"
+            f"  blocks {traced:>5} traced, {blocks:>+5} allocator"
+        )
+
+
+def benchmark_tail_calls():
+    print("tailcalls: a tail-recursive sum(1,000,000, 0) in constant Python stack")
+    code = """
+        function sum(n, acc) {
+            if (n == 0) { return acc };
+            return sum(n - 1, acc + n)
+        };
+        sum(1000000, 0)
+    """
+    ast = parse(tokenize(code))
+    # the closure compiler still makes one Python call per trivial call
+    for backend in ["evaluate", "stack", "vm"]:
+        (result, _), seconds = timed(backends[backend], ast, {})
+        assert result == 500000500000
+        report(backend, 1_000_000, "calls", seconds)
+
+
+def benchmark_depth():
+    print("depth: a non-tail recursion; evaluate() needs a raised recursion limit")
+    code = """
+        function count(n) {
+            if (n == 0) { return 0 };
+            return 1 + count(n - 1)
+        };
+        count(DEPTH)
+    """
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(200_000)
+    try:
+        for depth in [10_000, 100_000]:
+            ast = parse(tokenize(code.replace("DEPTH", str(depth))))
+            for backend in ["evaluate", "stack", "vm"]:
+                if backend == "evaluate" and depth > 10_000:
+                    continue
+                (result, _), seconds = timed(backends[backend], ast, {})
+                assert result == depth
+                report(f"{backend}, depth {depth:,}", depth, "calls", seconds)
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+templated_program = """
+    i = 0;
+    total = 0;
+    while (i < 50000) {
+        total = total + i * (60 * 60 * 24) - (2 * 3 + 4) / 5;
+        if (1 > 2) { total = 0 };
+        label = "record" + "-" + "total";
+        i = i + 1
+    };
+    total
+"""
+
+
+def benchmark_fold():
+    print("fold: seconds to run a loop full of literal arithmetic, as parsed and optimized")
+    ast = parse(tokenize(templated_program))
+    optimized, removed = optimize(ast)
+    print(f"  optimizer removed {removed} nodes")
+    for backend in ["evaluate", "closures", "vm"]:
+        (before, _), before_seconds = timed(backends[backend], ast, {})
+        (after, _), after_seconds = timed(backends[backend], optimized, {})
+        assert before == after
+        print(f"  {backend:<10} {before_seconds:.3f}s -> {after_seconds:.3f}s")
+
+
+invariant_program = """
+    items = [3, 1, 4, 1, 5, 9, 2, 6];
+    width = 40;
+    scale = 3;
+    i = 0;
+    total = 0;
+    while (i < width * scale * 1000 + scale) {
+        total = total + (width * width - scale) / 2 + i * (scale + 1);
+        i = i + 1
+    };
+    total
+"""
+
+
+def benchmark_hoist():
+    print("hoist: seconds to run a loop with invariant expressions, as parsed and hoisted")
+    ast = parse(tokenize(invariant_program))
+    hoisted, count = hoist_invariants(ast)
+    print(f"  {count} expressions hoisted")
+    for backend in ["evaluate", "closures", "vm"]:
+        (before, _), before_seconds = timed(backends[backend], ast, {})
+        (after, _), after_seconds = timed(backends[backend], hoisted, {})
+        assert before == after
+        print(f"  {backend:<10} {before_seconds:.3f}s -> {after_seconds:.3f}s")
+
+
+def benchmark_memo():
+    print("memo: seconds for fib(n), plain and as a memo function")
+    code = """
+        FUNCTION fib(n) {
+            if (n < 2) { return n };
+            return fib(n - 1) + fib(n - 2)
+        };
+        fib(N)
+    """
+    for n in [15, 20, 25]:
+        line = f"  fib({n})"
+        for label, keyword in [("plain", "function"), ("memo", "memo function")]:
+            ast = parse(tokenize(code.replace("FUNCTION", keyword).replace("N)", f"{n})")))
+            evaluator.memo_cache = evaluator.MemoCache()
+            _, seconds = timed(evaluate, ast, {})
+            line += f"  {label} {seconds:.4f}s"
+        print(line, evaluator.memo_cache.statistics())
+
+
+def benchmark_startup():
+    source = sample_program(2_000_000)
+    print(f"startup: seconds to get the AST of {len(source):,} characters, and to run runner.py")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.t")
+        with open(path, "w") as f:
+            f.write(source)
+        _, parse_seconds = timed(lambda: parse(tokenize_stream(source)))
+        _, cold_seconds = timed(ast_cache.parse_file, path, source)
+        _, warm_seconds = timed(ast_cache.parse_file, path, source)
+        compiled = program_file.dumps(parse(tokenize_stream(source)))
+        _, compiled_seconds = timed(program_file.loads, compiled)
+        print(
+            f"  parse {parse_seconds:.3f}s  cold cache {cold_seconds:.3f}s  warm cache {warm_seconds:.3f}s"
+            f"  compiled {compiled_seconds:.3f}s ({len(compiled):,} bytes)"
+        )
+        # the whole command, runner and modules included; the program only defines things
+        with open(path, "w") as f:
+            f.write(source.replace("print total(data, 2) / 4", "data"))
+        compiled_path = program_file.compile_file(path)
+        runner = os.path.join(os.path.dirname(os.path.abspath(__file__)), "runner.py")
+        for label, options in [
+            ("--no-cache", ["--no-cache", path]),
+            ("cold", [path]),
+            ("warm", [path]),
+            ("compiled", [compiled_path]),
+        ]:
+            command = [sys.executable, runner, *options]
+            _, seconds = timed(lambda: subprocess.run(command, check=True))
+            print(f"  runner.py {label:<12} {seconds:.3f}s")
+
+
+index_program = """
+    x = [0, 0, 0, 0, 0, 0, 0, 0, 0, 0];
+    i = 0;
+    while (i < 100000) {
+        x[3] = x[3] + 1;
+        x[7] = x[3] - x[7];
+        i = i + 1
+    };
+    x[3]
+"""
+
+
+def benchmark_trace():
+    print("trace: evaluate() of a loop of list reads and writes, with tracing off and on")
+    ast = parse(tokenize(index_program))
+    (result, _), seconds = timed(evaluate, ast, {})
+    report("off", 100_000, "iterations", seconds)
+    saved = tracing.output
+    for level in [1, 2]:
+        tracing.output = io.StringIO()
+        tracing.enable("index", level)
+        tracing.enable("assign", level)
+        try:
+            (traced_result, _), seconds = timed(evaluate, ast, {})
+        finally:
+            tracing.disable("index")
+            tracing.disable("assign")
+            tracing.output = saved
+        assert traced_result == result
+        report(f"level {level}", 100_000, "iterations", seconds)
+
+
+counted_loops = {
+    "while": "s = 0; i = 0; while (i < n) { s = s + i; i = i + 1 }; s",
+    "for (;;)": "s = 0; for (i = 0; i < n; i = i + 1) { s = s + i }; s",
+    "for in range": "s = 0; for i in range(n) { s = s + i }; s",
+}
+
+
+def benchmark_loops(count=300_000):
+    print(f"loops: seconds to sum {count:,} counters, per loop form and backend")
+    for form, code in counted_loops.items():
+        ast = parse(tokenize(code))
+        line = f"  {form:<14}"
+        for backend, run in backends.items():
+            (result, _), seconds = timed(run, ast, {"n": count})
+            assert result == count * (count - 1) // 2
+            line += f" {backend} {seconds:.3f}s "
+        print(line)
+
+
+class PrintSink:
+    """Prints the way the backends did before output sinks, for comparison."""
+
+    def write_value(self, value):
+        print(value)
+        return str(value) + "\n"
+
+
+def benchmark_print(count=10_000_000):
+    print(f"print: closure-compiled loop printing {count:,} lines to a file")
+    ast = parse(tokenize(f"i = 0; while (i < {count}) {{ print i; i = i + 1 }}"))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "output.txt")
+        for label, make_sink in [
+            ("print()", lambda file: PrintSink()),
+            ("sink, unbuffered", lambda file: sink.OutputSink(file)),
+            ("sink, 64 kB buffer", lambda file: sink.OutputSink(file, 1 << 16, keep_text=False)),
+        ]:
+            saved = sink.output
+            with open(path, "w") as file, contextlib.redirect_stdout(file):
+                sink.output = make_sink(file)
+                try:
+                    _, seconds = timed(run_closures, ast, {})
+                    if hasattr(sink.output, "flush"):
+                        sink.output.flush()
+                finally:
+                    sink.output = saved
+            assert os.path.getsize(path) == sum(len(f"{i}\n") for i in range(count))
+            report(label, count, "lines", seconds)
+
+
+field_loop = """
+p = {"x": 0, "y": 1, "z": 2};
+q = {"y": 1, "x": 0};
+for i in range(n) { p.x = p.x + p.y; q.x = q.x + p.z }
+"""
+
+
+def benchmark_fields(count=300_000, objects=100_000):
+    print(f"fields: {count:,} iterations of a loop of field reads and writes, per backend")
+    ast = parse(tokenize(field_loop))
+    for backend, run in backends.items():
+        environment = {"n": count}
+        _, seconds = timed(run, ast, environment)
+        assert environment["p"]["x"] == count and environment["q"]["x"] == 2 * count
+        report(backend, count, "iterations", seconds)
+    print(f"fields: memory of {objects:,} objects of three fields")
+
+    def build(make):
+        return [make(i) for i in range(objects)]
+
+    def shaped(i):
+        object = Object()
+        object["x"], object["y"], object["z"] = i, i, i
+        return object
+
+    for label, make in [("dict", lambda i: {"x": i, "y": i, "z": i}), ("Object", shaped)]:
+        _, size = retained_memory(build, make)
+        print(f"  {label:<24} {size / objects:>6.0f} bytes per object")
+
+
+numeric_buffers = """
+x = [0] * n;
+y = [0.0] * n;
+for i in range(n) { x[i] = i * 7; y[i] = i * 0.5 };
+s = 0;
+for i in range(n) { s = s + x[i] + y[i] };
+s
+"""
+
+
+def benchmark_lists(count=200_000):
+    print(f"lists: fill and sum an int and a float list of {count:,} items, per storage")
+    ast = parse(tokenize(numeric_buffers))
+    typed_storage = lists.storage
+    for label, storage in [("Python lists", lambda values: values), ("arrays", typed_storage)]:
+        lists.storage = storage
+        try:
+            for backend, run in backends.items():
+                environment = {"n": count}
+                (result, _), seconds = timed(run, ast, environment)
+                assert result == 7.5 * count * (count - 1) / 2
+                report(f"{label}, {backend}", count, "items", seconds)
+            environment = {"n": count}
+            _, size = retained_memory(run_closures, ast, environment)
+            print(f"  {label + ', memory':<24} {size / count:>14.1f} bytes/item pair")
+        finally:
+            lists.storage = typed_storage
+
+
+def benchmark_dispatch():
+    print("dispatch: nanoseconds per evaluate() of a minimal node of each tag")
+    number = {"tag": "number", "value": 1}
+    nodes = {
+        "number": number,
+        "+": {"tag": "+", "left": number, "right": number},
+        "!=": {"tag": "!=", "left": number, "right": number},
+        "if": {"tag": "if", "condition": {"tag": "number", "value": 0}, "then": number},
+        "while": {"tag": "while", "condition": {"tag": "number", "value": 0}, "do": number},
+        "function": {"tag": "function", "parameters": [], "body": number},
+        "assign": {"tag": "assign", "target": {"tag": "identifier", "value": "x"}, "value": number},
+        "return": {"tag": "return", "value": number},
+    }
+
+    def nanoseconds(node, count=200_000):
+        _, seconds = timed(lambda: [evaluate(node, {}) for _ in range(count)])
+        return seconds / count * 1e9
+
+    full = {tag: nanoseconds(node) for tag, node in nodes.items()}
+    # with every handler replaced by a no-op only the dispatch itself is left
+    handlers = evaluator.evaluators
+    evaluator.evaluators = {tag: lambda ast, environment: None for tag in handlers}
+    try:
+        dispatch = {tag: nanoseconds(node) for tag, node in nodes.items()}
+    finally:
+        evaluator.evaluators = handlers
+    for tag in nodes:
+        print(f"  {tag:<10} node {full[tag]:>6.0f} ns   dispatch {dispatch[tag]:>4.0f} ns")
+
+
+benchmarks = {
+    "tokenize": benchmark_tokenize,
+    "keywords": benchmark_keywords,
+    "stream": benchmark_stream,
+    "tokens": benchmark_tokens,
+    "parse": benchmark_parse,
+    "expressions": benchmark_expressions,
+    "backends": benchmark_backends,
+    "lookup": benchmark_lookup,
+    "guards": benchmark_guards,
+    "returns": benchmark_returns,
+    "tailcalls": benchmark_tail_calls,
+    "depth": benchmark_depth,
+    "fold": benchmark_fold,
+    "hoist": benchmark_hoist,
+    "memo": benchmark_memo,
+    "startup": benchmark_startup,
+    "trace": benchmark_trace,
+    "loops": benchmark_loops,
+    "print": benchmark_print,
+    "fields": benchmark_fields,
+    "lists": benchmark_lists,
+    "dispatch": benchmark_dispatch,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or benchmarks:
+        benchmarks[name]()
@@ -0,0 +1,644 @@
+from resolver import UNBOUND, resolve, top_frame, call_frame, lookup_unbound
+from memo import check_pure
+from evaluator import binary_operations, check_range, index_value
+import sink
+from objects import Object, Site, is_object, load_field, store_field
+from lists import List, make_list, store_item
+
+# Compiles an AST once into nested Python closures, so running a node is a
+# plain call instead of a dispatch on its tag. Each compiled node takes the
+# current frame and returns its value; a return statement's value is wrapped
+# in Return so enclosing statement lists, ifs and whiles can pass it up to the
+# call. Locals are read from frame slots at the address resolver.py gives
+# them and globals from the environment, by name.
+
+
+class Return:
+    __slots__ = ("value",)
+
+    def __init__(self, value):
+        self.value = value
+
+
+# break and continue are passed up to their loop as these two returns
+BREAK = Return(None)
+CONTINUE = Return(None)
+
+
+class Function:
+    """A function value: its parameter and local names, compiled body, source AST
+    and the frame it was defined in."""
+
+    __slots__ = ("parameters", "slots", "body", "ast", "frame")
+
+    def __init__(self, parameters, slots, body, ast, frame):
+        self.parameters = parameters
+        self.slots = slots
+        self.body = body
+        self.ast = ast
+        self.frame = frame
+
+    def __repr__(self):
+        return f"<function ({', '.join(self.parameters)})>"
+
+
+def compile(ast):
+    """Compiles a program, resolving its variables to frame slots first."""
+    program = compile_node(resolve(ast))
+    temporaries = ast.get("temporaries")
+    if not temporaries:
+        return program
+
+    def program_with_temporaries(frame):
+        # the optimizer's $invariant variables go when the program does, however it ends
+        try:
+            return program(frame)
+        finally:
+            for name in temporaries:
+                frame.globals.pop(name, None)
+
+    return program_with_temporaries
+
+
+def compile_node(ast):
+    return compilers[ast["tag"]](ast)
+
+
+def execute(compiled, environment):
+    value = compiled(top_frame(environment))
+    if value.__class__ is Return:
+        return value.value, True
+    return value, False
+
+
+def compile_constant(ast):
+    value = ast["value"]
+    if ast["tag"] == "number":
+        assert type(value) in [float, int], f"unexpected type {type(value)}"
+    if ast["tag"] == "string":
+        assert type(value) == str, f"unexpected type {type(value)}"
+
+    def constant(frame):
+        return value
+
+    return constant
+
+
+def compile_list(ast):
+    items = [compile_node(item) for item in ast["items"]]
+
+    def list_literal(frame):
+        return make_list([item(frame) for item in items])
+
+    return list_literal
+
+
+def compile_object(ast):
+    items = [(compile_node(item["key"]), compile_node(item["value"])) for item in ast["items"]]
+
+    def object_literal(frame):
+        object = Object()
+        for key, value in items:
+            key = key(frame)
+            assert type(key) is str, "Object key must be a string"
+            object[key] = value(frame)
+        return object
+
+    return object_literal
+
+
+def compile_identifier(ast):
+    identifier = ast["value"]
+    if "slot" not in ast:
+
+        def global_variable(frame):
+            environment = frame.globals
+            while identifier not in environment:
+                assert "$parent" in environment, f"Unknown identifier: '{identifier}'."
+                environment = environment["$parent"]
+            return environment[identifier]
+
+        return global_variable
+
+    depth = ast["depth"]
+    slot = ast["slot"]
+    if depth == 0:
+
+        def local_variable(frame):
+            value = frame.values[slot]
+            if value is UNBOUND:
+                return lookup_unbound(frame, slot)
+            return value
+
+        return local_variable
+
+    def outer_variable(frame):
+        for _ in range(depth):
+            frame = frame.parent
+        value = frame.values[slot]
+        if value is UNBOUND:
+            return lookup_unbound(frame, slot)
+        return value
+
+    return outer_variable
+
+
+def compile_binary(ast):
+    operation = binary_operations[ast["tag"]]
+    left = compile_node(ast["left"])
+    right = compile_node(ast["right"])
+
+    def binary(frame):
+        return operation(left(frame), right(frame))
+
+    return binary
+
+
+def compile_add(ast):
+    left = compile_node(ast["left"])
+    right = compile_node(ast["right"])
+
+    def add(frame):
+        return left(frame) + right(frame)
+
+    return add
+
+
+def compile_and(ast):
+    left = compile_node(ast["left"])
+    right = compile_node(ast["right"])
+
+    def and_(frame):
+        return left(frame) and right(frame)
+
+    return and_
+
+
+def compile_or(ast):
+    left = compile_node(ast["left"])
+    right = compile_node(ast["right"])
+
+    def or_(frame):
+        return left(frame) or right(frame)
+
+    return or_
+
+
+def compile_divide(ast):
+    left = compile_node(ast["left"])
+    right = compile_node(ast["right"])
+
+    def divide(frame):
+        left_value = left(frame)
+        right_value = right(frame)
+        assert right_value != 0, "Division by zero"
+        return left_value / right_value
+
+    return divide
+
+
+def compile_negate(ast):
+    value = compile_node(ast["value"])
+
+    def negate(frame):
+        return -value(frame)
+
+    return negate
+
+
+def compile_not(ast):
+    value = compile_node(ast["value"])
+
+    def not_(frame):
+        return not value(frame)
+
+    return not_
+
+
+def compile_print(ast):
+    if not ast["value"]:
+
+        def print_newline(frame):
+            return sink.output.write_newline()
+
+        return print_newline
+
+    value = compile_node(ast["value"])
+
+    def print_value(frame):
+        return sink.output.write_value(value(frame))
+
+    return print_value
+
+
+def compile_if(ast):
+    condition = compile_node(ast["condition"])
+    then = compile_node(ast["then"])
+    otherwise = compile_node(ast["else"]) if "else" in ast else None
+
+    def if_statement(frame):
+        if condition(frame):
+            value = then(frame)
+        elif otherwise:
+            value = otherwise(frame)
+        else:
+            return None
+        if value.__class__ is Return:
+            return value
+        return None
+
+    return if_statement
+
+
+def compile_while(ast):
+    condition = compile_node(ast["condition"])
+    do = compile_node(ast["do"])
+
+    def while_statement(frame):
+        while condition(frame):
+            value = do(frame)
+            if value.__class__ is Return:
+                if value is BREAK:
+                    break
+                if value is not CONTINUE:
+                    return value
+        return None
+
+    return while_statement
+
+
+def compile_for(ast):
+    initial = compile_node(ast["initial"]) if ast["initial"] else None
+    condition = compile_node(ast["condition"]) if ast["condition"] else None
+    step = compile_node(ast["step"]) if ast["step"] else None
+    do = compile_node(ast["do"])
+
+    def for_statement(frame):
+        if initial:
+            initial(frame)
+        while condition is None or condition(frame):
+            value = do(frame)
+            if value.__class__ is Return:
+                if value is BREAK:
+                    break
+                if value is not CONTINUE:
+                    return value
+            if step:
+                step(frame)
+        return None
+
+    return for_statement
+
+
+def compile_for_range(ast):
+    start = compile_node(ast["start"])
+    stop = compile_node(ast["stop"])
+    variable = ast["variable"]
+    do = compile_node(ast["do"])
+
+    def for_range_statement(frame):
+        first = start(frame)
+        last = stop(frame)
+        check_range(first, last)
+        # the variable is a local slot or a global, like an assignment's target
+        if "slot" in variable:
+            variables, key = frame.values, variable["slot"]
+        else:
+            variables, key = frame.globals, variable["value"]
+        for counter in range(first, last):
+            variables[key] = counter
+            value = do(frame)
+            if value.__class__ is Return:
+                if value is BREAK:
+                    break
+                if value is not CONTINUE:
+                    return value
+        return None
+
+    return for_range_statement
+
+
+def compile_break(ast):
+    def break_statement(frame):
+        return BREAK
+
+    return break_statement
+
+
+def compile_continue(ast):
+    def continue_statement(frame):
+        return CONTINUE
+
+    return continue_statement
+
+
+def compile_statement_list(ast):
+    statements = [compile_node(statement) for statement in ast["statements"]]
+
+    def statement_list(frame):
+        value = None
+        for statement in statements:
+            value = statement(frame)
+            if value.__class__ is Return:
+                return value
+        return value
+
+    return statement_list
+
+
+def compile_function(ast):
+    # memo functions run uncached here, but are held to the same rules
+    if "memo" in ast:
+        check_pure(ast)
+    parameters = [parameter["value"] for parameter in ast["parameters"]]
+    slots = ast["slots"]
+    body = compile_node(ast["body"])
+
+    def function_literal(frame):
+        return Function(parameters, slots, body, ast, frame)
+
+    return function_literal
+
+
+def compile_call(ast):
+    function = compile_node(ast["function"])
+    arguments = [compile_node(argument) for argument in ast["arguments"]]
+
+    def call(frame):
+        callee = function(frame)
+        assert type(callee) is Function, f"{callee} is not a function"
+        values = [argument(frame) for argument in arguments]
+        value = callee.body(call_frame(callee.parameters, callee.slots, values, callee.frame))
+        if value.__class__ is Return:
+            return value.value
+        return None
+
+    return call
+
+
+def compile_complex(ast):
+    base = compile_node(ast["base"])
+    if ast["index"]["tag"] == "string":
+        # x.name and x["name"]: the index is known to be a string, and the
+        # site caches where the last object read here kept the field
+        site = Site(ast["index"]["value"])
+
+        def field(frame):
+            object = base(frame)
+            if object.__class__ is Object and object.shape is site.shape:
+                return object.values[site.slot]
+            return load_field(object, site)
+
+        return field
+
+    index = compile_node(ast["index"])
+
+    def complex_expression(frame):
+        return index_value(base(frame), index(frame))
+
+    return complex_expression
+
+
+def compile_assign(ast):
+    target = ast["target"]
+    value = compile_node(ast["value"])
+    if target["tag"] == "identifier":
+        identifier = target["value"]
+        if "slot" not in target:
+
+            def assign_global(frame):
+                frame.globals[identifier] = value(frame)
+                return None
+
+            return assign_global
+
+        # assignment always binds in the current function, at depth 0
+        slot = target["slot"]
+
+        def assign_local(frame):
+            frame.values[slot] = value(frame)
+            return None
+
+        return assign_local
+
+    assert target["tag"] == "complex", f"Unknown target type in assignment. {target}"
+    base = compile_node(target["base"])
+    if target["index"]["tag"] == "string":
+        site = Site(target["index"]["value"])
+
+        def assign_field(frame):
+            target_base = base(frame)
+            # as in evaluate(), the value runs only once the base is known to be an object
+            if target_base.__class__ is not Object:
+                assert is_object(target_base)
+            target_value = value(frame)
+            if target_base.__class__ is Object and target_base.shape is site.shape:
+                target_base.values[site.slot] = target_value
+            else:
+                store_field(target_base, site, target_value)
+            return None
+
+        return assign_field
+
+    index = compile_node(target["index"])
+
+    def assign_complex(frame):
+        target_base = base(frame)
+        target_index = index(frame)
+        assert type(target_index) in [int, float, str], f"Unknown index type [{target_index}]"
+        if type(target_index) in [int, float]:
+            assert int(target_index) == target_index
+            if target_base.__class__ is List:
+                assert len(target_base.items) > target_index
+                target_value = value(frame)
+                # the value may have changed the storage
+                items = target_base.items
+                if items.__class__ is list:
+                    items[target_index] = target_value
+                else:
+                    store_item(target_base, target_index, target_value)
+                return None
+            assert type(target_base) == list
+            assert len(target_base) > target_index
+        else:
+            assert is_object(target_base)
+        target_base[target_index] = value(frame)
+        return None
+
+    return assign_complex
+
+
+def compile_return(ast):
+    if "value" not in ast:
+
+        def return_nothing(frame):
+            return Return(None)
+
+        return return_nothing
+
+    value = compile_node(ast["value"])
+
+    def return_value(frame):
+        return Return(value(frame))
+
+    return return_value
+
+
+compilers = {
+    "number": compile_constant,
+    "string": compile_constant,
+    "boolean": compile_constant,
+    "list": compile_list,
+    "object": compile_object,
+    "identifier": compile_identifier,
+    "+": compile_add,
+    "-": compile_binary,
+    "*": compile_binary,
+    "/": compile_divide,
+    "negate": compile_negate,
+    "&&": compile_and,
+    "||": compile_or,
+    "!": compile_not,
+    "not": compile_not,
+    "<": compile_binary,
+    ">": compile_binary,
+    "<=": compile_binary,
+    ">=": compile_binary,
+    "==": compile_binary,
+    "!=": compile_binary,
+    "print": compile_print,
+    "if": compile_if,
+    "while": compile_while,
+    "for": compile_for,
+    "for_range": compile_for_range,
+    "break": compile_break,
+    "continue": compile_continue,
+    "statement_list": compile_statement_list,
+    "program": compile_statement_list,
+    "function": compile_function,
+    "call": compile_call,
+    "complex": compile_complex,
+    "assign": compile_assign,
+    "return": compile_return,
+}
+
+
+def run(ast, environment):
+    return execute(compile(ast), environment)
+
+
+def test_compile_expressions():
+    print("testing compile expressions...")
+    from differential import check_same_as_evaluate
+
+    for code in [
+        "4",
+        "4.2",
+        '"x"',
+        "1+2*3-4/2",
+        "(3+2)*2",
+        "--3",
+        "1<2",
+        "2<=2",
+        "3>4",
+        "3>=4",
+        "1==1",
+        "1!=1",
+        "1&&0",
+        "0||2",
+        "!0",
+        "true",
+        "[1,2,[3]]",
+        '{"a":1,"b":[2]}',
+        "{}",
+        "X+Y",
+        "y",
+    ]:
+        check_same_as_evaluate(run, code, {"X": 1, "Y": 2, "$parent": {"y": 3}})
+
+
+def test_compile_statements():
+    print("testing compile statements...")
+    from differential import check_same_as_evaluate
+
+    for code in [
+        "print",
+        "print 1+1",
+        "if(1) {x=1} else {x=2}",
+        "if(0) {x=1} else {x=2}",
+        "if(0) {x=1}",
+        "x=1; while(x<5) {x=x+1}; y=3",
+        "x=x+1",
+        "y=[1,2,3]; y[1]=4; z={}; z[\"a\"]=y[1]; w=z.a",
+    ]:
+        check_same_as_evaluate(run, code, {"x": 0, "$parent": {"x": 3}})
+
+
+def test_compile_functions():
+    print("testing compile functions...")
+    from tokenizer import tokenize
+    from parser import parse
+    from differential import check_same_as_evaluate
+
+    assert check_same_as_evaluate(run, "function f() {return(1234)}; f()") == (1234, False)
+    assert check_same_as_evaluate(run, "function f() { return }; f()") == (None, False)
+    assert check_same_as_evaluate(run, "function f() { 3 }; f()") == (None, False)
+    code = """
+        function f(x) {
+            if (x > 1) {
+                return 123
+            };
+            return 2+2
+        };
+        f(7) + f(0)
+    """
+    assert check_same_as_evaluate(run, code) == (127, False)
+    code = """
+        function fib(n) {
+            if (n < 2) { return n };
+            return fib(n - 1) + fib(n - 2)
+        };
+        fib(15)
+    """
+    assert check_same_as_evaluate(run, code) == (610, False)
+    # functions see the variables where they were defined, not their caller's
+    code = "y = 1; function g() { return y }; function f(y) { return g() }; f(5)"
+    assert run(parse(tokenize(code)), {}) == (1, False)
+    code = "function adder(n) { return function(x) { return x + n } }; add2 = adder(2); add2(3)"
+    assert run(parse(tokenize(code)), {}) == (5, False)
+    assert check_same_as_evaluate(run, "return 3; 4") == (3, True)
+
+
+def test_compile_same_as_evaluate():
+    print("testing compile same as evaluate...")
+    from differential import check_programs
+
+    check_programs(run)
+
+
+def test_compile_errors():
+    print("testing compile errors...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    for code, message in [
+        ("x", "Unknown identifier"),
+        ("1/0", "Division by zero"),
+        ("x=[1]; x[3]", ""),
+        ('x=[1]; x["a"]', ""),
+    ]:
+        try:
+            execute(compile(parse(tokenize(code))), {})
+            assert False, f"Should have an error for {code}"
+        except AssertionError as e:
+            assert message in str(e), f"got {e} for {code}"
+            assert "Should have" not in str(e)
+
+
+if __name__ == "__main__":
+    test_compile_expressions()
+    test_compile_statements()
+    test_compile_functions()
+    test_compile_errors()
+    test_compile_same_as_evaluate()
+    print("done.")
@@ -0,0 +1,593 @@
+from resolver import resolve
+from memo import check_pure
+from objects import Site
+
+# Compiles an AST to bytecode for vm.py.
+#
+# A Code object holds a flat list of integers, two per instruction: an opcode
+# and its argument (0 when unused). Constants, identifier names and the inline
+# caches of field accesses (see objects.py) are kept in side tables and
+# referred to by index. Jump arguments are instruction offsets
+# into the list. The program and every function literal get their own Code.
+#
+# Identifiers are resolved first (see resolver.py): locals are read and written
+# by slot in the current frame, or by (depth, slot) in the frame of an
+# enclosing function, and only globals are looked up by name.
+
+LOAD_NAME = 0  # push the value of the global names[argument]
+LOAD_CONST = 1  # push constants[argument]
+STORE_NAME = 2  # pop a value into the global names[argument]
+ADD = 3  # pop right, pop left, push left + right (likewise up to NOT_EQUAL)
+SUBTRACT = 4
+MULTIPLY = 5
+DIVIDE = 6
+LESS = 7
+GREATER = 8
+LESS_EQUAL = 9
+GREATER_EQUAL = 10
+EQUAL = 11
+NOT_EQUAL = 12
+JUMP_IF_FALSE_OR_POP = 13  # jump to argument if the top value is false, else pop it
+JUMP_IF_TRUE_OR_POP = 14  # jump to argument if the top value is true, else pop it
+JUMP_IF_FALSE = 15  # pop a value, jump to argument if it is false
+JUMP = 16  # jump to argument
+POP = 17  # discard the top of the stack
+CALL = 18  # pop argument values and a function, and call it
+RETURN = 19  # pop a value and return it from the current function
+LOAD_FIELD = 20  # pop an object, push its field sites[argument].key
+INDEX = 21  # pop index, pop base, push base[index]
+STORE_INDEX = 22  # pop value, pop index, pop base, set base[index] = value (see CHECK_TARGET)
+NEGATE = 23  # replace the top of the stack with its negation
+NOT = 24  # replace the top of the stack with its logical not
+BUILD_LIST = 25  # pop argument values, push a list of them
+BUILD_OBJECT = 26  # pop argument key/value pairs, push an object of them
+PRINT = 27  # pop a value and print it (no value if argument is 0), push the text or None
+HALT = 28  # pop a value and stop, returning it as the program's value
+LOAD_LOCAL = 29  # push the value of slot argument of the current frame
+STORE_LOCAL = 30  # pop a value into slot argument of the current frame
+LOAD_OUTER = 31  # push the value at the (depth, slot) of addresses[argument]
+MAKE_FUNCTION = 32  # push a function of the code constants[argument] and the current frame
+GET_RANGE = 33  # pop stop, pop start, push an iterator over range(start, stop)
+FOR_ITER = 34  # push the next value of the iterator on top, or pop it and jump to argument
+STORE_FIELD = 35  # pop value, pop an object, set its field sites[argument].key = value
+CHECK_FUNCTION = 36  # fail unless the top value is a function, leaving it there
+CHECK_TARGET = 37  # fail unless index (on top) of base (below it) can be stored to, leaving both
+CHECK_OBJECT = 38  # fail unless the top value is an object, leaving it there
+
+opcode_names = {
+    value: name for name, value in list(globals().items()) if name.isupper()
+}
+
+binary_opcodes = {
+    "+": ADD,
+    "-": SUBTRACT,
+    "*": MULTIPLY,
+    "/": DIVIDE,
+    "<": LESS,
+    ">": GREATER,
+    "<=": LESS_EQUAL,
+    ">=": GREATER_EQUAL,
+    "==": EQUAL,
+    "!=": NOT_EQUAL,
+}
+
+# && and || leave their left value when it decides the result, skipping the right
+short_circuit_opcodes = {
+    "&&": JUMP_IF_FALSE_OR_POP,
+    "||": JUMP_IF_TRUE_OR_POP,
+}
+
+
+class Code:
+    """Instructions with their constant, name, address and site tables; for a
+    function body also its parameter and local names."""
+
+    def __init__(self, parameters=(), slots=()):
+        self.instructions = []
+        self.constants = []
+        self.names = []
+        self.addresses = []
+        # one per field access, since each caches what it last saw
+        self.sites = []
+        self.parameters = list(parameters)
+        self.slots = list(slots)
+        # for each loop being compiled, its break and continue jumps to patch
+        self.loops = []
+        self.temporaries = []
+
+    def emit(self, opcode, argument=0):
+        self.instructions += [opcode, argument]
+        return len(self.instructions) - 2
+
+    def here(self):
+        return len(self.instructions)
+
+    def patch(self, instruction, target):
+        """Points the jump at `instruction` to `target`."""
+        self.instructions[instruction + 1] = target
+
+    def constant(self, value):
+        for index, constant in enumerate(self.constants):
+            if type(constant) is type(value) and constant == value:
+                return index
+        self.constants.append(value)
+        return len(self.constants) - 1
+
+    def name(self, identifier):
+        if identifier not in self.names:
+            self.names.append(identifier)
+        return self.names.index(identifier)
+
+    def site(self, key):
+        self.sites.append(Site(key))
+        return len(self.sites) - 1
+
+    def address(self, depth, slot):
+        if (depth, slot) not in self.addresses:
+            self.addresses.append((depth, slot))
+        return self.addresses.index((depth, slot))
+
+
+class Function:
+    """A function value: its compiled body and the frame it was defined in."""
+
+    __slots__ = ("code", "frame")
+
+    def __init__(self, code, frame):
+        self.code = code
+        self.frame = frame
+
+    def __repr__(self):
+        return f"<function ({', '.join(self.code.parameters)})>"
+
+
+def compile(ast):
+    """Compiles a program; running it leaves the last statement's value."""
+    code = Code()
+    # the optimizer's $invariant globals, which execute() removes when the program ends
+    code.temporaries = list(ast.get("temporaries", ()))
+    compile_statement(resolve(ast), code, keep_value=True)
+    code.emit(HALT)
+    return code
+
+
+# STATEMENTS
+
+# Statements are compiled for effect, leaving the stack as it was, except for
+# the last statement of the program, whose value is the program's value.
+
+
+def compile_statement(ast, code, keep_value=False):
+    tag = ast["tag"]
+    if tag in ["program", "statement_list"]:
+        statements = ast["statements"]
+        for index, statement in enumerate(statements):
+            compile_statement(statement, code, keep_value and index == len(statements) - 1)
+        if keep_value and not statements:
+            code.emit(LOAD_CONST, code.constant(None))
+    elif tag == "assign":
+        compile_assign(ast, code)
+        if keep_value:
+            code.emit(LOAD_CONST, code.constant(None))
+    elif tag == "if":
+        compile_if(ast, code)
+        if keep_value:
+            code.emit(LOAD_CONST, code.constant(None))
+    elif tag == "while":
+        start = code.here()
+        compile_expression(ast["condition"], code)
+        exit_jump = code.emit(JUMP_IF_FALSE)
+        breaks, continues = compile_loop_body(ast["do"], code)
+        code.emit(JUMP, start)
+        for jump in [exit_jump] + breaks:
+            code.patch(jump, code.here())
+        for jump in continues:
+            code.patch(jump, start)
+        if keep_value:
+            code.emit(LOAD_CONST, code.constant(None))
+    elif tag == "for":
+        compile_for(ast, code)
+        if keep_value:
+            code.emit(LOAD_CONST, code.constant(None))
+    elif tag == "for_range":
+        compile_for_range(ast, code)
+        if keep_value:
+            code.emit(LOAD_CONST, code.constant(None))
+    elif tag == "break":
+        code.loops[-1][0].append(code.emit(JUMP))
+    elif tag == "continue":
+        code.loops[-1][1].append(code.emit(JUMP))
+    elif tag == "return":
+        if "value" in ast:
+            compile_expression(ast["value"], code)
+        else:
+            code.emit(LOAD_CONST, code.constant(None))
+        code.emit(RETURN)
+    elif tag == "print":
+        if ast["value"]:
+            compile_expression(ast["value"], code)
+        code.emit(PRINT, 1 if ast["value"] else 0)
+        if not keep_value:
+            code.emit(POP)
+    else:
+        compile_expression(ast, code)
+        if not keep_value:
+            code.emit(POP)
+
+
+def compile_if(ast, code):
+    compile_expression(ast["condition"], code)
+    else_jump = code.emit(JUMP_IF_FALSE)
+    compile_statement(ast["then"], code)
+    if "else" in ast:
+        end_jump = code.emit(JUMP)
+        code.patch(else_jump, code.here())
+        compile_statement(ast["else"], code)
+        code.patch(end_jump, code.here())
+    else:
+        code.patch(else_jump, code.here())
+
+
+def compile_loop_body(body, code):
+    """Compiles a loop's body; returns its break and continue jumps, for the loop to patch."""
+    code.loops.append(([], []))
+    compile_statement(body, code)
+    return code.loops.pop()
+
+
+def compile_for(ast, code):
+    if ast["initial"]:
+        compile_statement(ast["initial"], code)
+    start = code.here()
+    exits = []
+    if ast["condition"]:
+        compile_expression(ast["condition"], code)
+        exits.append(code.emit(JUMP_IF_FALSE))
+    breaks, continues = compile_loop_body(ast["do"], code)
+    for jump in continues:
+        code.patch(jump, code.here())
+    if ast["step"]:
+        compile_statement(ast["step"], code)
+    code.emit(JUMP, start)
+    for jump in exits + breaks:
+        code.patch(jump, code.here())
+
+
+def compile_for_range(ast, code):
+    # the range iterator stays on the stack while the loop runs
+    compile_expression(ast["start"], code)
+    compile_expression(ast["stop"], code)
+    code.emit(GET_RANGE)
+    start = code.here()
+    exit_jump = code.emit(FOR_ITER)
+    variable = ast["variable"]
+    if "slot" in variable:
+        code.emit(STORE_LOCAL, variable["slot"])
+    else:
+        code.emit(STORE_NAME, code.name(variable["value"]))
+    breaks, continues = compile_loop_body(ast["do"], code)
+    code.emit(JUMP, start)
+    for jump in continues:
+        code.patch(jump, start)
+    if breaks:
+        # a break leaves the iterator behind; FOR_ITER pops it when it is done
+        for jump in breaks:
+            code.patch(jump, code.here())
+        code.emit(POP)
+    code.patch(exit_jump, code.here())
+
+
+def compile_assign(ast, code):
+    target = ast["target"]
+    if target["tag"] == "identifier":
+        compile_expression(ast["value"], code)
+        if "slot" in target:
+            # assignment always binds in the current function, at depth 0
+            code.emit(STORE_LOCAL, target["slot"])
+        else:
+            code.emit(STORE_NAME, code.name(target["value"]))
+    elif target["tag"] == "complex" and target["index"]["tag"] == "string":
+        compile_expression(target["base"], code)
+        # as in evaluate(), a value that could print or fail runs only once
+        # the base is known to be an object; STORE_FIELD checks the rest
+        if not is_constant(ast["value"]):
+            code.emit(CHECK_OBJECT)
+        compile_expression(ast["value"], code)
+        code.emit(STORE_FIELD, code.site(target["index"]["value"]))
+    elif target["tag"] == "complex":
+        compile_expression(target["base"], code)
+        compile_expression(target["index"], code)
+        # as in evaluate(), the target is checked before the value is evaluated
+        code.emit(CHECK_TARGET)
+        compile_expression(ast["value"], code)
+        code.emit(STORE_INDEX)
+    else:
+        assert False, f"Unknown target type in assignment. {target}"
+
+
+# EXPRESSIONS
+
+
+def compile_expression(ast, code):
+    tag = ast["tag"]
+    if tag == "identifier":
+        if "slot" not in ast:
+            code.emit(LOAD_NAME, code.name(ast["value"]))
+        elif ast["depth"] == 0:
+            code.emit(LOAD_LOCAL, ast["slot"])
+        else:
+            code.emit(LOAD_OUTER, code.address(ast["depth"], ast["slot"]))
+    elif tag in ["number", "string", "boolean"]:
+        if tag == "number":
+            assert type(ast["value"]) in [float, int], f"unexpected type {type(ast["value"])}"
+        if tag == "string":
+            assert type(ast["value"]) == str, f"unexpected type {type(ast["value"])}"
+        code.emit(LOAD_CONST, code.constant(ast["value"]))
+    elif tag in binary_opcodes:
+        compile_expression(ast["left"], code)
+        compile_expression(ast["right"], code)
+        code.emit(binary_opcodes[tag])
+    elif tag in short_circuit_opcodes:
+        compile_expression(ast["left"], code)
+        jump = code.emit(short_circuit_opcodes[tag])
+        compile_expression(ast["right"], code)
+        code.patch(jump, code.here())
+    elif tag == "negate":
+        compile_expression(ast["value"], code)
+        code.emit(NEGATE)
+    elif tag in ["!", "not"]:
+        compile_expression(ast["value"], code)
+        code.emit(NOT)
+    elif tag == "list":
+        for item in ast["items"]:
+            compile_expression(item, code)
+        code.emit(BUILD_LIST, len(ast["items"]))
+    elif tag == "object":
+        for item in ast["items"]:
+            compile_expression(item["key"], code)
+            compile_expression(item["value"], code)
+        code.emit(BUILD_OBJECT, len(ast["items"]))
+    elif tag == "complex":
+        compile_expression(ast["base"], code)
+        if ast["index"]["tag"] == "string":
+            code.emit(LOAD_FIELD, code.site(ast["index"]["value"]))
+        else:
+            compile_expression(ast["index"], code)
+            code.emit(INDEX)
+    elif tag == "call":
+        compile_expression(ast["function"], code)
+        # as in evaluate(), arguments that could print or fail are evaluated
+        # only once the callee is known to be a function; CALL checks the rest
+        if not all(is_constant(argument) for argument in ast["arguments"]):
+            code.emit(CHECK_FUNCTION)
+        for argument in ast["arguments"]:
+            compile_expression(argument, code)
+        code.emit(CALL, len(ast["arguments"]))
+    elif tag == "function":
+        # memo functions run uncached on the VM, but are held to the same rules
+        if "memo" in ast:
+            check_pure(ast)
+        parameters = [parameter["value"] for parameter in ast["parameters"]]
+        body = Code(parameters, ast["slots"])
+        compile_statement(ast["body"], body)
+        body.emit(LOAD_CONST, body.constant(None))
+        body.emit(RETURN)
+        code.emit(MAKE_FUNCTION, code.constant(body))
+    else:
+        assert False, f"Unknown tag [{tag}] in AST"
+
+
+def is_constant(ast):
+    return ast["tag"] in ["number", "string", "boolean"]
+
+
+def disassemble(code):
+    """Returns one line of text per instruction."""
+    lines = []
+    for offset in range(0, len(code.instructions), 2):
+        opcode, argument = code.instructions[offset : offset + 2]
+        line = f"{offset:4} {opcode_names[opcode]}"
+        if opcode in [LOAD_CONST]:
+            line += f" {argument} ({code.constants[argument]!r})"
+        elif opcode in [LOAD_NAME, STORE_NAME]:
+            line += f" {argument} ({code.names[argument]})"
+        elif opcode in [LOAD_FIELD, STORE_FIELD]:
+            line += f" {argument} ({code.sites[argument].key})"
+        elif opcode in [LOAD_LOCAL, STORE_LOCAL]:
+            line += f" {argument} ({code.slots[argument]})"
+        elif opcode in [LOAD_OUTER]:
+            line += f" {argument} {code.addresses[argument]}"
+        elif opcode in [MAKE_FUNCTION]:
+            line += f" {argument} ({', '.join(code.constants[argument].parameters)})"
+        elif opcode in [JUMP, JUMP_IF_FALSE, JUMP_IF_FALSE_OR_POP, JUMP_IF_TRUE_OR_POP, FOR_ITER, CALL, BUILD_LIST, BUILD_OBJECT, PRINT]:
+            line += f" {argument}"
+        lines.append(line)
+    return lines
+
+
+def test_compile_expression():
+    print("testing compile expression...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    code = compile(parse(tokenize("x + 2 * y.z")))
+    assert disassemble(code) == [
+        "   0 LOAD_NAME 0 (x)",
+        "   2 LOAD_CONST 0 (2)",
+        "   4 LOAD_NAME 1 (y)",
+        "   6 LOAD_FIELD 0 (z)",
+        "   8 MULTIPLY",
+        "  10 ADD",
+        "  12 HALT",
+    ]
+    code = compile(parse(tokenize("[1, 1.0, true, -x]")))
+    assert code.constants == [1, 1.0]
+    assert disassemble(code)[-3:] == ["   8 NEGATE", "  10 BUILD_LIST 4", "  12 HALT"]
+    # each field access gets a site of its own
+    code = compile(parse(tokenize("p.x = p.x + 1")))
+    assert disassemble(code)[:7] == [
+        "   0 LOAD_NAME 0 (p)",
+        "   2 CHECK_OBJECT",
+        "   4 LOAD_NAME 0 (p)",
+        "   6 LOAD_FIELD 0 (x)",
+        "   8 LOAD_CONST 0 (1)",
+        "  10 ADD",
+        "  12 STORE_FIELD 1 (x)",
+    ]
+    # the callee and the target are checked before what could print or fail runs
+    code = compile(parse(tokenize("p.x = 1; p.y = q")))
+    assert disassemble(code)[:7] == [
+        "   0 LOAD_NAME 0 (p)",
+        "   2 LOAD_CONST 0 (1)",
+        "   4 STORE_FIELD 0 (x)",
+        "   6 LOAD_NAME 0 (p)",
+        "   8 CHECK_OBJECT",
+        "  10 LOAD_NAME 1 (q)",
+        "  12 STORE_FIELD 1 (y)",
+    ]
+    code = compile(parse(tokenize("f(1); g(x); y[0] = 2")))
+    assert disassemble(code) == [
+        "   0 LOAD_NAME 0 (f)",
+        "   2 LOAD_CONST 0 (1)",
+        "   4 CALL 1",
+        "   6 POP",
+        "   8 LOAD_NAME 1 (g)",
+        "  10 CHECK_FUNCTION",
+        "  12 LOAD_NAME 2 (x)",
+        "  14 CALL 1",
+        "  16 POP",
+        "  18 LOAD_NAME 3 (y)",
+        "  20 LOAD_CONST 1 (0)",
+        "  22 CHECK_TARGET",
+        "  24 LOAD_CONST 2 (2)",
+        "  26 STORE_INDEX",
+        "  28 LOAD_CONST 3 (None)",
+        "  30 HALT",
+    ]
+
+
+def test_compile_statements():
+    print("testing compile statements...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    code = compile(parse(tokenize("x = 0; while (x < 3) { x = x + 1 }")))
+    assert disassemble(code) == [
+        "   0 LOAD_CONST 0 (0)",
+        "   2 STORE_NAME 0 (x)",
+        "   4 LOAD_NAME 0 (x)",
+        "   6 LOAD_CONST 1 (3)",
+        "   8 LESS",
+        "  10 JUMP_IF_FALSE 22",
+        "  12 LOAD_NAME 0 (x)",
+        "  14 LOAD_CONST 2 (1)",
+        "  16 ADD",
+        "  18 STORE_NAME 0 (x)",
+        "  20 JUMP 4",
+        "  22 LOAD_CONST 3 (None)",
+        "  24 HALT",
+    ]
+    code = compile(parse(tokenize("if (x) { print 1 } else { print }; 2")))
+    assert disassemble(code) == [
+        "   0 LOAD_NAME 0 (x)",
+        "   2 JUMP_IF_FALSE 12",
+        "   4 LOAD_CONST 0 (1)",
+        "   6 PRINT 1",
+        "   8 POP",
+        "  10 JUMP 16",
+        "  12 PRINT 0",
+        "  14 POP",
+        "  16 LOAD_CONST 1 (2)",
+        "  18 HALT",
+    ]
+    code = compile(parse(tokenize("")))
+    assert disassemble(code) == ["   0 LOAD_CONST 0 (None)", "   2 HALT"]
+    # the optimizer's temporaries are kept for execute() to remove
+    code = compile({"tag": "program", "statements": [], "temporaries": ["$invariant0"]})
+    assert code.temporaries == ["$invariant0"]
+    code = compile(parse(tokenize("for (i = 0; i < 3; i = i + 1) { if (i) { continue }; break }")))
+    assert disassemble(code) == [
+        "   0 LOAD_CONST 0 (0)",
+        "   2 STORE_NAME 0 (i)",
+        "   4 LOAD_NAME 0 (i)",
+        "   6 LOAD_CONST 1 (3)",
+        "   8 LESS",
+        "  10 JUMP_IF_FALSE 30",
+        "  12 LOAD_NAME 0 (i)",
+        "  14 JUMP_IF_FALSE 18",
+        "  16 JUMP 20",
+        "  18 JUMP 30",
+        "  20 LOAD_NAME 0 (i)",
+        "  22 LOAD_CONST 2 (1)",
+        "  24 ADD",
+        "  26 STORE_NAME 0 (i)",
+        "  28 JUMP 4",
+        "  30 LOAD_CONST 3 (None)",
+        "  32 HALT",
+    ]
+    code = compile(parse(tokenize("for i in range(n) { if (i) { break } }")))
+    assert disassemble(code) == [
+        "   0 LOAD_CONST 0 (0)",
+        "   2 LOAD_NAME 0 (n)",
+        "   4 GET_RANGE",
+        "   6 FOR_ITER 20",
+        "   8 STORE_NAME 1 (i)",
+        "  10 LOAD_NAME 1 (i)",
+        "  12 JUMP_IF_FALSE 16",
+        "  14 JUMP 18",
+        "  16 JUMP 6",
+        "  18 POP",
+        "  20 LOAD_CONST 1 (None)",
+        "  22 HALT",
+    ]
+    code = compile(parse(tokenize("a && b || c")))
+    assert disassemble(code) == [
+        "   0 LOAD_NAME 0 (a)",
+        "   2 JUMP_IF_FALSE_OR_POP 6",
+        "   4 LOAD_NAME 1 (b)",
+        "   6 JUMP_IF_TRUE_OR_POP 10",
+        "   8 LOAD_NAME 2 (c)",
+        "  10 HALT",
+    ]
+
+
+def test_compile_function():
+    print("testing compile function...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    code = compile(parse(tokenize("function f(a, b) { return a - b }; f(3, 1)")))
+    body = code.constants[0]
+    assert body.parameters == ["a", "b"]
+    assert disassemble(body) == [
+        "   0 LOAD_LOCAL 0 (a)",
+        "   2 LOAD_LOCAL 1 (b)",
+        "   4 SUBTRACT",
+        "   6 RETURN",
+        "   8 LOAD_CONST 0 (None)",
+        "  10 RETURN",
+    ]
+    assert disassemble(code)[:2] == ["   0 MAKE_FUNCTION 0 (a, b)", "   2 STORE_NAME 0 (f)"]
+    assert disassemble(code)[2:] == [
+        "   4 LOAD_NAME 0 (f)",
+        "   6 LOAD_CONST 1 (3)",
+        "   8 LOAD_CONST 2 (1)",
+        "  10 CALL 2",
+        "  12 HALT",
+    ]
+    code = compile(parse(tokenize("function f(a) { b = a; return function() { return a + b + c } }")))
+    body = code.constants[0]
+    assert disassemble(body)[:2] == ["   0 LOAD_LOCAL 0 (a)", "   2 STORE_LOCAL 1 (b)"]
+    assert disassemble(body.constants[0])[:4] == [
+        "   0 LOAD_OUTER 0 (1, 0)",
+        "   2 LOAD_OUTER 1 (1, 1)",
+        "   4 ADD",
+        "   6 LOAD_NAME 0 (c)",
+    ]
+
+
+if __name__ == "__main__":
+    test_compile_expression()
+    test_compile_statements()
+    test_compile_function()
+    print("done.")
@@ -0,0 +1,305 @@
+import contextlib
+import io
+
+from tokenizer import tokenize
+from parser import parse
+from evaluator import evaluate
+from lists import List
+from objects import Object
+
+# Differential testing of the other backends against evaluate(): running a
+# program through both must give the same result, leave the same environment,
+# print the same output and fail with the same error.
+#
+# A backend is given as run(ast, environment) -> (value, return_chain).
+
+programs = [
+    "1 + 2 * 3 - 4 / 2",
+    "(3 + 2) * 2; --3",
+    '"abc" + "def"',
+    "1 < 2; 2 <= 2; 3 > 4; 3 >= 4; 1 == 1; 1 != 1",
+    "1 && 0; 0 || 2; !0; not 1; true; false",
+    "[0 && 1 / 0, 1 || x, 1 && 0 || 2, 0 || 0 && x]",
+    """
+    // the right side of && and || only runs when it decides the result
+    calls = {"count": 0};
+    function check(value) { calls.count = calls.count + 1; print value; return value };
+    [check(0) && check(1), check(1) || check(0), check(1) && check(2), check(0) || check(3)];
+    calls.count
+    """,
+    "x = [1, 2, [3, 4]]; x[2][1]",
+    'x = {"a": 1, "b": {"c": [5, 6]}}; x.b.c[1] + x["a"]',
+    'x = [1, 2, 3]; x[1] = 4; y = {"a": 1}; y["b"] = x; y.a = 7; y',
+    "x = 0; while (x < 10) { x = x + 1 }; x",
+    "x = 0; if (x) { y = 1 } else { y = 2 }; y",
+    "x = 3; if (x < 1) { y = 1 } else if (x < 2) { y = 2 } else { y = 3 }; y",
+    "if (1) { 3 }",
+    "while (0) { 1 }",
+    "print; print 1; print [1, 2]; print {}",
+    "",
+    "return 3; 4",
+    "function f() { return 1234 }; f()",
+    "function f() { return }; f()",
+    "function f() { 3 }; f()",
+    "function f(x) { return x + 1 }; return f(1)",
+    """
+    memo function fib(n) {
+        if (n < 2) { return n };
+        return fib(n - 1) + fib(n - 2)
+    };
+    memo function first(items) { return items[0] };
+    [fib(20), fib(20), fib(2.0), first([fib(5)])]
+    """,
+    # refused before anything runs, by the compiling backends too
+    "memo function f(x) { return x + k }; k = 1; a = f(1); k = 10; [a, f(1)]",
+    "memo function f(x) { return g(x) }; function g(x) { print x; return x }; [f(1), f(1)]",
+    "function f(x) { if (x > 1) { return 123 }; return 2 + 2 }; f(7) + f(0)",
+    """
+    function fib(n) {
+        if (n < 2) { return n };
+        return fib(n - 1) + fib(n - 2)
+    };
+    fib(12)
+    """,
+    """
+    // calls in tail position
+    function gcd(a, b) {
+        if (a == b) { return a };
+        if (a > b) { return gcd(a - b, b) };
+        return gcd(a, b - a)
+    };
+    gcd(1071, 462)
+    """,
+    """
+    function find(items, value) {
+        i = 0;
+        while (i < 10) {
+            if (items[i] == value) { return i };
+            i = i + 1
+        };
+        return -1
+    };
+    [find([5, 6, 7, 8, 9, 10, 11, 12, 13, 14], 7), find([1, 1, 1, 1, 1, 1, 1, 1, 1, 1], 2)]
+    """,
+    """
+    // functions see the variables where they were defined, not their caller's
+    y = 1;
+    function g() { return y };
+    function f(y) { return g() };
+    f(5)
+    """,
+    """
+    function adder(n) { return function(x) { return x + n } };
+    add2 = adder(2);
+    [add2(1), adder(3)(1)]
+    """,
+    """
+    function outer(a) {
+        function inner(b) { return a + b };
+        return inner(1)
+    };
+    outer(2)
+    """,
+    """
+    // functions are values that can be passed around
+    function twice(f, x) { return f(f(x)) };
+    twice(function(n) { return n * 3 }, 2)
+    """,
+    """
+    counter = {"count": 0};
+    function bump(c) { c.count = c.count + 1 };
+    bump(counter); bump(counter);
+    counter.count
+    """,
+    """
+    total = 0;
+    function add(n) { total = total + n; return total };
+    add(1); add(2)
+    """,
+    """
+    // counted loops, break and continue
+    s = 0;
+    for (i = 0; i < 10; i = i + 1) {
+        if (i == 3) { continue };
+        if (i == 8) { break };
+        s = s + i
+    };
+    for j in range(s, s + 3) { s = s + j };
+    k = 0;
+    while (1) { k = k + 1; if (k > 4) { break } };
+    [s, i, j, k]
+    """,
+    """
+    // loop variables are locals in a function, and return leaves every loop
+    function first_pair(n) {
+        for a in range(1, n) {
+            for (b = a; b < n; b = b + 1) {
+                if (a * b == 12) { return [a, b] }
+            }
+        };
+        return []
+    };
+    first_pair(10)
+    """,
+    """
+    count = 0;
+    for i in range(5) { for j in range(i) { if (j == 2) { continue }; count = count + 1 } };
+    count
+    """,
+    """
+    // the same field accesses see objects of different shapes
+    function get_x(o) { return o.x };
+    function set_x(o, v) { o.x = v };
+    a = {"x": 1, "y": 2};
+    b = {"y": 3, "x": 4};
+    c = {"z": 0};
+    objects = [a, b, a, b];
+    for i in range(4) { set_x(objects[i], get_x(objects[i]) + i) };
+    set_x(c, 5);
+    c.z = c.x + 1;
+    [a, b, c, c.x == c["x"], a == {"y": 2, "x": 3}]
+    """,
+    """
+    // lists of numbers turn generic on the first value that does not fit
+    x = [0] * 4;
+    for i in range(4) { x[i] = i * 3 };
+    y = [0.5, 1.5] + [2.5];
+    z = x + [1];
+    x[1] = 2.5;
+    y[0] = "a";
+    print x; print y;
+    [x, y, z, x == [0, 2.5, 6, 9], [1] * 2 + [2.0], [] + z, z[-1]]
+    """,
+    "function f() { x[1] = true; return 7 }; x = [1, 2, 3]; x[0] = f(); x",
+    "for i in range(0, 2.5) { print i }",
+    "x",
+    "1 / 0",
+    "x = [1]; x[3]",
+    'x = [1]; x["a"]',
+    'x = {"a": 1}; x.b',
+    "x = [1]; x.a = 2",
+    "x = [1]; x[5] = 2",
+    'x = [1.5]; x[1] = "a"; x',
+    '{1: 2}',
+    "x = 3; x(1)",
+    # a failing target or callee fails before the value or arguments run
+    "function f() { print 9; return 0 }; x = [1]; x[5] = f()",
+    "function f() { print 9; return 0 }; x = 1; x[0] = f()",
+    "function f() { print 9; return 0 }; x = 1; x(f())",
+    "function f() { print 9; return 0 }; x = 1; x.a = f()",
+    'function f() { print 9; return 0 }; x = [1, 2]; x["a"] = f()',
+]
+
+
+def is_function(value):
+    """Function values are represented differently by each backend."""
+    return type(value) not in [int, float, str, bool, list, List, dict, Object, type(None)]
+
+
+def comparable(value, seen=()):
+    """value with its lists and objects as plain lists and dicts, and its
+    functions as "function", so values from any backend compare by value."""
+    if is_function(value):
+        return "function"
+    if type(value) not in [list, List, dict, Object]:
+        return value
+    if id(value) in seen:
+        # a list or object that contains itself
+        return "..."
+    seen = seen + (id(value),)
+    if type(value) in [dict, Object]:
+        return {key: comparable(item, seen) for key, item in value.items()}
+    return [comparable(item, seen) for item in value]
+
+
+def plain(environment):
+    """An environment minus its function values."""
+    result = {}
+    for key, value in environment.items():
+        if key == "$parent":
+            value = plain(value)
+        elif is_function(value):
+            continue
+        else:
+            value = comparable(value)
+        result[key] = value
+    return result
+
+
+def error_message(error):
+    """The error's own message, without the explanation pytest adds to asserts."""
+    message = str(error).split("\nassert ")[0]
+    return "" if message.startswith("assert ") else message
+
+
+def outcome(run, ast, environment):
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        try:
+            value, return_chain = run(ast, environment)
+            result = (comparable(value), return_chain)
+        except Exception as e:
+            result = f"{type(e).__name__}: {error_message(e)}"
+    return result, plain(environment), output.getvalue()
+
+
+def check_same_as_evaluate(run, code, environment=None):
+    """Runs code through evaluate() and run and checks they agree; returns the result."""
+    ast = parse(tokenize(code))
+    expected = outcome(evaluate, ast, dict(environment or {}))
+    actual = outcome(run, ast, dict(environment or {}))
+    for part, expected_part, actual_part in zip(
+        ["result", "environment", "output"], expected, actual
+    ):
+        assert (
+            actual_part == expected_part
+        ), f"{[code]}: expected {part} {[expected_part]}, got {[actual_part]}"
+    return actual[0]
+
+
+def check_programs(run):
+    for code in programs:
+        check_same_as_evaluate(run, code)
+    environment = {"x": 1, "y": [1, 2], "$parent": {"z": 3, "x": 4}}
+    for code in ["x + z", "x = x + z", "z = z + 1", "y[0] = z", "q"]:
+        check_same_as_evaluate(run, code, environment)
+
+
+def test_check_same_as_evaluate():
+    print("testing check_same_as_evaluate...")
+    check_programs(evaluate)
+    # a backend that gets something wrong is caught
+    for wrong in [
+        lambda ast, environment: (None, False),
+        lambda ast, environment: environment.update({"x": 1}) or evaluate(ast, environment),
+        lambda ast, environment: print("extra") or evaluate(ast, environment),
+    ]:
+        try:
+            check_same_as_evaluate(wrong, "1 + 1")
+            assert False, "Should have found a difference."
+        except AssertionError as e:
+            assert "expected" in str(e), str(e)
+    # objects are compared by value, in the result and in the environment
+    def changes_object(ast, environment):
+        result = evaluate(ast, environment)
+        environment["x"]["b"] = 2
+        return result
+
+    for wrong, code in [
+        (lambda ast, environment: ({"a": [1, 3]}, False), '{"a": [1, 2]}'),
+        (changes_object, 'x = {"a": [1, 2]}; 1'),
+    ]:
+        try:
+            check_same_as_evaluate(wrong, code)
+            assert False, "Should have found a difference in an object."
+        except AssertionError as e:
+            assert "expected" in str(e), str(e)
+    assert check_same_as_evaluate(evaluate, 'x = {"a": [1]}; x.self = x; x') == (
+        {"a": [1], "self": "..."},
+        False,
+    )
+
+
+if __name__ == "__main__":
+    test_check_same_as_evaluate()
+    print("done.")
@@ -1,154 +1,349 @@
-from tokenizer import tokenize
-from parser import parse
+import operator
 from pprint import pprint
+from memo import MemoCache, memo_key, check_pure
+import sink
+from objects import Object, is_object
+from lists import List, is_list, make_list
+
+# results of memo function calls; the runner may resize it and reports its counters
+memo_cache = MemoCache()
+
+
+class Closure:
+    """A function value: the function literal and the environment it was defined in."""
+
+    __slots__ = ("function", "environment")
+
+    def __init__(self, function, environment):
+        self.function = function
+        self.environment = environment
+
+    def __repr__(self):
+        parameters = [parameter["value"] for parameter in self.function["parameters"]]
+        return f"<function ({', '.join(parameters)})>"
+
+
+class Return:
+    """
+    The value of a return statement, passed up to the call it returns from.
+
+    `return f(x)` is a call in tail position: instead of making the call, it
+    returns the closure and arguments, and the call it returns from runs f in
+    its place. So a chain of tail calls runs in a loop in constant Python stack.
+    """
+
+    __slots__ = ("value", "closure", "arguments")
+
+    def __init__(self, value, closure=None, arguments=None):
+        self.value = value
+        self.closure = closure
+        self.arguments = arguments
+
+
+# the values of break and continue statements, passed up to the loop they are in
+# like a return statement's value; the parser sees to it that there is one
+BREAK = Return(None)
+CONTINUE = Return(None)
 
 
 def evaluate(ast, environment):
-    if ast["tag"] == "number":
-        assert type(ast["value"]) in [
-            float,
-            int,
-        ], f"unexpected type {type(ast["value"])}"
-        return ast["value"], False
-    if ast["tag"] == "string":
-        assert type(ast["value"]) == str, f"unexpected type {type(ast["value"])}"
-        return ast["value"], False
-    if ast["tag"] == "list":
-        items = []
-        for item in ast["items"]:
-            result, _ = evaluate(item, environment)
-            items.append(result)
-        return items, False        
-    if ast["tag"] == "object":
-        object = {}
-        for item in ast["items"]:
-            key, _ = evaluate(item["key"], environment)
-            assert type(key) is str, "Object key must be a string"
-            value, _ = evaluate(item["value"], environment)
-            object[key] = value
-        return object, False        
-    if ast["tag"] == "identifier":
-        identifier = ast["value"]
-        if identifier in environment:
-            return environment[identifier], False
-        if "$parent" in environment:
-            return evaluate(ast, environment["$parent"])
-        assert False, f"Unknown identifier: '{identifier}'."
-    if ast["tag"] == "+":
-        left_value, _ = evaluate(ast["left"], environment)
-        right_value, _ = evaluate(ast["right"], environment)
-        return left_value + right_value, False
-    if ast["tag"] == "-":
-        left_value, _ = evaluate(ast["left"], environment)
-        right_value, _ = evaluate(ast["right"], environment)
-        return left_value - right_value, False
-    if ast["tag"] == "*":
-        left_value, _ = evaluate(ast["left"], environment)
-        right_value, _ = evaluate(ast["right"], environment)
-        return left_value * right_value, False
-    if ast["tag"] == "/":
-        left_value, _ = evaluate(ast["left"], environment)
-        right_value, _ = evaluate(ast["right"], environment)
-        assert right_value != 0, "Division by zero"
-        return left_value / right_value, False
-    if ast["tag"] == "negate":
-        value, _ = evaluate(ast["value"], environment)
-        return -value, False
-    if ast["tag"] == "&&":
-        left_value, _ = evaluate(ast["left"], environment)
-        right_value, _ = evaluate(ast["right"], environment)
-        return left_value and right_value, False
-    if ast["tag"] == "||":
-        left_value, _ = evaluate(ast["left"], environment)
-        right_value, _ = evaluate(ast["right"], environment)
-        return left_value or right_value, False
-    if ast["tag"] == "!":
-        value, _ = evaluate(ast["value"], environment)
-        return not value, False
-    if ast["tag"] == "<":
-        left_value, _ = evaluate(ast["left"], environment)
-        right_value, _ = evaluate(ast["right"], environment)
-        return left_value < right_value, False
-    if ast["tag"] == ">":
-        left_value, _ = evaluate(ast["left"], environment)
-        right_value, _ = evaluate(ast["right"], environment)
-        return left_value > right_value, False
-    if ast["tag"] == "<=":
-        left_value, _ = evaluate(ast["left"], environment)
-        right_value, _ = evaluate(ast["right"], environment)
-        return left_value <= right_value, False
-    if ast["tag"] == ">=":
-        left_value, _ = evaluate(ast["left"], environment)
-        right_value, _ = evaluate(ast["right"], environment)
-        return left_value >= right_value, False
-    if ast["tag"] == "==":
-        left_value, _ = evaluate(ast["left"], environment)
-        right_value, _ = evaluate(ast["right"], environment)
-        return left_value == right_value, False
-    if ast["tag"] == "!=":
-        left_value, _ = evaluate(ast["left"], environment)
-        right_value, _ = evaluate(ast["right"], environment)
-        return left_value != right_value, False
-
-    if ast["tag"] == "print":
-        if ast["value"]:
-            value, _ = evaluate(ast["value"], environment)
-            print(value)
-            return str(value) + "\n", False
-        else:
-            print()
-        return "\n", False
-
-    if ast["tag"] == "if":
-        condition, _ = evaluate(ast["condition"], environment)
-        if condition:
-            value, return_chain = evaluate(ast["then"], environment)
-            if return_chain:
-                return value, return_chain
-        else:
-            if "else" in ast:
-                value, return_chain = evaluate(ast["else"], environment)
-                if return_chain:
-                    return value, return_chain
-        return None, False
-
-    if ast["tag"] == "while":
-        condition_value, return_chain = evaluate(ast["condition"], environment)
-        if return_chain:
-            return condition_value, return_chain
-        while condition_value:
-            value, return_chain = evaluate(ast["do"], environment)
-            if return_chain:
-                return value, return_chain
-            condition_value, return_chain = evaluate(ast["condition"], environment)
-            if return_chain:
-                return condition_value, return_chain
-        return None, False
-
-    if ast["tag"] == "statement_list":
-        for statement in ast["statements"]:
-            value, return_chain = evaluate(statement, environment)
-            if return_chain:
-                return value, return_chain
-        return value, return_chain
-
-    if ast["tag"] == "program":
-        for statement in ast["statements"]:
-            value, return_chain = evaluate(statement, environment)
-            if return_chain:
-                return value, return_chain
-        return value, return_chain
-
-    if ast["tag"] == "function":
-        return ast, False
-
-    if ast["tag"] == "call":
-        function, _ = evaluate(ast["function"], environment)
+    """Evaluates ast; returns (value, return_chain), return_chain being True when
+    the value comes from a return statement outside any function."""
+    try:
+        value = evaluate_node(ast, environment)
+        if value.__class__ is Return:
+            if value.closure:
+                return call_closure(value.closure, value.arguments), True
+            return value.value, True
+        return value, False
+    finally:
+        forget_temporaries(ast, environment)
+
+
+def forget_temporaries(ast, environment):
+    # the optimizer's $invariant variables (see optimizer.py) go when the program
+    # does, whether it ends, returns or fails
+    for name in ast.get("temporaries", ()):
+        environment.pop(name, None)
+
+
+def evaluate_node(ast, environment):
+    """Evaluates ast to a plain value, or a Return from a return statement."""
+    handler = evaluators.get(ast["tag"])
+    assert handler, f"Unknown tag [{ast['tag']}] in AST"
+    return handler(ast, environment)
+
+
+def evaluate_number(ast, environment):
+    assert type(ast["value"]) in [
+        float,
+        int,
+    ], f"unexpected type {type(ast["value"])}"
+    return ast["value"]
+
+
+def evaluate_string(ast, environment):
+    assert type(ast["value"]) == str, f"unexpected type {type(ast["value"])}"
+    return ast["value"]
+
+
+def evaluate_boolean(ast, environment):
+    return ast["value"]
+
+
+def evaluate_list(ast, environment):
+    items = []
+    for item in ast["items"]:
+        result = evaluate_node(item, environment)
+        items.append(result)
+    return make_list(items)
+
+
+def evaluate_object(ast, environment):
+    object = Object()
+    for item in ast["items"]:
+        key = evaluate_node(item["key"], environment)
+        assert type(key) is str, "Object key must be a string"
+        value = evaluate_node(item["value"], environment)
+        object[key] = value
+    return object
+
+
+def evaluate_identifier(ast, environment):
+    identifier = ast["value"]
+    if identifier in environment:
+        return environment[identifier]
+    if "$parent" in environment:
+        return evaluate_node(ast, environment["$parent"])
+    assert False, f"Unknown identifier: '{identifier}'."
+
+
+def evaluate_add(ast, environment):
+    left_value = evaluate_node(ast["left"], environment)
+    right_value = evaluate_node(ast["right"], environment)
+    return left_value + right_value
+
+
+def evaluate_subtract(ast, environment):
+    left_value = evaluate_node(ast["left"], environment)
+    right_value = evaluate_node(ast["right"], environment)
+    return left_value - right_value
+
+
+def evaluate_multiply(ast, environment):
+    left_value = evaluate_node(ast["left"], environment)
+    right_value = evaluate_node(ast["right"], environment)
+    return left_value * right_value
+
+
+def evaluate_divide(ast, environment):
+    left_value = evaluate_node(ast["left"], environment)
+    right_value = evaluate_node(ast["right"], environment)
+    assert right_value != 0, "Division by zero"
+    return left_value / right_value
+
+
+def evaluate_negate(ast, environment):
+    value = evaluate_node(ast["value"], environment)
+    return -value
+
+
+def evaluate_and(ast, environment):
+    left_value = evaluate_node(ast["left"], environment)
+    if not left_value:
+        # the right side is not evaluated once the result is known
+        return left_value
+    return evaluate_node(ast["right"], environment)
+
+
+def evaluate_or(ast, environment):
+    left_value = evaluate_node(ast["left"], environment)
+    if left_value:
+        return left_value
+    return evaluate_node(ast["right"], environment)
+
+
+def evaluate_not(ast, environment):
+    value = evaluate_node(ast["value"], environment)
+    return not value
+
+
+def evaluate_less_than(ast, environment):
+    left_value = evaluate_node(ast["left"], environment)
+    right_value = evaluate_node(ast["right"], environment)
+    return left_value < right_value
+
+
+def evaluate_greater_than(ast, environment):
+    left_value = evaluate_node(ast["left"], environment)
+    right_value = evaluate_node(ast["right"], environment)
+    return left_value > right_value
+
+
+def evaluate_less_than_or_equal(ast, environment):
+    left_value = evaluate_node(ast["left"], environment)
+    right_value = evaluate_node(ast["right"], environment)
+    return left_value <= right_value
+
+
+def evaluate_greater_than_or_equal(ast, environment):
+    left_value = evaluate_node(ast["left"], environment)
+    right_value = evaluate_node(ast["right"], environment)
+    return left_value >= right_value
+
+
+def evaluate_equal(ast, environment):
+    left_value = evaluate_node(ast["left"], environment)
+    right_value = evaluate_node(ast["right"], environment)
+    return left_value == right_value
+
+
+def evaluate_not_equal(ast, environment):
+    left_value = evaluate_node(ast["left"], environment)
+    right_value = evaluate_node(ast["right"], environment)
+    return left_value != right_value
+
+
+# the Python operation behind each binary operator, for the backends that look
+# one up by tag; "/" is not here, as division by zero is refused before dividing
+binary_operations = {
+    "+": operator.add,
+    "-": operator.sub,
+    "*": operator.mul,
+    "<": operator.lt,
+    ">": operator.gt,
+    "<=": operator.le,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+def evaluate_print(ast, environment):
+    if ast["value"]:
+        value = evaluate_node(ast["value"], environment)
+        return sink.output.write_value(value)
+    return sink.output.write_newline()
+
+
+def evaluate_if(ast, environment):
+    condition = evaluate_node(ast["condition"], environment)
+    if condition:
+        value = evaluate_node(ast["then"], environment)
+    elif "else" in ast:
+        value = evaluate_node(ast["else"], environment)
+    else:
+        return None
+    if value.__class__ is Return:
+        return value
+    return None
+
+
+def evaluate_while(ast, environment):
+    while evaluate_node(ast["condition"], environment):
+        value = evaluate_node(ast["do"], environment)
+        if value.__class__ is Return:
+            if value is BREAK:
+                break
+            if value is not CONTINUE:
+                return value
+    return None
+
+
+def evaluate_for(ast, environment):
+    if ast["initial"]:
+        evaluate_node(ast["initial"], environment)
+    condition, step = ast["condition"], ast["step"]
+    while condition is None or evaluate_node(condition, environment):
+        value = evaluate_node(ast["do"], environment)
+        if value.__class__ is Return:
+            if value is BREAK:
+                break
+            if value is not CONTINUE:
+                return value
+        if step:
+            evaluate_node(step, environment)
+    return None
+
+
+def evaluate_for_range(ast, environment):
+    start = evaluate_node(ast["start"], environment)
+    stop = evaluate_node(ast["stop"], environment)
+    check_range(start, stop)
+    variable = ast["variable"]["value"]
+    do = ast["do"]
+    # the counter comes from Python's range: assigning to the variable in the
+    # body does not change the iterations
+    for counter in range(start, stop):
+        environment[variable] = counter
+        value = evaluate_node(do, environment)
+        if value.__class__ is Return:
+            if value is BREAK:
+                break
+            if value is not CONTINUE:
+                return value
+    return None
+
+
+def check_range(start, stop):
+    assert type(start) is int and type(stop) is int, f"range({start}, {stop}) needs integers"
+
+
+def evaluate_break(ast, environment):
+    return BREAK
+
+
+def evaluate_continue(ast, environment):
+    return CONTINUE
+
+
+def evaluate_statement_list(ast, environment):
+    value = None
+    for statement in ast["statements"]:
+        value = evaluate_node(statement, environment)
+        if value.__class__ is Return:
+            return value
+    return value
+
+
+def evaluate_function(ast, environment):
+    if "memo" in ast:
+        check_pure(ast)
+    return Closure(ast, environment)
+
+
+def evaluate_call(ast, environment):
+    closure, argument_values = evaluate_callee(ast, environment)
+    return call_closure(closure, argument_values)
+
+
+def evaluate_callee(ast, environment):
+    """The closure a call node calls and its argument values."""
+    closure = evaluate_node(ast["function"], environment)
+    assert type(closure) is Closure, f"{closure} is not a function"
+    argument_values = []
+    for argument in ast["arguments"]:
+        value = evaluate_node(argument, environment)
+        argument_values.append(value)
+    return closure, argument_values
+
+
+def call_closure(closure, argument_values):
+    if "memo" in closure.function:
+        key = memo_key(closure, argument_values)
+        if key is not None:
+            cached, value = memo_cache.get(key)
+            if not cached:
+                value = run_closure(closure, argument_values)
+                memo_cache.put(key, value)
+            return value
+    return run_closure(closure, argument_values)
+
+
+def run_closure(closure, argument_values):
+    while True:
+        function = closure.function
         local_environment = {}
-        argument_values = []
-        for argument in ast["arguments"]:
-            value, _ = evaluate(argument, environment)
-            argument_values.append(value)
         parameter_identifiers = []
         for parameter in function["parameters"]:
             identifier = parameter["value"]
@@ -156,70 +351,136 @@ def evaluate(ast, environment):
         p = list(zip(parameter_identifiers, argument_values))
         for identifier, value in p:
             local_environment[identifier] = value
-        local_environment["$parent"] = environment
-        value, return_chain = evaluate(function["body"], local_environment)
-        if return_chain:
-            return value, False
+        # the body sees the variables where the function was defined, not the caller's
+        local_environment["$parent"] = closure.environment
+        value = evaluate_node(function["body"], local_environment)
+        if value.__class__ is not Return:
+            return None
+        if not value.closure:
+            return value.value
+        if "memo" in value.closure.function:
+            # a memo function is called through its cache, tail call or not
+            return call_closure(value.closure, value.arguments)
+        # a tail call: run the callee in this call's place
+        closure, argument_values = value.closure, value.arguments
+
+
+def evaluate_complex(ast, environment):
+    base = evaluate_node(ast["base"], environment)
+    index = ast["index"]
+    if index["tag"] == "string":
+        # a constant field name: nothing to evaluate or check but the base
+        if base.__class__ is Object and base.shape is not None:
+            return base.values[base.shape.slots[index["value"]]]
+        assert is_object(base)
+        return base[index["value"]]
+    return index_value(base, evaluate_node(index, environment))
+
+
+def index_value(base, index):
+    if index == None:
+        return base
+    if type(index) in [int, float]:
+        assert int(index) == index
+        if base.__class__ is List:
+            # every storage indexes alike
+            base = base.items
         else:
-            return None, False
-
-    if ast["tag"] == "complex":
-        print(ast)
-        base, _ = evaluate(ast["base"], environment)
-        index, _ = evaluate(ast["index"], environment)
-        if index == None:
-            return base, False
-        if type(index) in [int, float]:
-            assert int(index) == index
             assert type(base) == list
-            assert len(base) > index
-            return base[index], False
-        if type(index) == str:
-            assert type(base) == dict
-            return base[index], False
-        assert False, f"Unknown index type [{index}]"
-
-    if ast["tag"] == "assign":
-        assert "target" in ast
-        target = ast["target"]
-        if target["tag"] == "identifier":
-            target_base = environment
-            target_index = target["value"] 
-        elif target["tag"] == "complex":
-            base, _ = evaluate(target["base"], environment)
-            print(f"Target Base = {[base]}")
-            index, _ = evaluate(target["index"], environment)
-            print(f"Target Index = {[index]}")
-            assert type(index) in [int, float, str], f"Unknown index type [{index}]"
-            if type(index) in [int, float]:
-                assert int(index) == index
-                assert type(base) == list
-                assert len(base) > index
-                target_base = base
-                target_index = index
-            if type(index) in [str]:
-                assert type(base) == dict
-                target_base = base
-                target_index = index
-        else:
-            assert False, f"Unknown target type in assignment. {target}"
-        value, return_chain = evaluate(ast["value"], environment)
-        if return_chain:
-            return value, return_chain
-        target_base[target_index] = value
-        return None, False
-
-    if ast["tag"] == "return":
-        if "value" in ast:
-            value, return_chain = evaluate(ast["value"], environment)
-            return value, True
-        return None, True
-
-    assert False, f"Unknown tag [{ast['tag']}] in AST"
+        assert len(base) > index
+        return base[index]
+    if type(index) == str:
+        assert is_object(base)
+        return base[index]
+    assert False, f"Unknown index type [{index}]"
+
+
+def evaluate_assign(ast, environment):
+    assert "target" in ast
+    target = ast["target"]
+    if target["tag"] == "identifier":
+        target_base = environment
+        target_index = target["value"]
+    else:
+        target_base, target_index = evaluate_target(target, environment)
+    target_base[target_index] = evaluate_node(ast["value"], environment)
+    return None
+
+
+def evaluate_target(target, environment):
+    """The list or object and the index a `complex` assignment target stores to."""
+    assert target["tag"] == "complex", f"Unknown target type in assignment. {target}"
+    base = evaluate_node(target["base"], environment)
+    index = evaluate_node(target["index"], environment)
+    assert type(index) in [int, float, str], f"Unknown index type [{index}]"
+    if type(index) in [int, float]:
+        assert int(index) == index
+        assert is_list(base)
+        assert len(base) > index
+    else:
+        assert is_object(base)
+    return base, index
+
+
+def evaluate_return(ast, environment):
+    if "value" in ast:
+        if ast["value"]["tag"] == "call":
+            closure, argument_values = evaluate_callee(ast["value"], environment)
+            return Return(None, closure, argument_values)
+        return Return(evaluate_node(ast["value"], environment))
+    return Return(None)
+
+
+# each node is evaluated by one lookup in this table, whatever its tag
+evaluators = {
+    "number": evaluate_number,
+    "string": evaluate_string,
+    "boolean": evaluate_boolean,
+    "list": evaluate_list,
+    "object": evaluate_object,
+    "identifier": evaluate_identifier,
+    "+": evaluate_add,
+    "-": evaluate_subtract,
+    "*": evaluate_multiply,
+    "/": evaluate_divide,
+    "negate": evaluate_negate,
+    "&&": evaluate_and,
+    "||": evaluate_or,
+    "!": evaluate_not,
+    "not": evaluate_not,
+    "<": evaluate_less_than,
+    ">": evaluate_greater_than,
+    "<=": evaluate_less_than_or_equal,
+    ">=": evaluate_greater_than_or_equal,
+    "==": evaluate_equal,
+    "!=": evaluate_not_equal,
+    "print": evaluate_print,
+    "if": evaluate_if,
+    "while": evaluate_while,
+    "for": evaluate_for,
+    "for_range": evaluate_for_range,
+    "break": evaluate_break,
+    "continue": evaluate_continue,
+    "statement_list": evaluate_statement_list,
+    "program": evaluate_statement_list,
+    "function": evaluate_function,
+    "call": evaluate_call,
+    "complex": evaluate_complex,
+    "assign": evaluate_assign,
+    "return": evaluate_return,
+}
+
+
+def parse_code(code):
+    # imported here, so that running a precompiled program never loads the tokenizer or parser
+    from tokenizer import tokenize
+    from parser import parse
+
+    return parse(tokenize(code))
 
 
 def equals(code, environment, expected_result, expected_environment=None):
-    result, _ = evaluate(parse(tokenize(code)), environment)
+    result, _ = evaluate(parse_code(code), environment)
     assert (
         result == expected_result
     ), f"""ERROR: When executing
@@ -284,6 +545,39 @@ def test_evaluate_negation():
     equals("--3", {}, 3, {})
 
 
+def test_evaluate_boolean_and_not():
+    print("test evaluate boolean and not")
+    equals("true", {}, 1, {})
+    equals("false", {}, 0, {})
+    equals("!0", {}, True, {})
+    equals("not 1", {}, False, {})
+    equals("!!x", {"x": 2}, True)
+
+
+def test_evaluate_short_circuit():
+    print("test evaluate short circuit")
+    equals("1 && 2", {}, 2, {})
+    equals("0 && 2", {}, 0, {})
+    equals("0 || 2", {}, 2, {})
+    equals("3 || 2", {}, 3, {})
+    # the right side is not evaluated when the left side decides the result
+    equals("0 && 1/0", {}, 0, {})
+    equals("1 || x[5]", {"x": []}, 1)
+    environment = {"c": {"n": 0}}
+    code = "function f() { c.n = c.n + 1; return 1 }; [0 && f(), 1 || f(), 1 && f(), 0 || f()]"
+    equals(code, environment, [0, 1, 1, 1])
+    assert environment["c"] == {"n": 2}
+
+
+def test_evaluate_unknown_tag():
+    print("test evaluate unknown tag")
+    try:
+        evaluate({"tag": "unknown"}, {})
+        assert False, "Should have an error for an unknown tag."
+    except AssertionError as e:
+        assert "Unknown tag [unknown] in AST" in str(e)
+
+
 def test_evaluate_print_statement():
     print("test evaluate_print_statement")
     equals("print", {}, "\n", {})
@@ -308,6 +602,51 @@ def test_evaluate_while_statement():
     equals("x=1; while(x<5) {x=x+1}; y=3", {}, None, {"x": 5, "y": 3})
 
 
+def test_evaluate_for_statement():
+    print("testing evaluate_for_statement")
+    equals("s=0; for (i=0; i<4; i=i+1) {s=s+i}", {}, None, {"s": 6, "i": 4})
+    equals("for (;0;) {x=1}", {}, None, {})
+    equals("s=0; for i in range(2, 5) {s=s+i}", {}, None, {"s": 9, "i": 4})
+    equals("s=0; for i in range(3) {s=s*10+i}", {}, None, {"s": 12, "i": 2})
+    equals("for i in range(3, 1) {x=1}", {}, None, {})
+    # the counter does not depend on assignments to the variable
+    equals("n=0; for i in range(3) {i=i+10; n=n+1}", {}, None, {"n": 3, "i": 12})
+    try:
+        evaluate(parse_code("for i in range(0, 1.5) {}"), {})
+        assert False, "Should refuse a float range."
+    except AssertionError as e:
+        assert str(e) == "range(0, 1.5) needs integers"
+
+
+def test_evaluate_break_continue():
+    print("testing evaluate_break_continue")
+    equals("i=0; while(1) {i=i+1; if (i==3) {break}}", {}, None, {"i": 3})
+    equals(
+        "s=0; for (i=0; i<6; i=i+1) {if (i==2 || i==4) {continue}; s=s+i}",
+        {},
+        None,
+        {"s": 9, "i": 6},
+    )
+    equals("s=0; for i in range(10) {if (i==5) {break} else {s=s+i}}", {}, None, {"s": 10, "i": 5})
+    # break leaves the innermost loop only
+    equals(
+        "n=0; for i in range(3) {for j in range(3) {if (j==1) {break}; n=n+1}}",
+        {},
+        None,
+        {"n": 3, "i": 2, "j": 1},
+    )
+    code = """
+        function find(x, items) {
+            for i in range(0, 3) {
+                if (items[i] == x) { return i }
+            };
+            return -1
+        };
+        [find(20, [10, 20, 30]), find(40, [10, 20, 30])]
+    """
+    equals(code, {}, [1, -1])
+
+
 def test_evaluate_assignment_statement():
     print("test evaluate_assignment_statement")
     equals("X=1", {}, None, {"X": 1})
@@ -324,11 +663,11 @@ def test_evaluate_list_literal():
     print("test evaluate_list_literal")
     environment = {}
     code = '[1,2,3]'
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     assert result == [1,2,3]
     code = '[]'
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     assert result == []
 
@@ -336,66 +675,49 @@ def test_evaluate_object_literal():
     print("test evaluate_object_literal")
     environment = {}
     code = '{"a":1,"b":2}'
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     assert result == {"a":1,"b":2}
     code = '{}'
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     assert result == {}
 
 def test_evaluate_function_literal():
     print("test evaluate_function_literal")
-    equals(
-        "f=function(x) {1}",
-        {},
-        None,
-        {
-            "f": {
-                "tag": "function",
-                "parameters": [{"tag": "identifier", "value": "x", "position": 11}],
-                "body": {
-                    "tag": "statement_list",
-                    "statements": [{"tag": "number", "value": 1}],
-                },
-            }
-        },
-    )
-    equals(
-        "function f(x) {1}",
-        {},
-        None,
-        {
-            "f": {
-                "tag": "function",
-                "parameters": [{"tag": "identifier", "value": "x", "position": 11}],
-                "body": {
-                    "tag": "statement_list",
-                    "statements": [{"tag": "number", "value": 1}],
-                },
-            }
-        },
-    )
+    for code in ["f=function(x) {1}", "function f(x) {1}"]:
+        environment = {}
+        equals(code, environment, None)
+        closure = environment["f"]
+        assert type(closure) is Closure
+        assert closure.function == {
+            "tag": "function",
+            "parameters": [{"tag": "identifier", "value": "x", "position": 11}],
+            "body": {
+                "tag": "statement_list",
+                "statements": [{"tag": "number", "value": 1}],
+            },
+        }
+        assert closure.environment is environment
 
 
 def test_evaluate_function_call():
     print("test evaluate_function_call")
     environment = {}
     code = "function f() {return(1234)}"
-    result, _ = evaluate(parse(tokenize(code)), environment)
-    assert environment == {
-        "f": {
-            "body": {
-                "statements": [
-                    {"tag": "return", "value": {"tag": "number", "value": 1234}}
-                ],
-                "tag": "statement_list",
-            },
-            "parameters": [],
-            "tag": "function",
-        }
+    result, _ = evaluate(parse_code(code), environment)
+    assert list(environment) == ["f"]
+    assert environment["f"].function == {
+        "body": {
+            "statements": [
+                {"tag": "return", "value": {"tag": "number", "value": 1234}}
+            ],
+            "tag": "statement_list",
+        },
+        "parameters": [],
+        "tag": "function",
     }
-    ast = parse(tokenize("f()"))
+    ast = parse_code("f()")
     assert ast == {
         "statements": [
             {
@@ -425,7 +747,7 @@ def test_evaluate_function_call():
             {return 2};
         g(4)
         """
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     assert result == 2
     code = """
@@ -434,10 +756,32 @@ def test_evaluate_function_call():
             {return [1,2,3,q]};
         g(4)
         """
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     assert result == [1,2,3,4]
 
+def test_evaluate_closures():
+    print("test evaluate_closures")
+    # functions see the variables where they were defined, not their caller's
+    environment = {}
+    code = "y = 1; function g() { return y }; function f(y) { return g() }; f(5)"
+    result, _ = evaluate(parse_code(code), environment)
+    assert result == 1
+    code = """
+        function adder(n) { return function(x) { return x + n } };
+        add2 = adder(2);
+        add3 = adder(3);
+        [add2(1), add3(1), add2(add3(0))]
+    """
+    result, _ = evaluate(parse_code(code), environment)
+    assert result == [3, 4, 5]
+    try:
+        evaluate(parse_code("x = 1; x(2)"), {})
+        assert False, "Should have an error for calling a non-function."
+    except AssertionError as e:
+        assert "is not a function" in str(e)
+
+
 def test_evaluate_return_statement():
     print("test evaluate_return_statement")
     environment = {}
@@ -445,13 +789,13 @@ def test_evaluate_return_statement():
         function f() { return };
         f()
     """
-    result, _ = evaluate(parse(tokenize(code)), environment)
+    result, _ = evaluate(parse_code(code), environment)
     assert result == None
     code = """
         function f() { return 2+2 };
         f()
     """
-    result, _ = evaluate(parse(tokenize(code)), environment)
+    result, _ = evaluate(parse_code(code), environment)
     assert result == 4
     code = """
         function f(x) { 
@@ -462,57 +806,124 @@ def test_evaluate_return_statement():
         };
         f(7) + f(0)
     """
-    result, _ = evaluate(parse(tokenize(code)), environment)
+    result, _ = evaluate(parse_code(code), environment)
     assert result == 127
 
 
+def test_evaluate_tail_calls():
+    print("test evaluate_tail_calls")
+    code = """
+        function sum(n, acc) {
+            if (n == 0) { return acc };
+            return sum(n - 1, acc + n)
+        };
+        sum(100000, 0)
+    """
+    # far deeper than Python's recursion limit would allow one call per level
+    result, _ = evaluate(parse_code(code), {})
+    assert result == 5000050000
+    code = """
+        function is_even(n) { if (n == 0) { return 1 }; return is_odd(n - 1) };
+        function is_odd(n) { if (n == 0) { return 0 }; return is_even(n - 1) };
+        [is_even(20001), is_odd(20001)]
+    """
+    result, _ = evaluate(parse_code(code), {})
+    assert result == [0, 1]
+    # a tail call at the top level still runs
+    result, return_chain = evaluate(parse_code("function f(x) { return x + 1 }; return f(1)"), {})
+    assert (result, return_chain) == (2, True)
+
+
+def test_evaluate_memo_functions():
+    print("test evaluate_memo_functions")
+    global memo_cache
+    saved = memo_cache
+    memo_cache = MemoCache(size=100)
+    try:
+        code = """
+            memo function fib(n) {
+                if (n < 2) { return n };
+                return fib(n - 1) + fib(n - 2)
+            };
+            fib(80)
+        """
+        # unmemoized, fib(80) would make about 10^16 calls
+        result, _ = evaluate(parse_code(code), {})
+        assert result == 23416728348467685
+        assert memo_cache.statistics() == {"hits": 78, "misses": 81, "evictions": 0, "size": 81}
+        result, _ = evaluate(parse_code(code.replace("fib(80)", "[fib(80), fib(1), fib(1.0)]")), {})
+        assert result == [23416728348467685, 1, 1.0]
+        # lists and objects are not hashable, so those calls are not cached
+        code = "memo function first(x) { return x[0] }; [first([1]), first([2])]"
+        result, _ = evaluate(parse_code(code), {})
+        assert result == [1, 2]
+        memo_cache = MemoCache(size=2)
+        code = "memo function f(x) { return x * 2 }; [f(1), f(2), f(3), f(1)]"
+        result, _ = evaluate(parse_code(code), {})
+        assert result == [2, 4, 6, 2]
+        assert memo_cache.statistics() == {"hits": 0, "misses": 4, "evictions": 2, "size": 2}
+        # a tail call to a memo function goes through the cache too
+        memo_cache = MemoCache(size=100)
+        code = "memo function g(n) { return n * 2 }; function f(n) { return g(n) }; [f(3), f(3), f(3)]"
+        result, _ = evaluate(parse_code(code), {})
+        assert result == [6, 6, 6]
+        assert memo_cache.statistics() == {"hits": 2, "misses": 1, "evictions": 0, "size": 1}
+    finally:
+        memo_cache = saved
+    try:
+        evaluate(parse_code("memo function f(x) { print x }"), {})
+        assert False, "Should refuse to memoize a function that prints."
+    except AssertionError as e:
+        assert "Cannot memoize a function that prints." in str(e)
+
+
 def test_evaluate_complex_expression():
     environment = {"x":[2,4,6,8]}
     code = "x[3]"
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     assert result == 8
 
     environment = {"x": {"a": 3, "b": 4}}
     code = 'x["b"]'
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     assert result == 4
 
     environment = {"x": {"a": [1,2,3], "b": 4}}
     code = 'x["a"]'
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     assert result == [1,2,3]
 
     code = 'x["a"][2]'
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     assert result == 3
 
     environment = {"x": [[1,2],[3,4]]}
     code = 'x[0][1]'
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     print(result)
     assert result == 2
 
     environment = {"x": {"a":{"x":4,"y":6},"b":{"x":5,"y":7}}}
     code = 'x["b"]["y"]'
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     assert result == 7
 
 def test_evaluate_complex_assignment():
     environment = {"x":[1,2,3]}
     code = 'x[1]=4'
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     assert environment["x"][1] == 4
 
     environment = {"x":{"a":1,"b":2}}
     code = 'x["b"]=4'
-    ast = parse(tokenize(code))
+    ast = parse_code(code)
     result, _ = evaluate(ast, environment)
     assert environment["x"]["b"] == 4
 
@@ -524,12 +935,20 @@ if __name__ == "__main__":
     test_evaluate_multiplication()
     test_evaluate_division()
     test_evaluate_negation()
+    test_evaluate_boolean_and_not()
+    test_evaluate_short_circuit()
+    test_evaluate_unknown_tag()
     test_evaluate_print_statement()
     test_evaluate_if_statement()
     test_evaluate_while_statement()
+    test_evaluate_for_statement()
+    test_evaluate_break_continue()
     test_evaluate_assignment_statement()
     test_evaluate_function_literal()
     test_evaluate_function_call()
+    test_evaluate_closures()
+    test_evaluate_tail_calls()
+    test_evaluate_memo_functions()
     test_evaluate_complex_expression()
     test_evaluate_complex_assignment()
     test_evaluate_return_statement()
@@ -0,0 +1,225 @@
+import reprlib
+import sys
+from array import array
+
+# List values.
+#
+# A list is a List, which keeps its items in one of three storages, chosen when
+# the list is made:
+#
+#   array("q")  every item is an int that fits in 64 bits
+#   array("d")  every item is a float
+#   list        anything else, including the empty list
+#
+# An array keeps its numbers unboxed, 8 bytes each, where a Python list holds
+# a pointer to a separate int or float object per item. Reading an item boxes
+# it again, so the point is memory, and with it the time spent allocating and
+# collecting, for the numeric buffers that programs build with `[0] * n` and
+# fill with `x[i] = ...`.
+#
+# Storing a value that the array cannot hold (a float in an int list, a
+# string, an int beyond 64 bits) turns the list into a plain list for good,
+# before the value is stored; storage never goes back to an array. Lists
+# made from lists (`+`, `*`) keep an array when both sides share one.
+#
+# Lists behave like the Python lists they replace: they index, compare equal,
+# concatenate and print the same way. Lists that come from outside a program,
+# like the values of an environment passed to evaluate(), may still be plain
+# lists; is_list() accepts either.
+
+# the item type each array typecode holds, and the typecode of each item type
+item_types = {"q": int, "d": float}
+typecodes = {int: "q", float: "d"}
+
+
+def storage(values):
+    """The storage for a list of values: an array when they allow one."""
+    if values:
+        item_type = type(values[0])
+        typecode = typecodes.get(item_type)
+        # bool is a subclass of int, so types are compared exactly
+        if typecode and all(type(value) is item_type for value in values):
+            try:
+                return array(typecode, values)
+            except OverflowError:
+                pass
+    return values
+
+
+class List:
+    """A list value: its items, in an array or a Python list."""
+
+    __slots__ = ("items",)
+
+    def __init__(self, items):
+        self.items = items
+
+    def __getitem__(self, index):
+        return self.items[index]
+
+    def __setitem__(self, index, value):
+        store_item(self, index, value)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __add__(self, other):
+        if other.__class__ is List:
+            other = other.items
+        elif type(other) is not list:
+            return NotImplemented
+        items = self.items
+        if items.__class__ is array and other.__class__ is array and items.typecode == other.typecode:
+            return List(items + other)
+        return make_list(list(items) + list(other))
+
+    def __radd__(self, other):
+        if type(other) is not list:
+            return NotImplemented
+        return make_list(other + list(self.items))
+
+    def __mul__(self, count):
+        # the same storage, repeated; raises like a list for a count that is not an int
+        return List(self.items * count)
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other):
+        if other.__class__ is List:
+            other = other.items
+        if type(other) in [list, array]:
+            return list(self.items) == list(other)
+        return NotImplemented
+
+    def __lt__(self, other):
+        return list(self.items) < as_python_list(other)
+
+    def __le__(self, other):
+        return list(self.items) <= as_python_list(other)
+
+    def __gt__(self, other):
+        return list(self.items) > as_python_list(other)
+
+    def __ge__(self, other):
+        return list(self.items) >= as_python_list(other)
+
+    __hash__ = None
+
+    @reprlib.recursive_repr("[...]")
+    def __repr__(self):
+        return "[" + ", ".join(repr(item) for item in self.items) + "]"
+
+
+def make_list(values):
+    """A List of the Python list values, in the storage they allow."""
+    return List(storage(values))
+
+
+def is_list(value):
+    return value.__class__ is List or type(value) is list
+
+
+def as_python_list(value):
+    if value.__class__ is List:
+        return list(value.items)
+    return value
+
+
+def store_item(base, index, value):
+    """Sets item index of the List base, making its storage a plain list if value does not fit."""
+    items = base.items
+    if items.__class__ is list:
+        items[index] = value
+    elif type(value) is item_types[items.typecode]:
+        try:
+            items[index] = value
+        except OverflowError:
+            items = base.items = list(items)
+            items[index] = value
+    else:
+        # an IndexError must leave the list as it was
+        items[index]
+        items = base.items = list(items)
+        items[index] = value
+
+
+def test_storage():
+    print("testing storage...")
+    assert make_list([1, 2, 3]).items == array("q", [1, 2, 3])
+    assert make_list([1.5, 2.0]).items == array("d", [1.5, 2.0])
+    for values in [[], [1, 2.0], [True, 1], [1, True], ["a"], [[1]], [1 << 70], [None]]:
+        items = make_list(values).items
+        assert type(items) is list and items == values, values
+    # the items keep their types
+    assert [type(item) for item in make_list([1, 2])] == [int, int]
+    assert [type(item) for item in make_list([1.0])] == [float]
+
+
+def test_store_item():
+    print("testing store item...")
+    numbers = make_list([1, 2, 3])
+    numbers[0] = 4
+    store_item(numbers, -1, 5)
+    assert numbers.items == array("q", [4, 2, 5])
+    numbers[1] = 2.5
+    assert type(numbers.items) is list and numbers == [4, 2.5, 5]
+    for value in [1 << 64, True, "a", None]:
+        numbers = make_list([1, 2])
+        numbers[1] = value
+        assert type(numbers.items) is list and numbers.items == [1, value], value
+        assert type(numbers[1]) is type(value)
+    floats = make_list([1.0])
+    floats[0] = 1
+    assert type(floats.items) is list and type(floats[0]) is int
+    try:
+        numbers = make_list([1, 2])
+        numbers[2] = "a"
+        assert False, "Should have an IndexError."
+    except IndexError:
+        assert numbers.items == array("q", [1, 2])
+
+
+def test_list_operations():
+    print("testing list operations...")
+    numbers = make_list([1, 2])
+    assert numbers == [1, 2] and [1, 2] == numbers and numbers == make_list([1, 2])
+    assert numbers == make_list([1.0, 2.0]) and numbers != [1, 3] and numbers != (1, 2)
+    assert len(numbers) == 2 and list(numbers) == [1, 2] and numbers[-1] == 2
+    assert repr(numbers) == "[1, 2]" == f"{numbers}"
+    assert repr(make_list([1.5, -0.0])) == "[1.5, -0.0]"
+    zeros = make_list([0]) * 4
+    assert zeros.items == array("q", [0, 0, 0, 0])
+    assert (3 * make_list([0.5])).items == array("d", [0.5, 0.5, 0.5])
+    assert (numbers + numbers).items == array("q", [1, 2, 1, 2])
+    assert (numbers + make_list([3.0])) == [1, 2, 3.0]
+    assert type((numbers + make_list([3.0])).items) is list
+    assert ([3] + numbers).items == array("q", [3, 1, 2])
+    assert (make_list([]) + numbers).items == array("q", [1, 2])
+    assert numbers < make_list([1, 3]) and numbers >= [1, 2] and not numbers > [1, 2]
+    nested = make_list(["a", numbers])
+    nested[0] = nested
+    assert repr(nested) == "[[...], [1, 2]]"
+    try:
+        numbers + 1
+        assert False, "Should refuse to add a number to a list."
+    except TypeError:
+        pass
+
+
+def test_memory():
+    print("testing memory...")
+    boxed = [float(i) for i in range(1000)]
+    unboxed = make_list(boxed)
+    boxed_size = sys.getsizeof(boxed) + sum(sys.getsizeof(value) for value in boxed)
+    assert sys.getsizeof(unboxed.items) * 3 < boxed_size
+
+
+if __name__ == "__main__":
+    test_storage()
+    test_store_item()
+    test_list_operations()
+    test_memory()
+    print("done.")
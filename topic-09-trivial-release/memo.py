@@ -0,0 +1,169 @@
+from collections import OrderedDict
+
+from resolver import assigned_names
+
+# Memoization of `memo function`s.
+#
+# A memo function's results are kept in a bounded least-recently-used cache,
+# keyed on the function value and its argument values, so calling it again
+# with the same arguments returns the cached result without running the body.
+# That is only right for a function whose result depends on nothing but its
+# arguments and which has no effects, so check_pure() refuses a memo function
+# that prints, assigns to anything but its own locals (an indexed or field
+# assignment changes a list or object that may be shared), or reads a variable
+# that is not its own: a global may be assigned again between calls, and a
+# function it names may print. Function literals in a memo function are held
+# to the same rules and may read its locals. The one exception is calling
+# itself by the name its function statement gives it, which is what makes
+# recursive memo functions worth caching.
+
+
+class MemoCache:
+    """Results of memo function calls, at most `size` of them, least recently
+    used dropped first."""
+
+    def __init__(self, size=1024):
+        self.size = size
+        self.results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Returns (True, result) for a cached call, else (False, None)."""
+        if key in self.results:
+            self.hits += 1
+            self.results.move_to_end(key)
+            return True, self.results[key]
+        self.misses += 1
+        return False, None
+
+    def put(self, key, result):
+        self.results[key] = result
+        while len(self.results) > self.size:
+            self.results.popitem(last=False)
+            self.evictions += 1
+
+    def statistics(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self.results),
+        }
+
+
+def memo_key(function, arguments):
+    """The cache key of a call, or None when an argument is not hashable."""
+    # 1, 1.0 and true are equal in Python but not interchangeable in trivial
+    key = [function]
+    for argument in arguments:
+        if type(argument) not in [int, float, str, bool, type(None)]:
+            return None
+        key.append((type(argument), argument))
+    return tuple(key)
+
+
+def check_pure(function):
+    """Asserts that a memo function literal only computes its result from its arguments."""
+    problem = impurity(function["body"], local_names(function), function.get("name"))
+    assert not problem, f"Cannot memoize a function that {problem}."
+
+
+def local_names(function):
+    parameters = [parameter["value"] for parameter in function["parameters"]]
+    return set(parameters + assigned_names(function["body"]))
+
+
+def impurity(ast, names, own_name):
+    """What in ast makes a memo function impure, or None; names are the
+    variables it may read."""
+    if type(ast) is list:
+        for item in ast:
+            problem = impurity(item, names, own_name)
+            if problem:
+                return problem
+        return None
+    if type(ast) is not dict:
+        return None
+    tag = ast.get("tag")
+    if tag == "print":
+        return "prints"
+    if tag == "assign":
+        if ast["target"]["tag"] != "identifier":
+            return "assigns outside its locals"
+        return impurity(ast["value"], names, own_name)
+    if tag == "identifier" and ast["value"] not in names:
+        return f"reads '{ast['value']}', which is not one of its variables"
+    if tag == "call" and ast["function"]["tag"] == "identifier":
+        callee = ast["function"]["value"]
+        if callee not in names:
+            if callee != own_name:
+                return f"calls '{callee}', which is not itself"
+            return impurity(ast["arguments"], names, own_name)
+    if tag == "function":
+        return impurity(ast["body"], names | local_names(ast), own_name)
+    if tag == "for_range":
+        return impurity([ast["start"], ast["stop"], ast["do"]], names, own_name)
+    return impurity(list(ast.values()), names, own_name)
+
+
+def test_memo_cache():
+    print("testing memo cache...")
+    cache = MemoCache(size=2)
+    assert cache.get("a") == (False, None)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == (True, 1)
+    cache.put("c", 3)
+    # "b" was the least recently used
+    assert cache.get("b") == (False, None)
+    assert cache.get("a") == (True, 1)
+    assert cache.get("c") == (True, 3)
+    assert cache.statistics() == {"hits": 3, "misses": 2, "evictions": 1, "size": 2}
+
+
+def test_memo_key():
+    print("testing memo key...")
+    assert memo_key("f", [1, "a"]) == ("f", (int, 1), (str, "a"))
+    assert memo_key("f", [1]) != memo_key("f", [1.0])
+    assert memo_key("f", [1]) != memo_key("g", [1])
+    assert memo_key("f", [[1]]) is None
+    assert memo_key("f", [{}]) is None
+
+
+def test_check_pure():
+    print("testing check pure...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    for code in [
+        "memo function f(n) { if (n < 2) { return n }; return f(n - 1) + f(n - 2) }",
+        "memo function f(x) { y = x * 2; t = [y]; return t[0] }",
+        "memo function f(n) { g = function(k) { return k * n }; return g(2) + f(n - 1) }",
+        "memo function f(n) { s = 0; for i in range(n) { s = s + i }; return s }",
+    ]:
+        check_pure(parse(tokenize(code))["statements"][0]["value"])
+    for code, problem in [
+        ("memo function f(x) { print x }", "prints"),
+        ("memo function f(x) { if (x) { print } }", "prints"),
+        ("memo function f(x) { x[0] = 1 }", "assigns outside its locals"),
+        ("memo function f(x) { x.a = 1 }", "assigns outside its locals"),
+        ("memo function f(x) { return x + k }", "reads 'k', which is not one of its variables"),
+        ("memo function f(x) { return g(x) }", "calls 'g', which is not itself"),
+        ("memo function f(x) { h = function() { print x }; h() }", "prints"),
+        ("memo function f(x) { h = function() { return k }; return h() }", "reads 'k', which is not one of its variables"),
+        ("f = memo function(x) { return f(x - 1) }", "calls 'f', which is not itself"),
+    ]:
+        try:
+            check_pure(parse(tokenize(code))["statements"][0]["value"])
+            assert False, f"Should have refused {code}"
+        except AssertionError as e:
+            assert f"Cannot memoize a function that {problem}." == str(e), str(e)
+
+
+if __name__ == "__main__":
+    test_memo_cache()
+    test_memo_key()
+    test_check_pure()
+    print("done.")
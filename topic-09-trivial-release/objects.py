@@ -0,0 +1,274 @@
+import reprlib
+import sys
+
+# Object values.
+#
+# An object is an Object: a Shape, which lists its field names in the order
+# they were added and maps each to a slot, and a list of the field values by
+# slot. Objects that got the same fields in the same order share one Shape,
+# found by following the transitions from the empty shape, one per field
+# added. So the names are stored once per layout rather than once per object,
+# and a field read that has seen an object's shape before can go straight to
+# its slot.
+#
+# A field access with a constant name (`x.name`, `x["name"]`) keeps an inline
+# cache, a Site: the shape it last saw and the slot of the name in it. When
+# the next object has the same shape, which is the common case in a loop, the
+# read or write is an identity test and a list index. Otherwise load_field()
+# and store_field() take the slow way and cache the new shape.
+#
+# Shapes are never freed: a shape stays in its parent's transitions once made.
+# So their number is bounded. An object stops sharing shapes and keeps its
+# fields in a dict of its own (shape None) when it would get more than
+# max_shape_fields fields, when the shape it has already leads to
+# max_shape_transitions others, or when max_shapes shapes have been made.
+# Programs that make ever new field names, or lay out objects in ever new
+# orders, end up with dict objects rather than ever more shapes.
+#
+# Objects behave like the dicts they replace: they index, compare equal and
+# print the same way. Objects that come from outside a program, like the
+# values of an environment passed to evaluate(), may still be plain dicts;
+# is_object() accepts either.
+
+max_shape_fields = 64
+max_shape_transitions = 64
+max_shapes = 4096
+
+
+class Shape:
+    """The field names of objects laid out alike, and the slot of each."""
+
+    __slots__ = ("keys", "slots", "transitions")
+
+    # shapes made so far, of at most max_shapes
+    made = 0
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.slots = {key: slot for slot, key in enumerate(keys)}
+        # field name: the shape of an object of this shape once it gets the field
+        self.transitions = {}
+        Shape.made += 1
+
+    def with_key(self, key):
+        """The shape with key added, or None when there may be no more shapes."""
+        shape = self.transitions.get(key)
+        if shape is None:
+            if (
+                len(self.keys) >= max_shape_fields
+                or len(self.transitions) >= max_shape_transitions
+                or Shape.made >= max_shapes
+            ):
+                return None
+            shape = self.transitions[key] = Shape(self.keys + (key,))
+        return shape
+
+
+empty_shape = Shape(())
+
+# the shape a Site has before its first access, which no object has
+unseen_shape = Shape(())
+
+
+class Object:
+    """An object value: its shape and its field values by slot."""
+
+    __slots__ = ("shape", "values")
+
+    def __init__(self):
+        self.shape = empty_shape
+        self.values = []
+
+    def __getitem__(self, key):
+        if self.shape is None:
+            return self.values[key]
+        return self.values[self.shape.slots[key]]
+
+    def __setitem__(self, key, value):
+        shape = self.shape
+        if shape is None:
+            self.values[key] = value
+            return
+        slot = shape.slots.get(key)
+        if slot is not None:
+            self.values[slot] = value
+            return
+        shape = shape.with_key(key)
+        if shape is not None:
+            self.shape = shape
+            self.values.append(value)
+        else:
+            self.values = dict(zip(self.shape.keys, self.values))
+            self.values[key] = value
+            self.shape = None
+
+    def __contains__(self, key):
+        if self.shape is None:
+            return key in self.values
+        return key in self.shape.slots
+
+    def __len__(self):
+        return len(self.values)
+
+    def items(self):
+        if self.shape is None:
+            return list(self.values.items())
+        return list(zip(self.shape.keys, self.values))
+
+    def __eq__(self, other):
+        if isinstance(other, Object):
+            other = dict(other.items())
+        if isinstance(other, dict):
+            return dict(self.items()) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    @reprlib.recursive_repr("{...}")
+    def __repr__(self):
+        return "{" + ", ".join(f"{key!r}: {value!r}" for key, value in self.items()) + "}"
+
+
+def is_object(value):
+    return value.__class__ is Object or type(value) is dict
+
+
+class Site:
+    """The inline cache of one field access with a constant name."""
+
+    __slots__ = ("key", "shape", "slot")
+
+    def __init__(self, key):
+        self.key = key
+        self.shape = unseen_shape
+        self.slot = 0
+
+
+def load_field(base, site):
+    """base's field site.key, caching its slot in site; the slow way of a field read."""
+    if base.__class__ is Object and base.shape is not None:
+        slot = base.shape.slots[site.key]
+        site.shape = base.shape
+        site.slot = slot
+        return base.values[slot]
+    assert type(base) is dict or base.__class__ is Object
+    return base[site.key]
+
+
+def store_field(base, site, value):
+    """Sets base's field site.key, caching its slot in site; the slow way of a field write."""
+    assert type(base) is dict or base.__class__ is Object
+    base[site.key] = value
+    if base.__class__ is Object and base.shape is not None:
+        site.shape = base.shape
+        site.slot = base.shape.slots[site.key]
+
+
+def test_object():
+    print("testing object...")
+    object = Object()
+    object["a"] = 1
+    object["b"] = [2]
+    object["a"] = 3
+    assert object["a"] == 3 and object["b"] == [2]
+    assert object.shape.keys == ("a", "b")
+    assert "a" in object and "c" not in object and len(object) == 2
+    assert object == {"a": 3, "b": [2]} and {"a": 3, "b": [2]} == object
+    assert object != {"b": [2], "a": 4}
+    assert repr(object) == "{'a': 3, 'b': [2]}" == f"{object}"
+    object["self"] = object
+    assert repr(object) == "{'a': 3, 'b': [2], 'self': {...}}"
+    try:
+        object["c"]
+        assert False, "Should have a KeyError for 'c'."
+    except KeyError as e:
+        assert str(e) == "'c'"
+
+
+def test_shapes_are_shared():
+    print("testing shapes are shared...")
+    first, second, third = Object(), Object(), Object()
+    for object in [first, second]:
+        object["x"] = 1
+        object["y"] = 2
+    third["y"] = 1
+    third["x"] = 2
+    assert first.shape is second.shape
+    assert first.shape is not third.shape
+    assert first.shape.slots == {"x": 0, "y": 1}
+    # objects laid out alike take less memory than dicts
+    assert sys.getsizeof(first) + sys.getsizeof(first.values) < sys.getsizeof({"x": 1, "y": 2})
+
+
+def test_many_fields():
+    print("testing many fields...")
+    object = Object()
+    for index in range(max_shape_fields + 10):
+        object[f"field{index}"] = index
+    assert object.shape is None
+    assert object["field70"] == 70 and len(object) == max_shape_fields + 10
+    object["field0"] = "a"
+    assert object == {f"field{index}": "a" if index == 0 else index for index in range(74)}
+
+
+def test_shapes_are_bounded():
+    print("testing shapes are bounded...")
+    global empty_shape
+
+    def reachable(shape):
+        return 1 + sum(reachable(next) for next in shape.transitions.values())
+
+    # from a root of its own, so the other tests' shapes do not count
+    saved = empty_shape, Shape.made
+    empty_shape = Shape(())
+    Shape.made = 1
+    try:
+        objects = []
+        for index in range(20_000):
+            object = Object()
+            object[f"name{index}"] = index
+            objects.append(object)
+        assert len(empty_shape.transitions) == max_shape_transitions
+        assert sum(object.shape is None for object in objects) == 20_000 - max_shape_transitions
+        assert objects[-1] == {"name19999": 19999}
+        # however many orders fields are added in
+        for index in range(20_000):
+            object = Object()
+            fields = [index % 7, index % 11, index % 13, index % 17, index % 19]
+            for field in fields:
+                object[f"field{field}"] = field
+            assert object == {f"field{field}": field for field in fields}
+        assert reachable(empty_shape) == Shape.made <= max_shapes
+    finally:
+        empty_shape, Shape.made = saved
+
+
+def test_sites():
+    print("testing sites...")
+    site = Site("x")
+    first, second = Object(), Object()
+    first["x"], first["y"] = 1, 2
+    second["y"], second["x"] = 3, 4
+    assert load_field(first, site) == 1
+    assert site.shape is first.shape and site.slot == 0
+    assert load_field(second, site) == 4
+    assert site.shape is second.shape and site.slot == 1
+    store_field(first, site, 5)
+    assert first["x"] == 5 and site.shape is first.shape
+    assert load_field({"x": 6}, site) == 6
+    store_field(second, Site("z"), 7)
+    assert second == {"y": 3, "x": 4, "z": 7}
+    try:
+        load_field([1], site)
+        assert False, "Should refuse a field of a list."
+    except AssertionError:
+        pass
+
+
+if __name__ == "__main__":
+    test_object()
+    test_shapes_are_shared()
+    test_many_fields()
+    test_shapes_are_bounded()
+    test_sites()
+    print("done.")
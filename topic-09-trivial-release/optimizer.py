@@ -0,0 +1,573 @@
+import copy
+import operator
+
+import evaluator
+from evaluator import evaluate
+from resolver import assigned_names
+
+# Constant folding and dead branch elimination, run between parse and evaluate.
+#
+# An operator whose operands are all literals is replaced by a literal of its
+# value, computed with the same Python operation evaluate() uses. Operations
+# that would fail at run time (1/0, "a" < 1, ...) are left as they are, so
+# the program still fails the same way when it gets there. && and || fold as
+# soon as their left side is a literal, since it decides whether the right
+# side is evaluated at all.
+#
+# A string longer than max_folded_length is not folded: it would be built at
+# compile time and stored in the AST, the cache and compiled files, where
+# computing it at run time costs nothing until the code runs.
+#
+# An if with a literal condition is replaced by the statements of the branch
+# it takes, and a while with a false literal condition by nothing; the
+# branches it rules out are not optimized first. When such a
+# statement was the last of its list, an empty statement list takes its place,
+# so the list still has no value, as the if or while had none.
+#
+# hoist_invariants() is a separate pass that moves loop-invariant expressions
+# out of while loops; see below.
+
+# the operations evaluate() applies; fold_binary() checks for division by zero
+binary_operations = {**evaluator.binary_operations, "/": operator.truediv}
+
+unary_operations = {
+    "negate": operator.neg,
+    "!": operator.not_,
+    "not": operator.not_,
+}
+
+literal_tags = {int: "number", float: "number", str: "string", bool: "boolean"}
+
+max_folded_length = 4096
+
+
+def optimize(ast):
+    """Returns an optimized copy of a program's AST and the number of nodes removed."""
+    optimized = optimize_node(ast)
+    return optimized, count_nodes(ast) - count_nodes(optimized)
+
+
+def count_nodes(ast):
+    if type(ast) is list:
+        return sum(count_nodes(item) for item in ast)
+    if type(ast) is not dict:
+        return 0
+    return ("tag" in ast) + sum(count_nodes(value) for value in ast.values())
+
+
+def is_literal(ast):
+    return ast["tag"] in ["number", "string", "boolean"]
+
+
+def literal(value):
+    return {"tag": literal_tags[type(value)], "value": value}
+
+
+def optimize_node(ast):
+    if type(ast) is list:
+        return [optimize_node(item) for item in ast]
+    if type(ast) is not dict:
+        return ast
+    node = dict(ast)
+    if "condition" in ast:
+        node["condition"] = optimize_node(ast["condition"])
+    dead = dead_branches(node)
+    for key, value in ast.items():
+        if key != "condition" and key not in dead:
+            node[key] = optimize_node(value)
+    tag = node.get("tag")
+    if tag in binary_operations:
+        return fold_binary(node)
+    if tag in unary_operations:
+        return fold_unary(node)
+    if tag in ["&&", "||"]:
+        return fold_logical(node)
+    if tag in ["statement_list", "program"]:
+        return eliminate_dead_statements(node)
+    return node
+
+
+def dead_branches(node):
+    """The keys of the branches of an if or while that its literal condition rules out."""
+    condition = node.get("condition")
+    if condition is None or not is_literal(condition):
+        return []
+    if node["tag"] == "if":
+        return ["else"] if condition["value"] else ["then"]
+    if node["tag"] == "while" and not condition["value"]:
+        return ["do"]
+    return []
+
+
+def fold_binary(node):
+    left, right = node["left"], node["right"]
+    if not (is_literal(left) and is_literal(right)):
+        return node
+    if node["tag"] == "/" and right["value"] == 0:
+        return node
+    if node["tag"] == "*" and repeated_length(left["value"], right["value"]) > max_folded_length:
+        # not even built
+        return node
+    try:
+        value = binary_operations[node["tag"]](left["value"], right["value"])
+    except TypeError:
+        return node
+    if type(value) not in literal_tags:
+        return node
+    if type(value) is str and len(value) > max_folded_length:
+        return node
+    return literal(value)
+
+
+def repeated_length(left, right):
+    """The length of the string left * right, or 0 if it is not a string repetition."""
+    if type(right) is str:
+        left, right = right, left
+    if type(left) is str and type(right) in [int, bool]:
+        return len(left) * right
+    return 0
+
+
+def fold_unary(node):
+    value = node["value"]
+    if not is_literal(value):
+        return node
+    try:
+        return literal(unary_operations[node["tag"]](value["value"]))
+    except TypeError:
+        return node
+
+
+def fold_logical(node):
+    left = node["left"]
+    if not is_literal(left):
+        return node
+    # the left value is the result when it decides it, else the right one is
+    if node["tag"] == "&&":
+        return node["right"] if left["value"] else left
+    return left if left["value"] else node["right"]
+
+
+def eliminate_dead_statements(node):
+    statements = []
+    for statement in node["statements"]:
+        statements += live_statements(statement)
+    # None marks where a removed if or while was; it only matters as the last
+    # statement, where it stands for the list's value
+    if statements and statements[-1] is None:
+        statements[-1] = {"tag": "statement_list", "statements": []}
+    return dict(node, statements=[statement for statement in statements if statement])
+
+
+def live_statements(statement):
+    """The statements that run in place of statement, None standing for one removed."""
+    if statement["tag"] == "if" and is_literal(statement["condition"]):
+        if statement["condition"]["value"]:
+            branch = statement["then"]
+        else:
+            branch = statement.get("else")
+        if branch is None:
+            return [None]
+        if branch["tag"] == "if":
+            return live_statements(branch)
+        return branch["statements"] + [None]
+    if statement["tag"] == "while" and is_literal(statement["condition"]):
+        if not statement["condition"]["value"]:
+            return [None]
+    return [statement]
+
+
+# LOOP INVARIANTS
+#
+# An expression in a while loop is invariant if it only reads variables the
+# loop does not assign. Assignment always binds in the current scope, so a
+# function called from the loop cannot change them either. Such an expression
+# built from the operators folded above, on literals and variables, always has
+# the same value in the loop, so it is computed once before the loop into a
+# "$invariant" variable that the loop then reads. Calls and indexing are never
+# hoisted: a call may have effects, and indexing reads lists and objects that
+# the loop may change.
+#
+# Only expressions evaluated every time the code around them runs are hoisted:
+# not ones in if branches, nested loop bodies, for loop steps, function
+# literals or the right side of && and ||. The condition runs before the first iteration, so its
+# invariants are computed just before the loop. The body may not run at all,
+# so its invariants are only computed once the condition has held once:
+#
+#   while (c) { b }   becomes   if (c) { $invariant0 = ...; while (c) { b } }
+#
+# which evaluates c once more, so it is only done when c makes no calls.
+#
+# A hoisted expression may fail ("a" + 1), and then it must fail before
+# anything visible has happened, as it would have in the loop. So nothing is
+# hoisted from a condition that makes calls, and body invariants are only
+# taken from the statements up to the first one that prints, assigns, calls
+# or loops (that one included, as its own effect comes after its
+# expressions). Statements from one containing a call, return, break or
+# continue on are left alone. When the loop fails either way, the error
+# raised may still be a different one of the two.
+#
+# Outside functions the $invariant variables are globals. They are listed in
+# the program's "temporaries", which every backend removes from the
+# environment when the program ends, however it ends: a return or a failure
+# in the loop ends the program too. In a function they are locals and go with
+# the call. Invariants are only moved out of while loops, not for loops.
+
+hoistable_tags = set(binary_operations) | set(unary_operations) | {"&&", "||"}
+
+# statements with these in them may have effects a hoisted expression must not precede
+effect_tags = ["print", "assign", "call", "while", "for", "for_range"]
+
+
+def hoist_invariants(ast):
+    """Returns a copy of a program's AST with loop invariants computed before their
+    loops, and the number of expressions hoisted."""
+    names = []
+    temporaries = []
+    hoisted = hoist_node(ast, names, temporaries)
+    if temporaries:
+        hoisted["temporaries"] = temporaries
+    return hoisted, len(names)
+
+
+def hoist_node(ast, names, temporaries):
+    """temporaries collects the names hoisted outside functions; it is None in one."""
+    if type(ast) is list:
+        return [hoist_node(item, names, temporaries) for item in ast]
+    if type(ast) is not dict:
+        return ast
+    if ast.get("tag") == "function":
+        temporaries = None
+    node = {key: hoist_node(value, names, temporaries) for key, value in ast.items()}
+    if node.get("tag") in ["statement_list", "program"]:
+        statements = []
+        for statement in node["statements"]:
+            if statement["tag"] == "while":
+                statements += hoist_loop(statement, names, temporaries)
+            else:
+                statements.append(statement)
+        node["statements"] = statements
+    return node
+
+
+def hoist_loop(loop, names, temporaries):
+    """The statements that run in place of a while loop, invariants hoisted."""
+    if contains(loop["condition"], "call"):
+        return [loop]
+    assigned = set(assigned_names(loop))
+    before = {}
+    condition = replace_invariants(loop["condition"], assigned, before, names)
+    first = {}
+    statements = []
+    for statement in loop["do"]["statements"]:
+        if any(contains(statement, tag) for tag in ["call", "return", "break", "continue"]):
+            break
+        statements.append(replace_invariants(statement, assigned, first, names))
+        if any(contains(statement, tag) for tag in effect_tags):
+            break
+    body = dict(loop["do"], statements=statements + loop["do"]["statements"][len(statements) :])
+    hoisted = [assignment(name, value) for name, value in before.values()]
+    loop = dict(loop, condition=condition, do=body)
+    if first:
+        then = [assignment(name, value) for name, value in first.values()] + [loop]
+        loop = {
+            "tag": "if",
+            "condition": copy.deepcopy(condition),
+            "then": {"tag": "statement_list", "statements": then},
+        }
+    if temporaries is not None:
+        temporaries += [name for name, _ in list(before.values()) + list(first.values())]
+    return hoisted + [loop]
+
+
+def assignment(name, value):
+    return {"tag": "assign", "target": {"tag": "identifier", "value": name}, "value": value}
+
+
+def is_invariant(ast, assigned):
+    tag = ast["tag"]
+    if tag == "identifier":
+        return ast["value"] not in assigned
+    if is_literal(ast):
+        return True
+    if tag not in hoistable_tags:
+        return False
+    if tag == "/" and not (is_literal(ast["right"]) and ast["right"]["value"] != 0):
+        # a division by a variable might fail where the loop never divides
+        return False
+    children = [ast["value"]] if tag in unary_operations else [ast["left"], ast["right"]]
+    return all(is_invariant(child, assigned) for child in children)
+
+
+def replace_invariants(ast, assigned, hoisted, names):
+    """
+    A copy of ast with each invariant expression it always evaluates replaced by
+    a variable; hoisted maps a key of each replaced expression to its variable
+    name and the expression, so repeated expressions share one variable.
+    """
+    tag = ast["tag"]
+    if tag in hoistable_tags and is_invariant(ast, assigned):
+        key = repr(ast)
+        if key not in hoisted:
+            names.append(f"$invariant{len(names)}")
+            hoisted[key] = (names[-1], ast)
+        return {"tag": "identifier", "value": hoisted[key][0]}
+    # the parts of a node that run whenever the node does
+    if tag in ["&&", "||"]:
+        parts = ["left"]
+    elif tag in ["if", "while"]:
+        parts = ["condition"]
+    elif tag == "for":
+        parts = ["initial", "condition"]
+    elif tag == "for_range":
+        parts = ["start", "stop"]
+    elif tag == "function":
+        parts = []
+    else:
+        parts = [key for key in ast if key != "tag"]
+    node = dict(ast)
+    for key in parts:
+        node[key] = replace_all(ast[key], assigned, hoisted, names)
+    return node
+
+
+def replace_all(value, assigned, hoisted, names):
+    if type(value) is list:
+        return [replace_all(item, assigned, hoisted, names) for item in value]
+    if type(value) is not dict:
+        return value
+    if "tag" not in value:
+        # the key and value of an object literal item
+        return {key: replace_all(item, assigned, hoisted, names) for key, item in value.items()}
+    return replace_invariants(value, assigned, hoisted, names)
+
+
+def contains(ast, tag):
+    """Whether ast has a node with tag outside of any function literal in it."""
+    if type(ast) is list:
+        return any(contains(item, tag) for item in ast)
+    if type(ast) is not dict or ast.get("tag") == "function":
+        return False
+    return ast.get("tag") == tag or any(contains(value, tag) for value in ast.values())
+
+
+def test_fold_constants():
+    print("testing fold constants...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    for code, value in [
+        ("60*60*24", 86400),
+        ('"a" + "b"', "ab"),
+        ("1 + 2 * 3 - 4 / 2", 5.0),
+        ("-(2 + 3)", -5),
+        ("!0", True),
+        ("not 1", False),
+        ("1 < 2", True),
+        ("2 >= 3", False),
+        ('"a" == "a"', True),
+        ("1 != 1", False),
+        ("true && 3", 3),
+        ("0 && x", 0),
+        ("0 || 2", 2),
+        ("2 || x", 2),
+    ]:
+        ast, removed = optimize(parse(tokenize(code)))
+        assert ast["statements"] == [literal(value)], f"{code}: {ast}"
+        assert type(ast["statements"][0]["value"]) is type(value)
+        assert removed > 0
+    # long strings are left to be made at run time
+    for code in ['"ab" * 50000000', '3 * "ab" * 1000000000', '"a" * 4000 + "b" * 100']:
+        ast, _ = optimize(parse(tokenize(code)))
+        assert not is_literal(ast["statements"][0]), code
+    assert optimize(parse(tokenize('"ab" * 2048')))[0]["statements"] == [literal("ab" * 2048)]
+    ast, removed = optimize(parse(tokenize("x * (60 * 60) + (1 && y)")))
+    assert ast["statements"][0] == parse(tokenize("x * 3600 + y"))["statements"][0]
+    assert removed == 4
+
+
+def test_fold_leaves_failures():
+    print("testing fold leaves failures...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    for code in ["1 / 0", '"a" < 1', '"a" - "b"', '-"a"', "x + 1", "x && 1"]:
+        ast = parse(tokenize(code))
+        assert optimize(ast) == (ast, 0), code
+
+
+def test_eliminate_dead_branches():
+    print("testing eliminate dead branches...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    for code, expected in [
+        ("if (1) { x = 1 } else { x = 2 }; y = 3", "x = 1; y = 3"),
+        ("if (0) { x = 1 } else { x = 2 }; y = 3", "x = 2; y = 3"),
+        ("if (0) { x = 1 }; y = 3", "y = 3"),
+        ("while (0) { x = 1 }; y = 3", "y = 3"),
+        ("while (1 - 1) { x = 1 }; y = 3", "y = 3"),
+        ("if (0) { x = 1 } else if (2 > 1) { x = 2 } else { x = 3 }; y", "x = 2; y"),
+        ("if (x) { if (0) { y = 1 }; z = 2 }", "if (x) { z = 2 }"),
+    ]:
+        ast, removed = optimize(parse(tokenize(code)))
+        assert ast == parse(tokenize(expected)), f"{code}: {ast}"
+        assert removed == count_nodes(parse(tokenize(code))) - count_nodes(ast)
+    # the branches a literal condition rules out are removed without being optimized
+    for code, dead in [
+        ("if (0) { x = 1 }", ["then"]),
+        ("if (1) { x = 1 } else { x = 2 }", ["else"]),
+        ("while (0) { x = 1 }", ["do"]),
+        ("while (1) { x = 1 }", []),
+        ("if (x) { x = 1 }", []),
+    ]:
+        assert dead_branches(parse(tokenize(code))["statements"][0]) == dead, code
+    # a removed last statement leaves the program without a value
+    ast, _ = optimize(parse(tokenize("3; if (1) { 4 }")))
+    assert evaluate(ast, {}) == (None, False)
+    assert ast["statements"][-1] == {"tag": "statement_list", "statements": []}
+
+
+loop_programs = [
+    "i = 0; n = 5; while (i < n * 2) { i = i + 1 }; i",
+    "i = 0; a = 3; b = 4; t = 0; while (i < 10) { t = t + (a * b - 1); i = i + 1 }; t",
+    "i = 0; a = 3; t = 0; while (i < 10) { t = t + a * 2; a = a + 1; i = i + 1 }; t",
+    "i = 0; while (i < 0) { x = 1 / 0; i = i + 1 }; i",
+    "i = 0; while (i < 0) { x = y + 1; i = i + 1 }; i",
+    "i = 0; s = \"\"; while (i < 3) { s = s + (\"a\" + \"-\"); i = i + 1 }; s",
+    "i = 0; t = 0; k = 2; while (i < 3) { if (i > 5) { t = t + x * 2 }; i = i + 1 }; t",
+    "i = 0; n = 4; while (i < n && 1 / n < 1) { i = i + 1 }; i",
+    "i = 0; n = 0; while (n > 0 && i < 10 / n) { i = i + 1 }; i",
+    """
+    i = 0; t = 0; n = 3; m = 2;
+    while (i < n * m) {
+        j = 0;
+        while (j < n + m) { t = t + n * m + j; j = j + 1 };
+        i = i + 1
+    };
+    t
+    """,
+    """
+    function f(items, k) {
+        i = 0;
+        while (i < k * 2) {
+            if (items[i] == k + 1) { return i };
+            i = i + 1
+        };
+        return -1
+    };
+    [f([9, 9, 9, 9, 4, 9], 3), f([1, 2], 1), f([], 0)]
+    """,
+    """
+    calls = {"count": 0};
+    function limit() { calls.count = calls.count + 1; return 3 };
+    i = 0; a = 2; t = 0;
+    while (i < limit()) { t = t + a * a; i = i + 1 };
+    [t, calls.count]
+    """,
+    """
+    i = 0; x = [1, 2, 3]; t = 0;
+    while (i < 3) { t = t + x[i] * (x[0] + 1); x[0] = i; i = i + 1 };
+    t
+    """,
+    "i = 0; a = 1; while (i < 3) { return a + 1; i = i + 1 }",
+    # what the loop printed or assigned before an invariant fails is kept
+    'i = 0; s = "a"; while (i < 2) { print i; t = s + 1; i = i + 1 }; t',
+    'i = 0; while (i < 2) { print i; t = -"a"; i = i + 1 }',
+    "i = 0; x = [1]; while (i < 2) { print i; t = x < 1; i = i + 1 }",
+    'i = 0; s = "a"; while (i < 2) { i = i + 1; t = s + 1 }',
+    'i = 0; s = "a"; while (i < 2) { while (i < 1) { i = i + 1 }; t = s + 1 }',
+    'function f(s) { print s; return 3 }; i = 0; s = "a"; while (i < f(s) + s * 2) { i = i + 1 }',
+    # a return or a failure in the loop leaves no temporaries behind either
+    "k = 2; i = 0; while (i < k * 3) { i = i + 1; if (i == 2) { return i } }; 9",
+    'k = 2; s = "a"; i = 0; while (i < k * 3) { i = i + 1; if (i == 2) { t = s + 1 } }; 9',
+]
+
+
+def run_hoisted(ast, environment, run=evaluate):
+    """Runs a program with its invariants hoisted."""
+    return run(hoist_invariants(ast)[0], environment)
+
+
+def test_hoist_invariants():
+    print("testing hoist invariants...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    ast, hoisted = hoist_invariants(parse(tokenize("while (i < n * 2) { t = t + a * b; i = i + 1 }")))
+    assert hoisted == 2
+    assert ast.pop("temporaries") == ["$invariant0", "$invariant1"]
+    expected = parse(
+        tokenize(
+            """
+            _invariant0 = n * 2;
+            if (i < _invariant0) {
+                _invariant1 = a * b;
+                while (i < _invariant0) { t = t + _invariant1; i = i + 1 }
+            }
+            """
+        )
+    )
+    assert repr(ast) == repr(expected).replace("'_invariant", "'$invariant")
+    # variables assigned in the loop, calls and indexing are not invariant
+    for code in [
+        "while (i < n) { n = n - 1; t = n * 2; i = i + 1 }",
+        "while (i < f(n)) { i = i + 1 }",
+        "while (i < x[0] * 2) { i = i + 1 }",
+        "while (i < 3) { if (i) { t = a * b }; i = i + 1 }",
+        "while (i < 3) { t = 1 / a; i = i + 1 }",
+        "while (i < 3 || a * b) { i = i + 1 }",
+    ]:
+        ast = parse(tokenize(code))
+        assert hoist_invariants(ast) == (ast, 0), code
+    # body invariants are only hoisted when the condition can be evaluated again
+    ast, hoisted = hoist_invariants(parse(tokenize("while (i < f()) { t = a * b; i = i + 1 }")))
+    assert hoisted == 0
+    # and never from after a statement with effects
+    for code in [
+        "while (i < 3) { print i; t = a * b; i = i + 1 }",
+        "while (i < 3) { i = i + 1; t = a * b }",
+        "while (i < 3) { f(); t = a * b; i = i + 1 }",
+        "while (i < 3) { x = [f(), a * b]; i = i + 1 }",
+        "while (i < 3) { if (i) { print i }; t = a * b; i = i + 1 }",
+    ]:
+        ast = parse(tokenize(code))
+        assert hoist_invariants(ast) == (ast, 0), code
+    _, hoisted = hoist_invariants(parse(tokenize("while (i < 3) { print a * b; print a * b; i = i + 1 }")))
+    assert hoisted == 1
+    # the temporaries are gone once the program is done, but for locals of a function
+    environment = {}
+    evaluate(hoist_invariants(parse(tokenize(loop_programs[1])))[0], environment)
+    assert environment == {"i": 10, "a": 3, "b": 4, "t": 110}
+    ast, hoisted = hoist_invariants(parse(tokenize("function f(n) { while (n < a * b) { n = n + 1 } }")))
+    assert hoisted == 1 and "temporaries" not in ast
+
+
+def test_hoist_same_as_evaluate():
+    print("testing hoist same as evaluate...")
+    from differential import check_programs, check_same_as_evaluate
+    import closure_compiler
+    import stack_evaluator
+    import vm
+
+    for run in [evaluate, stack_evaluator.evaluate, closure_compiler.run, vm.run]:
+        for code in loop_programs:
+            check_same_as_evaluate(lambda ast, environment: run_hoisted(ast, environment, run), code)
+    check_programs(run_hoisted)
+
+
+def test_optimize_same_as_evaluate():
+    print("testing optimize same as evaluate...")
+    from differential import check_programs
+
+    check_programs(lambda ast, environment: evaluate(optimize(ast)[0], environment))
+
+
+if __name__ == "__main__":
+    test_fold_constants()
+    test_fold_leaves_failures()
+    test_eliminate_dead_branches()
+    test_optimize_same_as_evaluate()
+    test_hoist_invariants()
+    test_hoist_same_as_evaluate()
+    print("done.")
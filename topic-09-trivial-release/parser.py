@@ -1,4 +1,4 @@
-from tokenizer import tokenize
+from tokenizer import tokenize, tokenize_stream
 from pprint import pprint
 
 # NOTE - ADD simple-expression = ... "(" expression ")"
@@ -9,7 +9,7 @@ grammar = """
 
     list_literal = "[" expression { "," expression } "]" ;
     object_literal = "{" [ expression ":" expression { "," expression ":" expression } ] "}" ;
-    function_literal = "function" "(" [ identifier { "," identifier } ] ")" statement_list ;
+    function_literal = [ "memo" ] "function" "(" [ identifier { "," identifier } ] ")" statement_list ;
 
     complex_expression = simple_expression { ("[" expression "]") | ("." identifier) | "(" [ expression { "," expression } ] ")" } ;
 
@@ -26,17 +26,99 @@ grammar = """
     assignment_statement = expression [ "=" expression ] ;
     return_statement = "return" [ expression ] ;
     print_statement = "print" [ expression ] ;
-    function_statement = "function" identifier "(" [ identifier { "," identifier } ] ")" statement_list ;
+    function_statement = [ "memo" ] "function" identifier "(" [ identifier { "," identifier } ] ")" statement_list ;
 
     if_statement = "if" "(" expression ")" statement_list [ "else" (if_statement | statement_list) ] ;
     while_statement = "while" "(" expression ")" statement_list ;
+    for_statement = "for" ( ( "(" [ assignment_statement ] ";" [ expression ] ";" [ assignment_statement ] ")" ) | ( identifier "in" "range" "(" expression [ "," expression ] ")" ) ) statement_list ;
+    break_statement = "break" ;
+    continue_statement = "continue" ;
     statement_list = "{" statement { ";" statement } "}" ;
 
-    statement = if_statement | while_statement | function_statement | return_statement | print_statement | assignment_statement ;
+    statement = if_statement | while_statement | for_statement | break_statement | continue_statement | function_statement | return_statement | print_statement | assignment_statement ;
 
     program = [ statement { ";" statement } ] ;
     """
 
+# TOKEN STREAMS
+
+
+class TokenStream:
+    """
+    Tokens pulled from an iterator (e.g. tokenize_stream) as the parser needs them.
+
+    stream[0] is the current token and stream[1:] is the rest of the stream, so
+    the parse functions consume a stream exactly like a token list. Only one
+    token is read ahead, and tokens the parser has moved past are released.
+    """
+
+    __slots__ = ("tokens", "token", "rest")
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.token = next(tokens, None)
+        self.rest = None
+
+    def __getitem__(self, key):
+        if key == 0:
+            return self.token
+        assert key == slice(1, None), f"Token streams only support [0] and [1:], not {key}"
+        if self.rest is None:
+            self.rest = TokenStream(self.tokens)
+        return self.rest
+
+
+class TokenCursor:
+    """
+    A position in a token list.
+
+    cursor[0] is the token at the position and cursor[1:] is a cursor one
+    token further on. Every cursor shares the same list, so moving past a
+    token costs the same however many tokens remain (slicing the list itself
+    copies them all, which made parsing quadratic in program length).
+    """
+
+    __slots__ = ("tokens", "index")
+
+    def __init__(self, tokens, index=0):
+        self.tokens = tokens
+        self.index = index
+
+    def __getitem__(self, key):
+        if key == 0:
+            return self.tokens[self.index]
+        assert key == slice(1, None), f"Token cursors only support [0] and [1:], not {key}"
+        return TokenCursor(self.tokens, self.index + 1)
+
+
+def test_token_cursor():
+    print("testing token cursor...")
+    tokens = tokenize("x + 1")
+    cursor = TokenCursor(tokens)
+    assert cursor[0] is tokens[0]
+    assert cursor[1:][0] is tokens[1]
+    assert cursor[1:][1:][1:][0]["tag"] is None
+    assert cursor[1:].tokens is tokens
+    ast, cursor = parse_expression(TokenCursor(tokens))
+    assert ast == parse_expression(tokens)[0]
+    assert cursor.index == 3
+
+
+def test_token_stream():
+    print("testing token stream...")
+    tokens = TokenStream(tokenize_stream("x + 1"))
+    assert tokens[0]["tag"] == "identifier"
+    assert tokens[1:] is tokens[1:]
+    assert tokens[1:][0]["tag"] == "+"
+    assert tokens[1:][1:][1:][0]["tag"] is None
+    for code in [
+        "x = 3; function g(q) {return [1,2,3,q]}; g(4)",
+        'if (x < 2) {print "a"} else {while (x) {x = x - 1}}',
+        'y = {"a": [1, 2], "b": function(a, b) {return a * b}}',
+    ]:
+        assert parse(tokenize_stream(code)) == parse(tokenize(code))
+
+
 # BASIC EXPRESSIONS
 
 
@@ -47,34 +129,34 @@ def parse_simple_expression(tokens):
 
     token = tokens[0]
 
-    if token["tag"] in {"identifier", "boolean", "number", "string"}:
-        return {"tag": token["tag"], "value": token["value"]}, tokens[1:]
+    if token.tag in {"identifier", "boolean", "number", "string"}:
+        return {"tag": token.tag, "value": token.value}, tokens[1:]
 
-    if token["tag"] == "[":
+    if token.tag == "[":
         return parse_list_literal(tokens)
 
-    if token["tag"] == "{":
+    if token.tag == "{":
         return parse_object_literal(tokens)
 
-    if token["tag"] == "-":
+    if token.tag == "-":
         value, tokens = parse_simple_expression(tokens[1:])
         return {"tag": "negate", "value": value}, tokens
 
-    if token["tag"] == "!":
+    if token.tag == "!":
         value, tokens = parse_simple_expression(tokens[1:])
         return {"tag": "not", "value": value}, tokens
 
-    if token["tag"] == "function":
+    if token.tag in ["function", "memo"]:
         return parse_function_literal(tokens)
 
-    if token["tag"] == "(":
+    if token.tag == "(":
         ast, tokens = parse_expression(tokens[1:])
         assert (
-            tokens[0]["tag"] == ")"
-        ), f"Expected ')' at position {tokens[0]['position']}"
+            tokens[0].tag == ")"
+        ), f"Expected ')' at position {tokens[0].position}"
         return ast, tokens[1:]
 
-    assert False, f"Unexpected token '{token['tag']}' at position {token['position']}"
+    assert False, f"Unexpected token '{token.tag}' at position {token.position}"
 
 
 def test_parse_simple_expression():
@@ -148,16 +230,16 @@ def parse_list_literal(tokens):
     """
     list_literal = "[" expression { "," expression } "]" ;
     """
-    assert tokens[0]["tag"] == "[", f"Expected '[' at position {tokens[0]['position']}"
+    assert tokens[0].tag == "[", f"Expected '[' at position {tokens[0].position}"
     tokens = tokens[1:]
     items = []
-    if tokens[0]["tag"] != "]":
-        value, tokens = parse_simple_expression(tokens)
+    if tokens[0].tag != "]":
+        value, tokens = parse_expression(tokens)
         items.append(value)
-        while tokens[0]["tag"] == ",":
-            value, tokens = parse_simple_expression(tokens[1:])
+        while tokens[0].tag == ",":
+            value, tokens = parse_expression(tokens[1:])
             items.append(value)
-    assert tokens[0]["tag"] == "]", f"Expected ']' at position {tokens[0]['position']}"
+    assert tokens[0].tag == "]", f"Expected ']' at position {tokens[0].position}"
     return {"tag": "list", "items": items}, tokens[1:]
 
 
@@ -192,32 +274,45 @@ def test_parse_list_literal():
     ast, tokens = parse_list_literal(tokenize("[]"))
     assert ast == {"items": [], "tag": "list"}
 
+    ast, tokens = parse_list_literal(tokenize("[1+2,x]"))
+    assert ast == {
+        "tag": "list",
+        "items": [
+            {
+                "tag": "+",
+                "left": {"tag": "number", "value": 1},
+                "right": {"tag": "number", "value": 2},
+            },
+            {"tag": "identifier", "value": "x"},
+        ],
+    }
+
 
 def parse_object_literal(tokens):
     """
     object_literal = "{" [ expression ":" expression { "," expression ":" expression } ] "}" ;
     """
-    assert tokens[0]["tag"] == "{", f"Expected '{{' at position {tokens[0]['position']}"
+    assert tokens[0].tag == "{", f"Expected '{{' at position {tokens[0].position}"
     tokens = tokens[1:]
     items = []
-    if tokens[0]["tag"] != "}":
-        key, tokens = parse_simple_expression(tokens)
+    if tokens[0].tag != "}":
+        key, tokens = parse_expression(tokens)
         assert (
-            tokens[0]["tag"] == ":"
-        ), f"Expected ':' at position {tokens[0]['position']}"
+            tokens[0].tag == ":"
+        ), f"Expected ':' at position {tokens[0].position}"
         tokens = tokens[1:]
-        value, tokens = parse_simple_expression(tokens)
+        value, tokens = parse_expression(tokens)
         items.append({"key": key, "value": value})
-        while tokens[0]["tag"] == ",":
+        while tokens[0].tag == ",":
             tokens = tokens[1:]
-            key, tokens = parse_simple_expression(tokens)
+            key, tokens = parse_expression(tokens)
             assert (
-                tokens[0]["tag"] == ":"
-            ), f"Expected ':' at position {tokens[0]['position']}"
+                tokens[0].tag == ":"
+            ), f"Expected ':' at position {tokens[0].position}"
             tokens = tokens[1:]
-            value, tokens = parse_simple_expression(tokens)
+            value, tokens = parse_expression(tokens)
             items.append({"key": key, "value": value})
-    assert tokens[0]["tag"] == "}", f"Expected '}}' at position {tokens[0]['position']}"
+    assert tokens[0].tag == "}", f"Expected '}}' at position {tokens[0].position}"
     return {"tag": "object", "items": items}, tokens[1:]
 
 
@@ -276,44 +371,74 @@ def test_parse_object_literal():
     ast, tokens = parse_object_literal(tokenize("{}"))
     assert ast == {"tag": "object", "items": []}
 
+    ast, tokens = parse_object_literal(tokenize('{"a":-x*2}'))
+    assert ast == {
+        "tag": "object",
+        "items": [
+            {
+                "key": {"tag": "string", "value": "a"},
+                "value": {
+                    "tag": "*",
+                    "left": {"tag": "negate", "value": {"tag": "identifier", "value": "x"}},
+                    "right": {"tag": "number", "value": 2},
+                },
+            }
+        ],
+    }
+
 
 def parse_function_literal(tokens):
     """
-    function_literal = "function" "(" [ identifier { "," identifier } ] ")" statement_list ;
+    function_literal = [ "memo" ] "function" "(" [ identifier { "," identifier } ] ")" statement_list ;
     """
+    memo = tokens[0].tag == "memo"
+    if memo:
+        tokens = tokens[1:]
     assert (
-        tokens[0]["tag"] == "function"
-    ), f"Expected 'function' at position {tokens[0]['position']}"
-    tokens = tokens[1:]
-    assert tokens[0]["tag"] == "(", f"Expected '(' at position {tokens[0]['position']}"
+        tokens[0].tag == "function"
+    ), f"Expected 'function' at position {tokens[0].position}"
+    return parse_function_definition(tokens[1:], memo)
+
+
+def parse_function_definition(tokens, memo=False):
+    """
+    The part shared by function literals and function statements:
+    "(" [ identifier { "," identifier } ] ")" statement_list
+    """
+    assert tokens[0].tag == "(", f"Expected '(' at position {tokens[0].position}"
     tokens = tokens[1:]
     parameters = []
-    if tokens[0]["tag"] != ")":
+    if tokens[0].tag != ")":
         assert (
-            tokens[0]["tag"] == "identifier"
-        ), f"Expected identifier at position {tokens[0]['position']}"
-        parameters.append(tokens[0])
+            tokens[0].tag == "identifier"
+        ), f"Expected identifier at position {tokens[0].position}"
+        parameters.append(tokens[0].as_dict())
         tokens = tokens[1:]
-        while tokens[0]["tag"] == ",":
+        while tokens[0].tag == ",":
             tokens = tokens[1:]
             assert (
-                tokens[0]["tag"] == "identifier"
-            ), f"Expected identifier at position {tokens[0]['position']}"
-            parameters.append(tokens[0])
+                tokens[0].tag == "identifier"
+            ), f"Expected identifier at position {tokens[0].position}"
+            parameters.append(tokens[0].as_dict())
             tokens = tokens[1:]
-    assert tokens[0]["tag"] == ")", f"Expected ']' at position {tokens[0]['position']}"
+    assert tokens[0].tag == ")", f"Expected ']' at position {tokens[0].position}"
     tokens = tokens[1:]
     body_statement_list, tokens = parse_statement_list(tokens)
-    return {
+    check_jumps(body_statement_list["statements"])
+    function = {
         "tag": "function",
         "parameters": parameters,
         "body": body_statement_list,
-    }, tokens
+    }
+    if memo:
+        # results of calls are cached (see memo.py)
+        function["memo"] = True
+    return function, tokens
 
 
 def test_parse_function_literal():
     """
-    function_literal = "function" "(" [ identifier { "," identifier } ] ")" statement_list ;
+    function_literal = [ "memo" ] "function" "(" [ identifier { "," identifier } ] ")" statement_list ;
     """
     print("testing parse_function_literal...")
     ast, tokens = parse_function_literal(tokenize("function(x,y){}"))
@@ -325,6 +450,13 @@ def test_parse_function_literal():
         ],
         "body": {"tag": "statement_list", "statements": []},
     }
+    ast, tokens = parse_function_literal(tokenize("memo function(x){}"))
+    assert ast == {
+        "tag": "function",
+        "parameters": [{"tag": "identifier", "value": "x", "position": 14}],
+        "body": {"tag": "statement_list", "statements": []},
+        "memo": True,
+    }
     ast, tokens = parse_function_literal(tokenize("function(x,y){return x+y}"))
     assert ast == {
         "tag": "function",
@@ -389,37 +521,38 @@ def parse_complex_expression(tokens):
     complex_expression = simple_expression { ( ) | ("." identifier) | "(" [ expression { "," expression } ] ")" } ;
     """
     ast, tokens = parse_simple_expression(tokens)
-    while tokens[0]["tag"] in ["[", ".", "("]:
-        if tokens[0]["tag"] == "[":
+    while tokens[0].tag in ["[", ".", "("]:
+        if tokens[0].tag == "[":
             tokens = tokens[1:]
             index_ast, tokens = parse_expression(tokens)
             assert (
-                tokens[0]["tag"] == "]"
-            ), f"Expected ']' at position {tokens[0]['position']}"
+                tokens[0].tag == "]"
+            ), f"Expected ']' at position {tokens[0].position}"
             tokens = tokens[1:]
             ast = {"tag": "complex", "base": ast, "index": index_ast}
-        if tokens[0]["tag"] == ".":
+        if tokens[0].tag == ".":
             tokens = tokens[1:]
             assert (
-                tokens[0]["tag"] == "identifier"
-            ), f"Expected identifier at position {tokens[0]['position']}"
+                tokens[0].tag == "identifier"
+            ), f"Expected identifier at position {tokens[0].position}"
             ast = {
                 "tag": "complex",
                 "base": ast,
-                "index": {"tag": "string", "value": tokens[0]["value"]},
+                "index": {"tag": "string", "value": tokens[0].value},
             }
-        if tokens[0]["tag"] == "(":
+            tokens = tokens[1:]
+        if tokens[0].tag == "(":
             tokens = tokens[1:]
             items = []
-            if tokens[0]["tag"] != ")":
+            if tokens[0].tag != ")":
                 value, tokens = parse_expression(tokens)
                 items.append(value)
-                while tokens[0]["tag"] == ",":
-                    value, tokens = parse_simple_expression(tokens[1:])
+                while tokens[0].tag == ",":
+                    value, tokens = parse_expression(tokens[1:])
                     items.append(value)
             assert (
-                tokens[0]["tag"] == ")"
-            ), f"Expected ')' at position {tokens[0]['position']}"
+                tokens[0].tag == ")"
+            ), f"Expected ')' at position {tokens[0].position}"
             tokens = tokens[1:]
             ast = {"tag": "call", "function": ast, "arguments": items}
     return ast, tokens
@@ -461,6 +594,23 @@ def test_parse_complex_expression():
         "base": {"tag": "identifier", "value": "x"},
         "index": {"tag": "string", "value": "abc"},
     }
+    assert tokens[0]["tag"] == None
+    ast, tokens = parse_complex_expression(tokenize("x.abc.d"))
+    assert ast == {
+        "tag": "complex",
+        "base": {
+            "tag": "complex",
+            "base": {"tag": "identifier", "value": "x"},
+            "index": {"tag": "string", "value": "abc"},
+        },
+        "index": {"tag": "string", "value": "d"},
+    }
+    assert tokens[0]["tag"] == None
+    # the identifier after "." is consumed, so what follows still parses
+    ast, tokens = parse_complex_expression(tokenize("x.abc + 1"))
+    assert ast == parse_complex_expression(tokenize('x["abc"]'))[0]
+    assert tokens[0]["tag"] == "+"
+    assert parse(tokenize("y = x.a.b * 2")) == parse(tokenize('y = x["a"]["b"] * 2'))
     ast, tokens = parse_complex_expression(tokenize("x()"))
     assert ast == {
         "tag": "call",
@@ -476,6 +626,103 @@ def test_parse_complex_expression():
         "arguments": [{"tag": "number", "value": 1}, {"tag": "number", "value": 2}],
     }
 
+    ast, tokens = parse_complex_expression(tokenize("x(1,y-1)"))
+    assert ast == {
+        "tag": "call",
+        "function": {"tag": "identifier", "value": "x"},
+        "arguments": [
+            {"tag": "number", "value": 1},
+            {
+                "tag": "-",
+                "left": {"tag": "identifier", "value": "y"},
+                "right": {"tag": "number", "value": 1},
+            },
+        ],
+    }
+
+
+# BINARY EXPRESSIONS
+
+# The arithmetic, relational and logical rules below are all left associative
+# binary operator levels, so they are parsed by one precedence climbing loop
+# driven by this table (higher binds tighter) rather than a function per level.
+binary_precedence = {
+    "||": 1,
+    "&&": 2,
+    "<": 3,
+    ">": 3,
+    "<=": 3,
+    ">=": 3,
+    "==": 3,
+    "!=": 3,
+    "+": 4,
+    "-": 4,
+    "*": 5,
+    "/": 5,
+}
+
+
+def parse_binary_expression(tokens, minimum_precedence=1):
+    """
+    Parses complex_expressions joined by binary operators, consuming only
+    operators with at least the given precedence.
+    """
+    node, tokens = parse_complex_expression(tokens)
+    return parse_binary_operators(node, tokens, minimum_precedence)
+
+
+def parse_binary_operators(node, tokens, minimum_precedence):
+    tag = tokens[0].tag
+    precedence = binary_precedence.get(tag, 0)
+    while precedence >= minimum_precedence:
+        right, tokens = parse_complex_expression(tokens[1:])
+        # operators binding tighter than this one take the right operand first
+        while binary_precedence.get(tokens[0].tag, 0) > precedence:
+            right, tokens = parse_binary_operators(right, tokens, precedence + 1)
+        node = {"tag": tag, "left": node, "right": right}
+        tag = tokens[0].tag
+        precedence = binary_precedence.get(tag, 0)
+    return node, tokens
+
+
+def test_parse_binary_expression():
+    print("testing parse_binary_expression...")
+
+    def x(name):
+        return {"tag": "identifier", "value": name}
+
+    ast, tokens = parse_binary_expression(tokenize("a-b-c*d/e<f==g&&h||i&&!j"))
+    assert ast == {
+        "tag": "||",
+        "left": {
+            "tag": "&&",
+            "left": {
+                "tag": "==",
+                "left": {
+                    "tag": "<",
+                    "left": {
+                        "tag": "-",
+                        "left": {"tag": "-", "left": x("a"), "right": x("b")},
+                        "right": {
+                            "tag": "/",
+                            "left": {"tag": "*", "left": x("c"), "right": x("d")},
+                            "right": x("e"),
+                        },
+                    },
+                    "right": x("f"),
+                },
+                "right": x("g"),
+            },
+            "right": x("h"),
+        },
+        "right": {"tag": "&&", "left": x("i"), "right": {"tag": "not", "value": x("j")}},
+    }
+    assert tokens[0]["tag"] == None
+    # a minimum precedence stops at looser operators
+    ast, tokens = parse_binary_expression(tokenize("a*b+c"), binary_precedence["*"])
+    assert ast == {"tag": "*", "left": x("a"), "right": x("b")}
+    assert tokens[0]["tag"] == "+"
+
 
 # ARITHMETIC EXPRESSIONS
 
@@ -501,12 +748,7 @@ def parse_arithmetic_term(tokens):
     """
     arithmetic_term = arithmetic_factor { ("*" | "/") arithmetic_factor } ;
     """
-    node, tokens = parse_arithmetic_factor(tokens)
-    while tokens[0]["tag"] in ["*", "/"]:
-        tag = tokens[0]["tag"]
-        next_node, tokens = parse_arithmetic_factor(tokens[1:])
-        node = {"tag": tag, "left": node, "right": next_node}
-    return node, tokens
+    return parse_binary_expression(tokens, binary_precedence["*"])
 
 
 def test_parse_arithmetic_term():
@@ -547,12 +789,7 @@ def parse_arithmetic_expression(tokens):
     """
     arithmetic_expression = arithmetic_term { ("+" | "-") arithmetic_term } ;
     """
-    node, tokens = parse_arithmetic_term(tokens)
-    while tokens[0]["tag"] in ["+", "-"]:
-        tag = tokens[0]["tag"]
-        next_node, tokens = parse_arithmetic_term(tokens[1:])
-        node = {"tag": tag, "left": node, "right": next_node}
-    return node, tokens
+    return parse_binary_expression(tokens, binary_precedence["+"])
 
 
 def test_parse_arithmetic_expression():
@@ -617,12 +854,7 @@ def parse_relational_expression(tokens):
     """
     relational_expression = arithmetic_expression { ("<" | ">" | "<=" | ">=" | "==" | "!=") arithmetic_expression } ;
     """
-    node, tokens = parse_arithmetic_expression(tokens)
-    while tokens[0]["tag"] in ["<", ">", "<=", ">=", "==", "!="]:
-        tag = tokens[0]["tag"]
-        next_node, tokens = parse_arithmetic_expression(tokens[1:])
-        node = {"tag": tag, "left": node, "right": next_node}
-    return node, tokens
+    return parse_binary_expression(tokens, binary_precedence["<"])
 
 
 def test_parse_relational_expression():
@@ -677,12 +909,7 @@ def parse_logical_term(tokens):
     """
     logical_term = logical_factor { "&&" logical_factor } ;
     """
-    node, tokens = parse_logical_factor(tokens)
-    while tokens[0]["tag"] == "&&":
-        tag = tokens[0]["tag"]
-        next_node, tokens = parse_logical_factor(tokens[1:])
-        node = {"tag": tag, "left": node, "right": next_node}
-    return node, tokens
+    return parse_binary_expression(tokens, binary_precedence["&&"])
 
 
 def test_parse_logical_term():
@@ -711,12 +938,7 @@ def parse_logical_expression(tokens):
     """
     logical_expression = logical_term { "||" logical_term } ;
     """
-    node, tokens = parse_logical_term(tokens)
-    while tokens[0]["tag"] == "||":
-        tag = tokens[0]["tag"]
-        next_node, tokens = parse_logical_term(tokens[1:])
-        node = {"tag": tag, "left": node, "right": next_node}
-    return node, tokens
+    return parse_binary_expression(tokens, binary_precedence["||"])
 
 
 def test_parse_logical_expression():
@@ -749,7 +971,7 @@ def parse_expression(tokens):
     """
     expression = logical_expression ;
     """
-    return parse_logical_expression(tokens)
+    return parse_binary_expression(tokens)
 
 
 def test_parse_expression():
@@ -769,17 +991,17 @@ def parse_statement_list(tokens):
     """
     statement_list = "{" statement { ";" statement } "}" ;
     """
-    assert tokens[0]["tag"] == "{", f"Expected '{{' at position {tokens[0]['position']}"
+    assert tokens[0].tag == "{", f"Expected '{{' at position {tokens[0].position}"
     tokens = tokens[1:]
     statements = []
-    if tokens[0]["tag"] != "}":
+    if tokens[0].tag != "}":
         statement, tokens = parse_statement(tokens)
         statements.append(statement)
-        while tokens[0]["tag"] == ";":
+        while tokens[0].tag == ";":
             tokens = tokens[1:]
             statement, tokens = parse_statement(tokens)
             statements.append(statement)
-    assert tokens[0]["tag"] == "}", f"Expected '}}' at position {tokens[0]['position']}"
+    assert tokens[0].tag == "}", f"Expected '}}' at position {tokens[0].position}"
     return {"tag": "statement_list", "statements": statements}, tokens[1:]
 
 
@@ -812,12 +1034,12 @@ def parse_if_statement(tokens):
     """
     if_statement = "if" "(" expression ")" statement_list [ "else" (if_statement | statement_list) ] ;
     """
-    assert tokens[0]["tag"] == "if"
+    assert tokens[0].tag == "if"
     tokens = tokens[1:]
-    if tokens[0]["tag"] != "(":
+    if tokens[0].tag != "(":
         raise Exception(f"Expected '(': {tokens[0]}")
     condition, tokens = parse_expression(tokens[1:])
-    if tokens[0]["tag"] != ")":
+    if tokens[0].tag != ")":
         raise Exception(f"Expected ')': {tokens[0]}")
     then_statement_list, tokens = parse_statement_list(tokens[1:])
     node = {
@@ -825,13 +1047,13 @@ def parse_if_statement(tokens):
         "condition": condition,
         "then": then_statement_list,
     }
-    if tokens[0]["tag"] == "else":
+    if tokens[0].tag == "else":
         tokens = tokens[1:]
-        assert tokens[0]["tag"] in [
+        assert tokens[0].tag in [
             "{",
             "if",
         ], "Else must be followed by statement_list or if statement."
-        if tokens[0]["tag"] == "{":
+        if tokens[0].tag == "{":
             else_statement_list, tokens = parse_statement_list(tokens)
         else:
             else_statement_list, tokens = parse_if_statement(tokens)
@@ -878,12 +1100,12 @@ def parse_while_statement(tokens):
     """
     while_statement = "while" "(" expression ")" statement_list ;
     """
-    assert tokens[0]["tag"] == "while"
+    assert tokens[0].tag == "while"
     tokens = tokens[1:]
-    if tokens[0]["tag"] != "(":
+    if tokens[0].tag != "(":
         raise Exception(f"Expected '(': {tokens[0]}")
     condition, tokens = parse_expression(tokens[1:])
-    if tokens[0]["tag"] != ")":
+    if tokens[0].tag != ")":
         raise Exception(f"Expected ')': {tokens[0]}")
     do_statement_list, tokens = parse_statement_list(tokens[1:])
     return {"tag": "while", "condition": condition, "do": do_statement_list}, tokens
@@ -905,13 +1127,197 @@ def test_parse_while_statement():
     }
 
 
+def parse_for_statement(tokens):
+    """
+    for_statement = "for" ( ( "(" [ assignment_statement ] ";" [ expression ] ";" [ assignment_statement ] ")" ) | ( identifier "in" "range" "(" expression [ "," expression ] ")" ) ) statement_list ;
+    """
+    assert tokens[0].tag == "for"
+    tokens = tokens[1:]
+    if tokens[0].tag == "identifier":
+        return parse_for_range(tokens)
+    assert tokens[0].tag == "(", f"Expected '(' at position {tokens[0].position}"
+    tokens = tokens[1:]
+    # each clause may be left out; a missing condition is always true
+    clauses = []
+    for end in [";", ";", ")"]:
+        if tokens[0].tag == end:
+            clause = None
+        elif len(clauses) == 1:
+            clause, tokens = parse_expression(tokens)
+        else:
+            clause, tokens = parse_assignment_statement(tokens)
+        assert tokens[0].tag == end, f"Expected '{end}' at position {tokens[0].position}"
+        tokens = tokens[1:]
+        clauses.append(clause)
+    do_statement_list, tokens = parse_statement_list(tokens)
+    initial, condition, step = clauses
+    node = {"tag": "for", "initial": initial, "condition": condition, "step": step, "do": do_statement_list}
+    return node, tokens
+
+
+def parse_for_range(tokens):
+    """The part of a for statement after "for" in `for i in range(a, b) {...}`."""
+    variable = tokens[0].as_dict()
+    tokens = tokens[1:]
+    assert tokens[0].tag == "in", f"Expected 'in' at position {tokens[0].position}"
+    tokens = tokens[1:]
+    assert (
+        tokens[0].tag == "identifier" and tokens[0].value == "range"
+    ), f"Expected 'range' at position {tokens[0].position}"
+    tokens = tokens[1:]
+    assert tokens[0].tag == "(", f"Expected '(' at position {tokens[0].position}"
+    start, tokens = parse_expression(tokens[1:])
+    if tokens[0].tag == ",":
+        stop, tokens = parse_expression(tokens[1:])
+    else:
+        # range(n) counts from 0
+        start, stop = {"tag": "number", "value": 0}, start
+    assert tokens[0].tag == ")", f"Expected ')' at position {tokens[0].position}"
+    do_statement_list, tokens = parse_statement_list(tokens[1:])
+    node = {"tag": "for_range", "variable": variable, "start": start, "stop": stop, "do": do_statement_list}
+    return node, tokens
+
+
+def test_parse_for_statement():
+    """
+    for_statement = "for" ( ( "(" [ assignment_statement ] ";" [ expression ] ";" [ assignment_statement ] ")" ) | ( identifier "in" "range" "(" expression [ "," expression ] ")" ) ) statement_list ;
+    """
+    print("testing parse_for_statement...")
+    ast = parse_for_statement(tokenize("for (i = 0; i < 3; i = i + 1) { print i }"))[0]
+    assert ast == {
+        "tag": "for",
+        "initial": {
+            "tag": "assign",
+            "target": {"tag": "identifier", "value": "i"},
+            "value": {"tag": "number", "value": 0},
+        },
+        "condition": {
+            "tag": "<",
+            "left": {"tag": "identifier", "value": "i"},
+            "right": {"tag": "number", "value": 3},
+        },
+        "step": {
+            "tag": "assign",
+            "target": {"tag": "identifier", "value": "i"},
+            "value": {
+                "tag": "+",
+                "left": {"tag": "identifier", "value": "i"},
+                "right": {"tag": "number", "value": 1},
+            },
+        },
+        "do": {
+            "tag": "statement_list",
+            "statements": [
+                {"tag": "print", "value": {"tag": "identifier", "value": "i"}}
+            ],
+        },
+    }
+    ast = parse_for_statement(tokenize("for (;;) { break }"))[0]
+    assert ast == {
+        "tag": "for",
+        "initial": None,
+        "condition": None,
+        "step": None,
+        "do": {"tag": "statement_list", "statements": [{"tag": "break"}]},
+    }
+    ast = parse_for_statement(tokenize("for i in range(2, n) { continue }"))[0]
+    assert ast == {
+        "tag": "for_range",
+        "variable": {"tag": "identifier", "value": "i", "position": 4},
+        "start": {"tag": "number", "value": 2},
+        "stop": {"tag": "identifier", "value": "n"},
+        "do": {"tag": "statement_list", "statements": [{"tag": "continue"}]},
+    }
+    ast = parse_for_statement(tokenize("for i in range(3) {}"))[0]
+    assert ast["start"] == {"tag": "number", "value": 0}
+    assert ast["stop"] == {"tag": "number", "value": 3}
+    for code, message in [
+        ("for i in list(3) {}", "Expected 'range' at position 9"),
+        ("for (i = 0; i < 3) {}", "Expected ';' at position 17"),
+        ("for i range(3) {}", "Expected 'in' at position 6"),
+    ]:
+        try:
+            parse_for_statement(tokenize(code))
+            assert False, f"Should have refused {code}"
+        except AssertionError as e:
+            assert str(e) == message, str(e)
+
+
+def parse_break_statement(tokens):
+    """
+    break_statement = "break" ;
+    """
+    assert tokens[0].tag == "break"
+    return {"tag": "break"}, tokens[1:]
+
+
+def test_parse_break_statement():
+    """
+    break_statement = "break" ;
+    """
+    print("testing parse_break_statement...")
+    assert parse_break_statement(tokenize("break"))[0] == {"tag": "break"}
+
+
+def parse_continue_statement(tokens):
+    """
+    continue_statement = "continue" ;
+    """
+    assert tokens[0].tag == "continue"
+    return {"tag": "continue"}, tokens[1:]
+
+
+def test_parse_continue_statement():
+    """
+    continue_statement = "continue" ;
+    """
+    print("testing parse_continue_statement...")
+    assert parse_continue_statement(tokenize("continue"))[0] == {"tag": "continue"}
+
+
+def check_jumps(statements):
+    """Asserts that each break and continue in statements is inside a loop among them."""
+    for statement in statements:
+        tag = statement["tag"]
+        assert tag not in ["break", "continue"], f"'{tag}' outside of a loop"
+        if tag == "if":
+            check_jumps(statement["then"]["statements"])
+            if "else" in statement:
+                check_jumps([statement["else"]])
+        elif tag == "statement_list":
+            check_jumps(statement["statements"])
+
+
+def test_check_jumps():
+    print("testing check_jumps...")
+    for code in [
+        "while (1) { break }",
+        "for i in range(3) { if (i) { continue } else { break } }",
+        "while (1) { function f() { return 1 }; break }",
+    ]:
+        parse(tokenize(code))
+    for code, message in [
+        ("break", "'break' outside of a loop"),
+        ("if (1) { continue }", "'continue' outside of a loop"),
+        ("if (0) {} else if (1) { break }", "'break' outside of a loop"),
+        # a function body is not inside the loop its literal is in
+        ("while (1) { function f() { break } }", "'break' outside of a loop"),
+        ("for (;;) { f = function() { if (1) { continue } } }", "'continue' outside of a loop"),
+    ]:
+        try:
+            parse(tokenize(code))
+            assert False, f"Should have refused {code}"
+        except AssertionError as e:
+            assert str(e) == message, str(e)
+
+
 def parse_return_statement(tokens):
     """
     return_statement = "return" [ expression ] ;
     """
-    assert tokens[0]["tag"] == "return"
+    assert tokens[0].tag == "return"
     tokens = tokens[1:]
-    if tokens[0]["tag"] in ["}", ";", None]:
+    if tokens[0].tag in ["}", ";", None]:
         value = None
         return {"tag": "return"}, tokens
     else:
@@ -940,9 +1346,9 @@ def parse_print_statement(tokens):
     """
     print_statement = "print" [ expression ] ;
     """
-    assert tokens[0]["tag"] == "print"
+    assert tokens[0].tag == "print"
     tokens = tokens[1:]
-    if tokens[0]["tag"] in ["}", ";", None]:
+    if tokens[0].tag in ["}", ";", None]:
         # no expression
         return {"tag": "print", "value": None}, tokens
     else:
@@ -964,7 +1370,7 @@ def parse_assignment_statement(tokens):
     assignment_statement = expression [ "=" expression ] ;
     """
     target, tokens = parse_expression(tokens)
-    if tokens[0]["tag"] == "=":
+    if tokens[0].tag == "=":
         tokens = tokens[1:]
         value, tokens = parse_expression(tokens)
         return {"tag": "assign", "target": target, "value": value}, tokens
@@ -988,24 +1394,25 @@ def test_parse_assignment_statement():
 
 def parse_function_statement(tokens):
     """
-    function_statement = "function" identifier "(" [ identifier { "," identifier } ] ")" statement_list ;
+    function_statement = [ "memo" ] "function" identifier "(" [ identifier { "," identifier } ] ")" statement_list ;
     """
-    assert tokens[0]["tag"] == "function"
-    tokens = tokens[1:]
-    assert tokens[0]["tag"] == "identifier"
-    identifier_token = tokens[0]
+    memo = tokens[0].tag == "memo"
+    if memo:
+        tokens = tokens[1:]
+    assert tokens[0].tag == "function"
     tokens = tokens[1:]
-    tokens = [
-        identifier_token,
-        {"tag": "=", "value": "="},
-        {"tag": "function", "value": "function"},
-    ] + tokens
-    return parse_assignment_statement(tokens)
+    assert tokens[0].tag == "identifier"
+    target = {"tag": "identifier", "value": tokens[0].value}
+    value, tokens = parse_function_definition(tokens[1:], memo)
+    if memo:
+        # the one non-local name a memo function may call (see memo.py)
+        value["name"] = target["value"]
+    return {"tag": "assign", "target": target, "value": value}, tokens
 
 
 def test_parse_function_statement():
     """
-    function_statement = "function" identifier "(" [ identifier { "," identifier } ] ")" statement_list ;
+    function_statement = [ "memo" ] "function" identifier "(" [ identifier { "," identifier } ] ")" statement_list ;
     """
     print("testing parse_function_statement...")
     ast, result = parse_function_statement(tokenize("function x(y){2}"))
@@ -1021,13 +1428,18 @@ def test_parse_function_statement():
             "tag": "function",
         },
     }
+    ast, result = parse_function_statement(tokenize("memo function x(y){2}"))
+    assert ast["target"] == {"tag": "identifier", "value": "x"}
+    assert ast["value"]["memo"] is True
+    assert ast["value"]["name"] == "x"
+    assert ast["value"]["parameters"] == [{"position": 16, "tag": "identifier", "value": "y"}]
 
 
 def parse_statement(tokens):
     """
-    statement = if_statement | while_statement |  function_statement | return_statement | print_statement | assignment_statement ;
+    statement = if_statement | while_statement | for_statement | break_statement | continue_statement | function_statement | return_statement | print_statement | assignment_statement ;
     """
-    tag = tokens[0]["tag"]
+    tag = tokens[0].tag
     # note: none of these consumes a token
     # if tag == "{":
     #     return parse_statement_list(tokens)
@@ -1035,7 +1447,13 @@ def parse_statement(tokens):
         return parse_if_statement(tokens)
     if tag == "while":
         return parse_while_statement(tokens)
-    if tag == "function":
+    if tag == "for":
+        return parse_for_statement(tokens)
+    if tag == "break":
+        return parse_break_statement(tokens)
+    if tag == "continue":
+        return parse_continue_statement(tokens)
+    if tag in ["function", "memo"]:
         return parse_function_statement(tokens)
     if tag == "return":
         return parse_return_statement(tokens)
@@ -1046,7 +1464,7 @@ def parse_statement(tokens):
 
 def test_parse_statement():
     """
-    statement = if_statement | while_statement | function_statement | return_statement | print_statement | assignment_statement ;
+    statement = if_statement | while_statement | for_statement | break_statement | continue_statement | function_statement | return_statement | print_statement | assignment_statement ;
     """
     print("testing parse_statement...")
 
@@ -1060,6 +1478,14 @@ def test_parse_statement():
         parse_statement(tokenize("while(1){print 1}"))[0]
         == parse_while_statement(tokenize("while(1){print 1}"))[0]
     )
+    # for statement
+    assert (
+        parse_statement(tokenize("for i in range(2) {print i}"))[0]
+        == parse_for_statement(tokenize("for i in range(2) {print i}"))[0]
+    )
+    # break and continue statements
+    assert parse_statement(tokenize("break"))[0] == {"tag": "break"}
+    assert parse_statement(tokenize("continue"))[0] == {"tag": "continue"}
     # return statement
     assert (
         parse_statement(tokenize("return 22"))[0]
@@ -1082,16 +1508,17 @@ def parse_program(tokens):
     program = [ statement { ";" statement } ] ;
     """
     statements = []
-    if tokens[0]["tag"]:
+    if tokens[0].tag:
         statement, tokens = parse_statement(tokens)
         statements.append(statement)
-        while tokens[0]["tag"] == ";":
+        while tokens[0].tag == ";":
             tokens = tokens[1:]
             statement, tokens = parse_statement(tokens)
             statements.append(statement)
     assert (
-        tokens[0]["tag"] == None
-    ), f"Expected end of input at position {tokens[0]['position']}, got [{tokens[0]}]"
+        tokens[0].tag == None
+    ), f"Expected end of input at position {tokens[0].position}, got [{tokens[0]}]"
+    check_jumps(statements)
     return {"tag": "program", "statements": statements}, tokens[1:]
 
 
@@ -1109,7 +1536,12 @@ def test_parse_program():
 
 
 def parse(tokens):
-    ast, tokens = parse_program(tokens)
+    if isinstance(tokens, list):
+        ast, _ = parse_program(TokenCursor(tokens))
+        return ast
+    # anything else (e.g. tokenize_stream) is read lazily. no reference to
+    # the head of the stream is kept here, so consumed tokens can be freed.
+    ast, _ = parse_program(TokenStream(iter(tokens)))
     return ast
 
 
@@ -1188,6 +1620,9 @@ if __name__ == "__main__":
         test_parse_statement_list,
         test_parse_if_statement,
         test_parse_while_statement,
+        test_parse_for_statement,
+        test_parse_break_statement,
+        test_parse_continue_statement,
         test_parse_return_statement,
         test_parse_print_statement,
         test_parse_assignment_statement,
@@ -1210,3 +1645,7 @@ if __name__ == "__main__":
         print(f"Untested grammar = [[[ {test_grammar} ]]]")
 
     test_parse()
+    test_check_jumps()
+    test_parse_binary_expression()
+    test_token_cursor()
+    test_token_stream()
@@ -0,0 +1,208 @@
+import gc
+import marshal
+import os
+import struct
+import subprocess
+import sys
+import tempfile
+
+from evaluator import evaluate, parse_code
+
+# Precompiled programs, as written by trivialc.
+#
+# A compiled program file is a fixed header followed by a marshalled payload:
+#
+#   magic            4 bytes, b"TRVC"
+#   format version   2 bytes, FORMAT_VERSION of the writer
+#   marshal version  2 bytes, marshal.version of the writer
+#   payload length   4 bytes
+#   payload          marshal of (constants, ast)
+#
+# constants is the constant pool: every distinct string and number of the AST
+# (node tags, keys, identifiers and literal values), once each. The AST is
+# rebuilt over the pooled objects before it is written, so marshal stores
+# each constant once and refers back to it everywhere else, and the loaded
+# AST shares them too.
+#
+# Loading needs nothing but this module and marshal: running a compiled
+# program never imports the tokenizer or the parser. A file written by
+# another format or marshal version is refused rather than misread; the
+# program must be compiled again.
+
+magic = b"TRVC"
+
+# bump whenever the shape of the AST that the evaluator expects changes
+FORMAT_VERSION = 4
+
+header = struct.Struct("<4sHHI")
+
+
+class FormatError(Exception):
+    pass
+
+
+def is_compiled(data):
+    return data[: len(magic)] == magic
+
+
+def pool_constants(ast, constants):
+    """A copy of ast whose strings and numbers are the pooled ones in constants."""
+    if type(ast) is dict:
+        return {pool_constants(key, constants): pool_constants(value, constants) for key, value in ast.items()}
+    if type(ast) is list:
+        return [pool_constants(item, constants) for item in ast]
+    if type(ast) in [str, int, float]:
+        # 1, 1.0 and true are equal in Python but not interchangeable in trivial
+        return constants.setdefault((type(ast), ast), ast)
+    return ast
+
+
+def dumps(ast):
+    """The compiled program file contents for ast."""
+    constants = {}
+    ast = pool_constants(ast, constants)
+    payload = marshal.dumps((list(constants.values()), ast))
+    return header.pack(magic, FORMAT_VERSION, marshal.version, len(payload)) + payload
+
+
+def loads(data):
+    """The AST of a compiled program file's contents."""
+    if len(data) < header.size or not is_compiled(data):
+        raise FormatError("Not a compiled trivial program.")
+    _, format_version, marshal_version, length = header.unpack_from(data)
+    if format_version != FORMAT_VERSION or marshal_version != marshal.version:
+        raise FormatError(
+            f"Compiled program is format {format_version}.{marshal_version}, "
+            f"expected {FORMAT_VERSION}.{marshal.version}; compile it again."
+        )
+    if len(data) != header.size + length:
+        raise FormatError("Compiled program is truncated.")
+    # the AST is only containers of constants; see ast_cache.load()
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        _, ast = marshal.loads(memoryview(data)[header.size :])
+    except (EOFError, ValueError, TypeError):
+        raise FormatError("Compiled program is damaged.")
+    finally:
+        if collecting:
+            gc.enable()
+    return ast
+
+
+def write(path, ast):
+    # written aside and renamed, so a program being run is never half written
+    descriptor, temporary = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(descriptor, "wb") as f:
+            f.write(dumps(ast))
+        # mkstemp() makes the file private; give it the mode open() would have
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary, 0o666 & ~umask)
+        os.replace(temporary, path)
+    except BaseException:
+        os.unlink(temporary)
+        raise
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def compile_file(source_path, output_path=None, optimize=False):
+    """Compiles the program at source_path; returns the path written."""
+    # the only part of this module that needs the parser
+    from tokenizer import tokenize_stream
+    from parser import parse
+
+    if output_path is None:
+        output_path = os.path.splitext(source_path)[0] + ".tc"
+    with open(source_path, "r") as f:
+        ast = parse(tokenize_stream(f.read()))
+    if optimize:
+        from optimizer import optimize as fold, hoist_invariants
+
+        ast, _ = fold(ast)
+        ast, _ = hoist_invariants(ast)
+    write(output_path, ast)
+    return output_path
+
+
+def test_dumps_and_loads():
+    print("testing dumps and loads...")
+    code = 'x = [1, 2.5, true, "a"]; function f(a) { return a + 1 }; print f(x[0]); y = {"a": 1.0}'
+    ast = parse_code(code)
+    data = dumps(ast)
+    assert data[:4] == magic
+    assert loads(data) == ast
+    # 1 and 1.0 are pooled apart
+    loaded = loads(data)
+    environment = {}
+    assert evaluate(loaded, environment) == (None, False)
+    assert type(environment["y"]["a"]) is float
+    assert type(environment["x"][0]) is int
+
+
+def test_constant_pool():
+    print("testing constant pool...")
+    ast = parse_code("alpha = 1; beta = alpha + alpha; gamma = beta + alpha")
+    constants, _ = marshal.loads(dumps(ast)[header.size :])
+    assert len(constants) == len(set((type(c), c) for c in constants))
+    assert "alpha" in constants and "tag" in constants
+    # each name is the one pooled object wherever it is used
+    loaded = loads(dumps(ast))
+    names = [statement["value"]["right"]["value"] for statement in loaded["statements"][1:]]
+    assert names[0] is names[1]
+
+
+def test_refuses_other_formats():
+    print("testing refuses other formats...")
+    data = dumps(parse_code("print 1"))
+    for damaged, message in [
+        (b"print 1", "Not a compiled trivial program."),
+        (data[:4], "Not a compiled trivial program."),
+        (data[:-1], "Compiled program is truncated."),
+        (header.pack(magic, FORMAT_VERSION + 1, marshal.version, 0), "compile it again."),
+        (header.pack(magic, FORMAT_VERSION, marshal.version, 3) + b"\xff\xff\xff", "Compiled program is damaged."),
+    ]:
+        try:
+            loads(damaged)
+            assert False, f"Should have refused {damaged}"
+        except FormatError as e:
+            assert message in str(e), str(e)
+
+
+def test_compile_file():
+    print("testing compile file...")
+    with tempfile.TemporaryDirectory() as directory:
+        source_path = os.path.join(directory, "program.t")
+        with open(source_path, "w") as f:
+            f.write("function f(n) { return n * 2 }; print f(21)")
+        output_path = compile_file(source_path)
+        assert output_path == os.path.join(directory, "program.tc")
+        # with the permissions of any file written with open()
+        assert os.stat(output_path).st_mode == os.stat(source_path).st_mode
+        assert read(output_path) == parse_code("function f(n) { return n * 2 }; print f(21)")
+        # the runner runs it without loading the tokenizer or the parser,
+        # on any backend and optimized too
+        here = os.path.dirname(os.path.abspath(__file__))
+        for options in [[], ["--vm"], ["--stack"], ["-O"], ["-O", "--vm"]]:
+            check = (
+                f"import runpy, sys; sys.argv = ['runner.py', *{options!r}, {output_path!r}]; "
+                "runpy.run_path('runner.py', run_name='__main__'); "
+                "print('tokenizer' in sys.modules, 'parser' in sys.modules)"
+            )
+            output = subprocess.run(
+                [sys.executable, "-c", check], cwd=here, capture_output=True, text=True, check=True
+            ).stdout
+            assert output == "42\nFalse False\n", (options, output)
+
+
+if __name__ == "__main__":
+    test_dumps_and_loads()
+    test_constant_pool()
+    test_refuses_other_formats()
+    test_compile_file()
+    print("done.")
@@ -0,0 +1,191 @@
+# Static resolution of identifiers to frame slots.
+#
+# Every function has a fixed set of local variables: its parameters and the
+# identifiers assigned anywhere in its body, for ... in range loop variables
+# included (assignment always binds in the current scope). resolve() gives each
+# function node the list of its locals as "slots", and each identifier that
+# names a local of the function it appears in, or of a function enclosing it,
+# a "depth" (how many functions out) and a "slot" (its index there). Other
+# identifiers are globals, looked up by name.
+#
+# A call runs in a Frame whose values are indexed by slot and whose parent is
+# the frame the function was defined in, so a (depth, slot) address is reached
+# by following depth parents. Globals stay in the environment dict.
+
+
+class Unbound:
+    """The value of a local that has not been assigned yet."""
+
+    def __repr__(self):
+        return "<unbound>"
+
+
+UNBOUND = Unbound()
+
+
+class Frame:
+    """The locals of one function call."""
+
+    __slots__ = ("values", "names", "parent", "globals")
+
+    def __init__(self, values, names, parent, globals):
+        self.values = values
+        self.names = names
+        self.parent = parent
+        self.globals = globals
+
+
+def top_frame(environment):
+    """The frame of a program's top level, where every variable is global."""
+    return Frame([], [], None, environment)
+
+
+def call_frame(parameters, names, arguments, parent):
+    """The frame of a call; parameters without an argument stay unbound."""
+    values = arguments[: len(parameters)]
+    values += [UNBOUND] * (len(names) - len(values))
+    return Frame(values, names, parent, parent.globals)
+
+
+def lookup_global(identifier, environment):
+    while identifier not in environment:
+        assert "$parent" in environment, f"Unknown identifier: '{identifier}'."
+        environment = environment["$parent"]
+    return environment[identifier]
+
+
+def lookup_unbound(frame, slot):
+    """Reads a local before its first assignment, from outside the function."""
+    identifier = frame.names[slot]
+    environment = frame.globals
+    frame = frame.parent
+    while frame:
+        if identifier in frame.names:
+            value = frame.values[frame.names.index(identifier)]
+            if value is not UNBOUND:
+                return value
+        frame = frame.parent
+    return lookup_global(identifier, environment)
+
+
+def resolve(ast):
+    """Returns a copy of a program's AST with its locals given (depth, slot) addresses."""
+    return resolve_node(ast, [])
+
+
+def resolve_node(ast, scopes):
+    if type(ast) is list:
+        return [resolve_node(item, scopes) for item in ast]
+    if type(ast) is not dict:
+        return ast
+    tag = ast.get("tag")
+    if tag == "function":
+        names = [parameter["value"] for parameter in ast["parameters"]]
+        for identifier in assigned_names(ast["body"]):
+            if identifier not in names:
+                names.append(identifier)
+        node = dict(ast)
+        node["slots"] = names
+        node["body"] = resolve_node(ast["body"], scopes + [names])
+        return node
+    node = {key: resolve_node(value, scopes) for key, value in ast.items()}
+    if tag == "identifier":
+        for depth, names in enumerate(reversed(scopes)):
+            if ast["value"] in names:
+                node["depth"] = depth
+                node["slot"] = names.index(ast["value"])
+                break
+    return node
+
+
+def assigned_names(ast):
+    """The identifiers assigned in ast, outside of any function literal in it."""
+    if type(ast) is list:
+        return [name for item in ast for name in assigned_names(item)]
+    if type(ast) is not dict or ast.get("tag") == "function":
+        return []
+    names = []
+    if ast.get("tag") == "assign" and ast["target"]["tag"] == "identifier":
+        names.append(ast["target"]["value"])
+    if ast.get("tag") == "for_range":
+        names.append(ast["variable"]["value"])
+    for value in ast.values():
+        names += assigned_names(value)
+    return names
+
+
+def test_resolve():
+    print("testing resolve...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    ast = resolve(parse(tokenize("x = 1; function f(a) { b = a + x; return b }")))
+    assert ast["statements"][0]["target"] == {"tag": "identifier", "value": "x"}
+    function = ast["statements"][1]["value"]
+    assert function["slots"] == ["a", "b"]
+    assign, return_ = function["body"]["statements"]
+    assert assign["target"] == {"tag": "identifier", "value": "b", "depth": 0, "slot": 1}
+    assert assign["value"]["left"] == {"tag": "identifier", "value": "a", "depth": 0, "slot": 0}
+    assert assign["value"]["right"] == {"tag": "identifier", "value": "x"}
+    assert return_["value"] == {"tag": "identifier", "value": "b", "depth": 0, "slot": 1}
+    # the parser's AST is left as it was
+    assert "slots" not in parse(tokenize("function f(a) { a }"))["statements"][0]["value"]
+
+
+def test_resolve_nested_functions():
+    print("testing resolve nested functions...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    code = """
+        function outer(a, b) {
+            c = 1;
+            inner = function(b) {
+                d = function() { return [a, b, c] };
+                return d
+            }
+        }
+    """
+    outer = resolve(parse(tokenize(code)))["statements"][0]["value"]
+    assert outer["slots"] == ["a", "b", "c", "inner"]
+    inner = outer["body"]["statements"][1]["value"]
+    assert inner["slots"] == ["b", "d"]
+    items = inner["body"]["statements"][0]["value"]["body"]["statements"][0]["value"]["items"]
+    assert [(item["depth"], item["slot"]) for item in items] == [(2, 0), (1, 0), (2, 2)]
+
+
+def test_assigned_names():
+    print("testing assigned names...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    code = "x = 1; if (x) { y[0] = 2; z = 3 } else { while (0) { w = 4 } }; f = function() { v = 5 }"
+    assert assigned_names(parse(tokenize(code))) == ["x", "z", "w", "f"]
+    code = "for (i = 0; i < 2; j = i) { k = i }; for n in range(3) { m = n }"
+    assert assigned_names(parse(tokenize(code))) == ["i", "j", "k", "n", "m"]
+
+
+def test_frames():
+    print("testing frames...")
+    top = top_frame({"x": 1, "$parent": {"y": 2}})
+    outer = call_frame(["a"], ["a", "x"], [3, 4], top)
+    assert outer.values == [3, UNBOUND]
+    inner = call_frame(["x", "y"], ["x", "y", "a"], [5], outer)
+    assert inner.values == [5, UNBOUND, UNBOUND]
+    # unassigned locals read the same name from outside the function
+    assert lookup_unbound(inner, 1) == 2
+    assert lookup_unbound(inner, 2) == 3
+    assert lookup_unbound(outer, 1) == 1
+    try:
+        lookup_unbound(call_frame([], ["q"], [], top), 0)
+        assert False, "Should have an error for an unknown identifier."
+    except AssertionError as e:
+        assert "Unknown identifier: 'q'" in str(e)
+
+
+if __name__ == "__main__":
+    test_resolve()
+    test_resolve_nested_functions()
+    test_assigned_names()
+    test_frames()
+    print("done.")
@@ -1,44 +1,198 @@
 #!/usr/bin/env python
 
+import argparse
 import sys
 
-from tokenizer import tokenize
+import evaluator
+from evaluator import evaluate
+import program_file
+import sink
+import tracing
 
-from parser import parse
+# The tokenizer, parser and other backends are imported where they are used,
+# so that a program compiled by trivialc runs without them.
+
+
+def run_vm(ast, environment):
+    import compiler
+    import vm
+
+    return vm.execute(compiler.compile(ast), environment)
+
+
+def run_stack(ast, environment):
+    import stack_evaluator
+
+    return stack_evaluator.evaluate(ast, environment)
+
+
+def optimize(ast):
+    from optimizer import optimize, hoist_invariants
+
+    ast, removed = optimize(ast)
+    ast, hoisted = hoist_invariants(ast)
+    return ast, removed, hoisted
+
+
+def load_program(path, use_cache):
+    """The AST of a program file, either source or compiled by trivialc."""
+    with open(path, "rb") as f:
+        data = f.read()
+    if program_file.is_compiled(data):
+        return program_file.loads(data)
+    source_code = data.decode("utf-8")
+    if not use_cache:
+        from tokenizer import tokenize_stream
+        from parser import parse
+
+        # tokens are produced as the parser consumes them
+        return parse(tokenize_stream(source_code))
+    import ast_cache
+
+    return ast_cache.parse_file(path, source_code)
+
+
+def report_memo_statistics():
+    statistics = evaluator.memo_cache.statistics()
+    print(
+        "memo: {hits} hits, {misses} misses, {evictions} evictions, {size} cached".format(
+            **statistics
+        ),
+        file=sys.stderr,
+    )
 
-from evaluator import evaluate
 
 def main():
+    argument_parser = argparse.ArgumentParser(description="Run a trivial program.")
+    argument_parser.add_argument(
+        "file", nargs="?", help="program or trivialc compiled program to run (default: REPL)"
+    )
+    backend = argument_parser.add_mutually_exclusive_group()
+    backend.add_argument(
+        "--vm", action="store_true", help="compile to bytecode and run on the VM"
+    )
+    backend.add_argument(
+        "--stack",
+        action="store_true",
+        help="evaluate from an explicit stack, without Python's recursion limit",
+    )
+    argument_parser.add_argument(
+        "-O",
+        "--optimize",
+        action="store_true",
+        help="fold constants, remove dead branches and hoist loop invariants",
+    )
+    argument_parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="parse the program even if __trivialcache__ holds its AST",
+    )
+    argument_parser.add_argument(
+        "--trace",
+        action="append",
+        default=[],
+        metavar="CHANNEL[=LEVEL]",
+        help="trace evaluation on a channel (index, assign) at level 1 or 2; "
+        "may be repeated; not with --vm or --stack",
+    )
+    argument_parser.add_argument(
+        "--output", metavar="FILE", help="write the program's output to FILE (default: stdout)"
+    )
+    argument_parser.add_argument(
+        "--buffer-size",
+        type=int,
+        default=1 << 16,
+        help="characters of output collected before writing them; 0 writes every line "
+        "(default: %(default)s, for a program file)",
+    )
+    argument_parser.add_argument(
+        "--memo-size",
+        type=int,
+        default=evaluator.memo_cache.size,
+        help="results kept for memo functions (default: %(default)s)",
+    )
+    argument_parser.add_argument(
+        "--memo-stats",
+        action="store_true",
+        help="report memo function cache hits, misses and evictions on exit; not with --vm",
+    )
+    arguments = argument_parser.parse_args()
+    if arguments.memo_stats and arguments.vm:
+        # the VM runs memo functions uncached, so there is nothing to report
+        argument_parser.error("--memo-stats only reports the evaluators' cache, not the VM's")
+    evaluator.memo_cache.size = arguments.memo_size
+    run = evaluate
+    if arguments.vm:
+        run = run_vm
+    if arguments.stack:
+        run = run_stack
+    for setting in arguments.trace:
+        if arguments.vm or arguments.stack:
+            argument_parser.error("--trace only traces the default evaluator")
+        try:
+            tracing.enable(*tracing.parse_setting(setting))
+        except AssertionError as e:
+            argument_parser.error(str(e))
+
     environment = {}
     # Check for command line arguments
-    if len(sys.argv) > 1:
+    if arguments.file:
         # Filename provided, read and execute it
-        with open(sys.argv[1], 'r') as f:
-            source_code = f.read()
-        
-        tokens = tokenize(source_code)
-        ast = parse(tokens)
-        evaluate(ast, environment)
+        try:
+            ast = load_program(arguments.file, not arguments.no_cache)
+        except program_file.FormatError as e:
+            sys.exit(f"{arguments.file}: {e}")
+        if arguments.optimize:
+            ast, removed, hoisted = optimize(ast)
+            print(f"optimizer: removed {removed} nodes, hoisted {hoisted}", file=sys.stderr)
+        output_file = open(arguments.output, "w") if arguments.output else None
+        # only the REPL shows the value of a print statement
+        sink.output = sink.OutputSink(output_file, arguments.buffer_size, keep_text=False)
+        try:
+            run(ast, environment)
+        finally:
+            # what the program printed comes out even if it failed
+            sink.output.flush()
+            if output_file:
+                output_file.close()
+        if arguments.memo_stats:
+            report_memo_statistics()
 
     else:
-        # REPL loop
-        while True:
-            try:
-                # Read input
-                source_code = input('>> ')
-
-                # Exit condition for the REPL loop
-                if source_code.strip() in ['exit', 'quit']:
-                    break
-
-                # Tokenize, parse, and execute the code
-                tokens = tokenize(source_code)
-                ast = parse(tokens)
-                result, _ = evaluate(ast, environment)
-                if result != None:
-                    print(result)
-            except Exception as e:
-                print(f"Error: {e}")
+        from tokenizer import tokenize
+        from parser import parse
+
+        # lines are printed as they are evaluated
+        output_file = open(arguments.output, "w") if arguments.output else None
+        if output_file:
+            sink.output = sink.OutputSink(output_file)
+        try:
+            # REPL loop
+            while True:
+                try:
+                    # Read input
+                    source_code = input('>> ')
+
+                    # Exit condition for the REPL loop
+                    if source_code.strip() in ['exit', 'quit']:
+                        break
+
+                    # Tokenize, parse, and execute the code
+                    tokens = tokenize(source_code)
+                    ast = parse(tokens)
+                    if arguments.optimize:
+                        ast, _, _ = optimize(ast)
+                    result, _ = run(ast, environment)
+                    if result != None:
+                        print(result)
+                except Exception as e:
+                    print(f"Error: {e}")
+        finally:
+            if output_file:
+                sink.output.flush()
+                output_file.close()
+        if arguments.memo_stats:
+            report_memo_statistics()
 
 if __name__ == "__main__":
     main()
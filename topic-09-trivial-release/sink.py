@@ -0,0 +1,111 @@
+import io
+import os
+import sys
+import tempfile
+
+# Where print statements write.
+#
+# Every backend prints through the module's `output`, an OutputSink, rather
+# than Python's print(). A sink writes to a file object, or to whatever
+# sys.stdout is at the time when it has none, so contextlib.redirect_stdout()
+# still captures a program's output. With a buffer size it collects lines and
+# writes them in one go once that many characters are waiting, and on flush();
+# whoever installs a buffered sink must flush it when the program ends,
+# including when it fails.
+#
+# The value of a print statement is the text it printed, which the REPL shows
+# and the tests check. A sink made with keep_text=False returns None instead,
+# so a program run for its output does not keep the text of its last print.
+
+
+class OutputSink:
+    def __init__(self, file=None, buffer_size=0, keep_text=True):
+        self.file = file
+        self.buffer_size = buffer_size
+        self.keep_text = keep_text
+        self.pending = []
+        self.pending_size = 0
+
+    def write_value(self, value):
+        """Prints value on a line; returns the text, if the sink keeps it."""
+        text = f"{value}\n"
+        if self.buffer_size:
+            self.pending.append(text)
+            self.pending_size += len(text)
+            if self.pending_size >= self.buffer_size:
+                self.flush()
+        else:
+            (self.file or sys.stdout).write(text)
+        if self.keep_text:
+            return text
+        return None
+
+    def write_newline(self):
+        return self.write_value("")
+
+    def flush(self):
+        file = self.file or sys.stdout
+        if self.pending:
+            file.write("".join(self.pending))
+            self.pending = []
+            self.pending_size = 0
+        file.flush()
+
+
+output = OutputSink()
+
+
+def test_unbuffered():
+    print("testing unbuffered...")
+    file = io.StringIO()
+    sink = OutputSink(file)
+    assert sink.write_value(1) == "1\n"
+    assert sink.write_newline() == "\n"
+    assert sink.write_value([1, "a"]) == "[1, 'a']\n"
+    assert file.getvalue() == "1\n\n[1, 'a']\n"
+
+
+def test_buffered():
+    print("testing buffered...")
+    file = io.StringIO()
+    sink = OutputSink(file, buffer_size=10)
+    sink.write_value("abc")
+    sink.write_value(True)
+    assert file.getvalue() == ""
+    # 11 characters waiting: more than the buffer holds
+    sink.write_value(1)
+    assert file.getvalue() == "abc\nTrue\n1\n"
+    sink.write_value(2)
+    assert file.getvalue() == "abc\nTrue\n1\n"
+    sink.flush()
+    assert file.getvalue() == "abc\nTrue\n1\n2\n"
+
+
+def test_keep_text():
+    print("testing keep text...")
+    file = io.StringIO()
+    sink = OutputSink(file, keep_text=False)
+    assert sink.write_value(1) is None
+    assert sink.write_newline() is None
+    assert file.getvalue() == "1\n\n"
+
+
+def test_file():
+    print("testing file...")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "output.txt")
+        with open(path, "w") as file:
+            sink = OutputSink(file, buffer_size=1 << 16)
+            for i in range(1000):
+                sink.write_value(i)
+            sink.flush()
+            with open(path) as written:
+                assert written.read() == "".join(f"{i}\n" for i in range(1000))
+
+
+if __name__ == "__main__":
+    test_unbuffered()
+    test_buffered()
+    test_keep_text()
+    test_file()
+    print("done.")
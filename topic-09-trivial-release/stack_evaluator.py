@@ -0,0 +1,440 @@
+from evaluator import Closure, Return, BREAK, CONTINUE, binary_operations, check_range, forget_temporaries, index_value, parse_code
+from memo import memo_key, check_pure
+import evaluator
+import sink
+from objects import Object, is_object
+from lists import is_list, make_list
+
+# Evaluates an AST like evaluator.py, but without recursing in Python.
+#
+# Each node that has children is evaluated by a generator: it yields a
+# (child, environment) pair for each child it needs and is sent back the
+# child's value. drive() keeps the generators of the nodes in progress on a
+# list and passes values between them, so the depth of an AST or of trivial
+# calls is limited by memory rather than by Python's recursion limit. Numbers,
+# strings, booleans, identifiers, function literals, breaks and continues have
+# no children to evaluate and are evaluated in place by plain functions.
+#
+# Values, closures, returns, breaks, continues and the memo function cache are
+# the ones evaluator.py uses.
+
+
+def evaluate(ast, environment):
+    """Evaluates ast; returns (value, return_chain) like evaluator.evaluate()."""
+    try:
+        value = run(ast, environment)
+        if value.__class__ is Return:
+            if value.closure:
+                return run_call(value.closure, value.arguments), True
+            return value.value, True
+        return value, False
+    finally:
+        forget_temporaries(ast, environment)
+
+
+def run(ast, environment):
+    """Evaluates ast to a plain value, or a Return from a return statement."""
+    leaf = leaves.get(ast["tag"])
+    if leaf:
+        return leaf(ast, environment)
+    return drive(step(ast, environment))
+
+
+def run_call(closure, argument_values):
+    return drive(call_closure(closure, argument_values))
+
+
+def drive(generator):
+    stack = [generator]
+    value = None
+    while True:
+        try:
+            ast, environment = generator.send(value)
+        except StopIteration as stop:
+            stack.pop()
+            if not stack:
+                return stop.value
+            generator = stack[-1]
+            value = stop.value
+            continue
+        leaf = leaves.get(ast["tag"])
+        if leaf:
+            value = leaf(ast, environment)
+        else:
+            generator = step(ast, environment)
+            stack.append(generator)
+            value = None
+
+
+def step(ast, environment):
+    handler = steps.get(ast["tag"])
+    assert handler, f"Unknown tag [{ast['tag']}] in AST"
+    return handler(ast, environment)
+
+
+# NODES WITHOUT CHILDREN
+
+
+def evaluate_number(ast, environment):
+    assert type(ast["value"]) in [
+        float,
+        int,
+    ], f"unexpected type {type(ast["value"])}"
+    return ast["value"]
+
+
+def evaluate_string(ast, environment):
+    assert type(ast["value"]) == str, f"unexpected type {type(ast["value"])}"
+    return ast["value"]
+
+
+def evaluate_boolean(ast, environment):
+    return ast["value"]
+
+
+def evaluate_identifier(ast, environment):
+    identifier = ast["value"]
+    while identifier not in environment:
+        assert "$parent" in environment, f"Unknown identifier: '{identifier}'."
+        environment = environment["$parent"]
+    return environment[identifier]
+
+
+def evaluate_function(ast, environment):
+    if "memo" in ast:
+        check_pure(ast)
+    return Closure(ast, environment)
+
+
+def evaluate_break(ast, environment):
+    return BREAK
+
+
+def evaluate_continue(ast, environment):
+    return CONTINUE
+
+
+leaves = {
+    "number": evaluate_number,
+    "string": evaluate_string,
+    "boolean": evaluate_boolean,
+    "identifier": evaluate_identifier,
+    "function": evaluate_function,
+    "break": evaluate_break,
+    "continue": evaluate_continue,
+}
+
+
+# NODES WITH CHILDREN
+
+
+def step_list(ast, environment):
+    items = []
+    for item in ast["items"]:
+        items.append((yield item, environment))
+    return make_list(items)
+
+
+def step_object(ast, environment):
+    object = Object()
+    for item in ast["items"]:
+        key = yield item["key"], environment
+        assert type(key) is str, "Object key must be a string"
+        object[key] = yield item["value"], environment
+    return object
+
+
+def step_binary(ast, environment):
+    left_value = yield ast["left"], environment
+    right_value = yield ast["right"], environment
+    return binary_operations[ast["tag"]](left_value, right_value)
+
+
+def step_divide(ast, environment):
+    left_value = yield ast["left"], environment
+    right_value = yield ast["right"], environment
+    assert right_value != 0, "Division by zero"
+    return left_value / right_value
+
+
+def step_negate(ast, environment):
+    value = yield ast["value"], environment
+    return -value
+
+
+def step_and(ast, environment):
+    left_value = yield ast["left"], environment
+    if not left_value:
+        return left_value
+    return (yield ast["right"], environment)
+
+
+def step_or(ast, environment):
+    left_value = yield ast["left"], environment
+    if left_value:
+        return left_value
+    return (yield ast["right"], environment)
+
+
+def step_not(ast, environment):
+    value = yield ast["value"], environment
+    return not value
+
+
+def step_print(ast, environment):
+    if ast["value"]:
+        value = yield ast["value"], environment
+        return sink.output.write_value(value)
+    return sink.output.write_newline()
+
+
+def step_if(ast, environment):
+    condition = yield ast["condition"], environment
+    if condition:
+        value = yield ast["then"], environment
+    elif "else" in ast:
+        value = yield ast["else"], environment
+    else:
+        return None
+    if value.__class__ is Return:
+        return value
+    return None
+
+
+def step_while(ast, environment):
+    while (yield ast["condition"], environment):
+        value = yield ast["do"], environment
+        if value.__class__ is Return:
+            if value is BREAK:
+                break
+            if value is not CONTINUE:
+                return value
+    return None
+
+
+def step_for(ast, environment):
+    if ast["initial"]:
+        yield ast["initial"], environment
+    condition, step = ast["condition"], ast["step"]
+    while condition is None or (yield condition, environment):
+        value = yield ast["do"], environment
+        if value.__class__ is Return:
+            if value is BREAK:
+                break
+            if value is not CONTINUE:
+                return value
+        if step:
+            yield step, environment
+    return None
+
+
+def step_for_range(ast, environment):
+    start = yield ast["start"], environment
+    stop = yield ast["stop"], environment
+    check_range(start, stop)
+    variable = ast["variable"]["value"]
+    for counter in range(start, stop):
+        environment[variable] = counter
+        value = yield ast["do"], environment
+        if value.__class__ is Return:
+            if value is BREAK:
+                break
+            if value is not CONTINUE:
+                return value
+    return None
+
+
+def step_statement_list(ast, environment):
+    value = None
+    for statement in ast["statements"]:
+        value = yield statement, environment
+        if value.__class__ is Return:
+            return value
+    return value
+
+
+def step_callee(ast, environment):
+    """The closure a call node calls and its argument values."""
+    closure = yield ast["function"], environment
+    assert type(closure) is Closure, f"{closure} is not a function"
+    argument_values = []
+    for argument in ast["arguments"]:
+        argument_values.append((yield argument, environment))
+    return closure, argument_values
+
+
+def step_call(ast, environment):
+    closure, argument_values = yield from step_callee(ast, environment)
+    return (yield from call_closure(closure, argument_values))
+
+
+def call_closure(closure, argument_values):
+    if "memo" in closure.function:
+        key = memo_key(closure, argument_values)
+        if key is not None:
+            cached, value = evaluator.memo_cache.get(key)
+            if not cached:
+                value = yield from run_closure(closure, argument_values)
+                evaluator.memo_cache.put(key, value)
+            return value
+    return (yield from run_closure(closure, argument_values))
+
+
+def run_closure(closure, argument_values):
+    while True:
+        function = closure.function
+        local_environment = {}
+        for parameter, value in zip(function["parameters"], argument_values):
+            local_environment[parameter["value"]] = value
+        # the body sees the variables where the function was defined, not the caller's
+        local_environment["$parent"] = closure.environment
+        value = yield function["body"], local_environment
+        if value.__class__ is not Return:
+            return None
+        if not value.closure:
+            return value.value
+        if "memo" in value.closure.function:
+            # a memo function is called through its cache, tail call or not
+            return (yield from call_closure(value.closure, value.arguments))
+        # a tail call: run the callee in this call's place
+        closure, argument_values = value.closure, value.arguments
+
+
+def step_complex(ast, environment):
+    base = yield ast["base"], environment
+    if ast["index"]["tag"] == "string":
+        # a constant field name: no step for the index
+        if base.__class__ is Object and base.shape is not None:
+            return base.values[base.shape.slots[ast["index"]["value"]]]
+        assert is_object(base)
+        return base[ast["index"]["value"]]
+    return index_value(base, (yield ast["index"], environment))
+
+
+def step_assign(ast, environment):
+    assert "target" in ast
+    target = ast["target"]
+    if target["tag"] == "identifier":
+        target_base = environment
+        target_index = target["value"]
+    elif target["tag"] == "complex":
+        target_base = yield target["base"], environment
+        target_index = yield target["index"], environment
+        assert type(target_index) in [int, float, str], f"Unknown index type [{target_index}]"
+        if type(target_index) in [int, float]:
+            assert int(target_index) == target_index
+            assert is_list(target_base)
+            assert len(target_base) > target_index
+        else:
+            assert is_object(target_base)
+    else:
+        assert False, f"Unknown target type in assignment. {target}"
+    target_base[target_index] = yield ast["value"], environment
+    return None
+
+
+def step_return(ast, environment):
+    if "value" in ast:
+        if ast["value"]["tag"] == "call":
+            closure, argument_values = yield from step_callee(ast["value"], environment)
+            return Return(None, closure, argument_values)
+        return Return((yield ast["value"], environment))
+    return Return(None)
+
+
+steps = {
+    "list": step_list,
+    "object": step_object,
+    "+": step_binary,
+    "-": step_binary,
+    "*": step_binary,
+    "/": step_divide,
+    "negate": step_negate,
+    "&&": step_and,
+    "||": step_or,
+    "!": step_not,
+    "not": step_not,
+    "<": step_binary,
+    ">": step_binary,
+    "<=": step_binary,
+    ">=": step_binary,
+    "==": step_binary,
+    "!=": step_binary,
+    "print": step_print,
+    "if": step_if,
+    "while": step_while,
+    "for": step_for,
+    "for_range": step_for_range,
+    "statement_list": step_statement_list,
+    "program": step_statement_list,
+    "call": step_call,
+    "complex": step_complex,
+    "assign": step_assign,
+    "return": step_return,
+}
+
+
+def test_evaluate():
+    print("testing evaluate...")
+    assert evaluate(parse_code("1 + 2 * 3"), {}) == (7, False)
+    assert evaluate(parse_code("x"), {"x": 1}) == (1, False)
+    environment = {}
+    assert evaluate(parse_code("x = [1, 2]; x[1] = 3; y = {}"), environment) == (None, False)
+    assert environment == {"x": [1, 3], "y": {}}
+    assert evaluate(parse_code("return 4; 5"), {}) == (4, True)
+    try:
+        evaluate({"tag": "unknown", "value": {"tag": "number", "value": 1}}, {})
+        assert False, "Should have an error for an unknown tag."
+    except AssertionError as e:
+        assert "Unknown tag [unknown] in AST" in str(e)
+
+
+def test_evaluate_deep_recursion():
+    print("testing evaluate deep recursion...")
+    code = """
+        function count(n) {
+            if (n == 0) { return 0 };
+            return 1 + count(n - 1)
+        };
+        count(20000)
+    """
+    # far deeper than evaluator.evaluate() could go with Python's recursion limit
+    assert evaluate(parse_code(code), {}) == (20000, False)
+
+
+def test_evaluate_deep_expression():
+    print("testing evaluate deep expression...")
+    ast = {"tag": "number", "value": 1}
+    for _ in range(100000):
+        ast = {"tag": "+", "left": {"tag": "number", "value": 1}, "right": {"tag": "negate", "value": ast}}
+    assert evaluate(ast, {}) == (1, False)
+
+
+def test_evaluate_memo_tail_call():
+    print("testing evaluate memo tail call...")
+    from memo import MemoCache
+
+    saved = evaluator.memo_cache
+    evaluator.memo_cache = MemoCache(size=100)
+    try:
+        code = "memo function g(n) { return n * 2 }; function f(n) { return g(n) }; [f(3), f(3), f(3)]"
+        assert evaluate(parse_code(code), {}) == ([6, 6, 6], False)
+        assert evaluator.memo_cache.statistics() == {"hits": 2, "misses": 1, "evictions": 0, "size": 1}
+    finally:
+        evaluator.memo_cache = saved
+
+
+def test_evaluate_same_as_evaluate():
+    print("testing evaluate same as evaluator.evaluate...")
+    from differential import check_programs
+
+    check_programs(evaluate)
+
+
+if __name__ == "__main__":
+    test_evaluate()
+    test_evaluate_deep_recursion()
+    test_evaluate_deep_expression()
+    test_evaluate_memo_tail_call()
+    test_evaluate_same_as_evaluate()
+    print("done.")
@@ -5,25 +5,7 @@ patterns = [
     [r"\s+", "whitespace"],  # Whitespace
     [r"\d*\.\d+|\d+\.\d*|\d+", "number"],  # numeric literals
     [r'"([^"]|"")*"', "string"],  # string literals
-    [r"true|false", "boolean"],  # boolean literals
-    [r"null", "null"],  # the null literal
-    [r"function", "function"],  # function keyword
-    [r"return", "return"],  # return keyword
-    [r"if", "if"],  # if keyword
-    [r"else", "else"],  # else keyword
-    [r"while", "while"],  # while keyword
-    [r"for", "for"],  # for keyword
-    [r"break", "break"],  # for keyword
-    [r"continue", "continue"],  # for keyword
-    [r"print", "print"],  # print keyword
-    [r"import", "import"],  # import keyword
-    [r"external", "external"],  # external keyword
-    [r"input", "input"],  # function keyword
-    [r"exit", "exit"],  # exit keyword
-    [r"and", "&&"],  # alternate for &&
-    [r"or", "||"],  # alternate for ||
-    [r"not", "!"],  # alternate for !
-    [r"[a-zA-Z_][a-zA-Z0-9_]*", "identifier"],  # identifiers
+    [r"[a-zA-Z_][a-zA-Z0-9_]*", "identifier"],  # identifiers and keywords
     [r"\+", "+"],
     [r"\-", "-"],
     [r"\*", "*"],
@@ -52,25 +34,90 @@ patterns = [
     [r".", "error"],  # unexpected content
 ]
 
-for pattern in patterns:
-    pattern[0] = re.compile(pattern[0])
+# words scanned as identifiers are looked up here, so a keyword is only
+# recognized as a whole word ("format" is an identifier, not "for" "mat").
+keywords = {
+    "true": "boolean",  # boolean literals
+    "false": "boolean",
+    "null": "null",  # the null literal
+    "function": "function",  # function keyword
+    "memo": "memo",  # memoized function keyword
+    "return": "return",  # return keyword
+    "if": "if",  # if keyword
+    "else": "else",  # else keyword
+    "while": "while",  # while keyword
+    "for": "for",  # for keyword
+    "in": "in",  # for ... in keyword
+    "break": "break",  # break keyword
+    "continue": "continue",  # continue keyword
+    "print": "print",  # print keyword
+    "import": "import",  # import keyword
+    "external": "external",  # external keyword
+    "input": "input",  # input keyword
+    "exit": "exit",  # exit keyword
+    "and": "&&",  # alternate for &&
+    "or": "||",  # alternate for ||
+    "not": "!",  # alternate for !
+}
+
+# combine the patterns into one alternation with a named group per pattern.
+# alternation tries the groups in order, so the first listed pattern that
+# matches still wins, but each token costs a single regex call.
+master_pattern = re.compile(
+    "|".join(f"(?P<t{index}>{pattern})" for index, (pattern, _) in enumerate(patterns))
+)
+group_tags = {f"t{index}": tag for index, (_, tag) in enumerate(patterns)}
+
+
+class Token:
+    """
+    A token's tag, value and position in the source.
+
+    Tokens are slotted objects rather than dicts to keep them small and quick
+    to read. token["tag"] style access still works, and a token compares
+    equal to the dict with the same three keys.
+    """
+
+    __slots__ = ("tag", "value", "position")
+
+    def __init__(self, tag, value, position):
+        self.tag = tag
+        self.value = value
+        self.position = position
+
+    def __getitem__(self, key):
+        if key not in Token.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def as_dict(self):
+        return {"tag": self.tag, "value": self.value, "position": self.position}
+
+    def __eq__(self, other):
+        if isinstance(other, Token):
+            other = other.as_dict()
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(self.as_dict())
+
 
 test_generated_tags = set()
 
 
-# The lex/tokenize function
-def tokenize(characters, generated_tags=test_generated_tags):
-    tokens = []
+# The lex/tokenize function, as a generator yielding one token at a time
+def tokenize_stream(characters, generated_tags=test_generated_tags):
     position = 0
-    while position < len(characters):
-        # find the first token pattern that matches
-        for pattern, tag in patterns:
-            match = pattern.match(characters, position)
-            if match:
-                break
-
-        # this should never fail, since the last pattern matches everything.
-        assert match
+    # every character is matched by some pattern (the last one matches
+    # anything but newline, which is whitespace), so matches are contiguous.
+    for match in master_pattern.finditer(characters):
+        tag = group_tags[match.lastgroup]
+        if tag == "identifier":
+            tag = keywords.get(match.group(0), "identifier")
 
         # note that the tag was generated
         generated_tags.add(tag)
@@ -79,27 +126,45 @@ def tokenize(characters, generated_tags=test_generated_tags):
         if tag == "error":
             raise Exception(f"Syntax error: illegal character : {[match.group(0)]}")
 
-        # package the token
-        token = {"tag": tag, "value": match.group(0), "position": position}
-        if token["tag"] == "string":
-            token["value"] = token["value"][1:-1].replace('""', '"')
-        if token["tag"] == "number":
-            if "." in token["value"]:
-                token["value"] = float(token["value"])
-            else:
-                token["value"] = int(token["value"])
-        if token["tag"] == "boolean":
-            token["value"] = 1 if token["value"] == "true" else 0
-
-        # append token to stream, skipping whitespace and comments
+        # package the token, skipping whitespace and comments
         if tag not in ["comment", "whitespace"]:
-            tokens.append(token)
+            value = match.group(0)
+            if tag == "string":
+                value = value[1:-1].replace('""', '"')
+            if tag == "number":
+                if "." in value:
+                    value = float(value)
+                else:
+                    value = int(value)
+            if tag == "boolean":
+                value = 1 if value == "true" else 0
+            yield Token(tag, value, position)
 
         # update position for next match
         position = match.end()
 
-    tokens.append({"tag": None, "value": None, "position": position})
-    return tokens
+    yield Token(None, None, position)
+
+
+def tokenize(characters, generated_tags=test_generated_tags):
+    return list(tokenize_stream(characters, generated_tags))
+
+
+def test_token():
+    print("testing token objects...")
+    token = Token("number", 1, 0)
+    assert (token.tag, token.value, token.position) == ("number", 1, 0)
+    assert token["tag"] == "number"
+    assert token == {"tag": "number", "value": 1, "position": 0}
+    assert {"tag": "number", "value": 1, "position": 0} == token
+    assert token == Token("number", 1, 0)
+    assert token != Token("number", 1, 2)
+    assert not hasattr(token, "__dict__")
+    try:
+        token["size"]
+        assert False, "Should have a KeyError for 'size'."
+    except KeyError:
+        pass
 
 
 def test_simple_tokens():
@@ -168,6 +233,41 @@ def test_identifier_tokens():
         assert t[0]["value"] == s
 
 
+def test_keyword_prefixes():
+    print("testing identifiers that start with keywords...")
+    for s in [
+        "format",
+        "iffy",
+        "elsewhere",
+        "whiles",
+        "forward",
+        "breakfast",
+        "continued",
+        "printer",
+        "imports",
+        "externals",
+        "inputs",
+        "index",
+        "exits",
+        "returned",
+        "functional",
+        "android",
+        "order",
+        "nothing",
+        "nullable",
+        "truest",
+        "falsehood",
+        "if_",
+        "for2",
+    ]:
+        t = tokenize(s)
+        assert len(t) == 2, f"got tokens = {t}"
+        assert t[0]["tag"] == "identifier"
+        assert t[0]["value"] == s
+    t = tokenize("for format or order")
+    assert [token["tag"] for token in t] == ["for", "identifier", "||", "identifier", None]
+
+
 def test_whitespace():
     print("testing whitespace...")
     for s in ["1", "1  ", "  1", "  1  "]:
@@ -224,6 +324,7 @@ def test_keywords():
     print("testing keywords...")
     for keyword in [
         "function",
+        "memo",
         "return",
         "if",
         "else",
@@ -231,6 +332,7 @@ def test_keywords():
         "for",
         "break",
         "continue",
+        "in",
         "external",  # (reserved for future use)
         "import",  # (reserved for future use)
         "input",
@@ -243,6 +345,22 @@ def test_keywords():
         assert "value" not in t
 
 
+def test_tokenize_stream():
+    print("testing tokenize stream...")
+    code = "x = [1, 2.5]; if (x) { print \"a\" } // comment"
+    stream = tokenize_stream(code)
+    assert next(stream) == {"tag": "identifier", "value": "x", "position": 0}
+    assert [next(stream)] + list(stream) == tokenize(code)[1:]
+    # errors are raised when the offending token is reached
+    stream = tokenize_stream("1 $")
+    assert next(stream)["tag"] == "number"
+    try:
+        next(stream)
+        assert False, "Should have a token exception for '$'."
+    except Exception as e:
+        assert "illegal character" in str(e)
+
+
 def test_comments():
     print("testing comments...")
     assert verify_same_tokens("//comment", "\n")
@@ -263,23 +381,44 @@ def test_error():
         assert "illegal character" in error_string
 
 
+def test_master_pattern():
+    print("testing master pattern...")
+    example = 'x = [1, 2.5, "a""b"]; if (x != y && !z) { print x.y } // done\n $'
+    position = 0
+    for match in master_pattern.finditer(example):
+        # the combined pattern must pick what trying each pattern in turn picks
+        for pattern, tag in patterns:
+            expected = re.match(pattern, example[position:])
+            if expected:
+                break
+        assert match.start() == position
+        assert group_tags[match.lastgroup] == tag, f"{match.group(0)} is not {tag}"
+        assert match.group(0) == expected.group(0)
+        position = match.end()
+    assert position == len(example)
+
+
 def test_tag_coverage():
     print("testing comprehensive tag coverage...")
-    for pattern, tag in patterns:
+    for tag in [tag for _, tag in patterns] + list(keywords.values()):
         assert tag in test_generated_tags, f"Tag [ {tag} ] was not tested."
 
 
 if __name__ == "__main__":
     print("testing tokenizer.")
+    test_token()
     test_simple_tokens()
     test_number_tokens()
     test_string_tokens()
     test_boolean_tokens()
     test_identifier_tokens()
+    test_keyword_prefixes()
     test_whitespace()
     test_multiple_tokens()
     test_keywords()
+    test_tokenize_stream()
     test_comments()
     test_error()
+    test_master_pattern()
     test_tag_coverage()
     print("done.")
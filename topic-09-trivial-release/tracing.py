@@ -0,0 +1,184 @@
+import io
+import sys
+
+import evaluator
+from evaluator import evaluate, parse_code
+from objects import is_object
+from lists import is_list
+
+# Debug tracing of evaluate().
+#
+# A channel traces one kind of node: `index` traces reading a list item or
+# object field, `assign` traces storing a variable, list item or object field.
+# A channel is enabled at a level, 1 for one line naming the types involved
+# and 2 for one line with the full values, and traces to `output` (stderr,
+# so that a traced program's own output is unchanged).
+#
+# A disabled channel costs nothing: enabling one puts a tracing handler for
+# its tag in evaluator.evaluators in place of the plain one, and disabling it
+# puts the plain one back, so evaluate() never checks whether to trace.
+
+output = sys.stderr
+
+levels = {}
+
+
+def describe(value, level):
+    if level > 1:
+        return repr(value)
+    if is_list(value):
+        return f"list({len(value)})"
+    if is_object(value):
+        return f"object({len(value)})"
+    return repr(value)
+
+
+def emit(channel, message):
+    print(f"trace.{channel}: {message}", file=output)
+
+
+def trace_index(ast, environment):
+    level = levels["index"]
+    base = evaluator.evaluate_node(ast["base"], environment)
+    index = evaluator.evaluate_node(ast["index"], environment)
+    value = evaluator.index_value(base, index)
+    emit("index", f"{describe(base, level)}[{index!r}] -> {describe(value, level)}")
+    return value
+
+
+def trace_assign(ast, environment):
+    level = levels["assign"]
+    target = ast["target"]
+    if target["tag"] == "identifier":
+        base = environment
+        index = target["value"]
+        name = index
+    else:
+        base, index = evaluator.evaluate_target(target, environment)
+        name = f"{describe(base, level)}[{index!r}]"
+    value = evaluator.evaluate_node(ast["value"], environment)
+    base[index] = value
+    emit("assign", f"{name} = {describe(value, level)}")
+    return None
+
+
+# channel: (tag, tracing handler)
+channels = {
+    "index": ("complex", trace_index),
+    "assign": ("assign", trace_assign),
+}
+
+plain_handlers = {tag: evaluator.evaluators[tag] for tag, _ in channels.values()}
+
+
+def enable(channel, level=1):
+    assert channel in channels, f"Unknown trace channel [{channel}]"
+    assert level in [1, 2], f"Unknown trace level [{level}]"
+    tag, handler = channels[channel]
+    levels[channel] = level
+    evaluator.evaluators[tag] = handler
+
+
+def disable(channel):
+    assert channel in channels, f"Unknown trace channel [{channel}]"
+    tag, _ = channels[channel]
+    levels.pop(channel, None)
+    evaluator.evaluators[tag] = plain_handlers[tag]
+
+
+def parse_setting(setting):
+    """`index` or `index=2` as given to runner.py --trace; returns (channel, level)."""
+    channel, _, level = setting.partition("=")
+    assert channel in channels, f"Unknown trace channel [{channel}]"
+    assert level in ["", "1", "2"], f"Unknown trace level [{level}]"
+    return channel, int(level or 1)
+
+
+def traced(code, settings):
+    """The trace evaluating code writes with the channels in settings enabled."""
+    global output
+    saved = output
+    output = io.StringIO()
+    try:
+        for channel, level in settings:
+            enable(channel, level)
+        evaluate(parse_code(code), {})
+        return output.getvalue()
+    finally:
+        for channel in channels:
+            disable(channel)
+        output = saved
+
+
+def test_disabled():
+    print("testing disabled...")
+    assert traced('x = [1, 2]; y = {"a": x}; z = y["a"][1]', []) == ""
+    assert evaluator.evaluators["complex"] is evaluator.evaluate_complex
+    assert evaluator.evaluators["assign"] is evaluator.evaluate_assign
+
+
+def test_index():
+    print("testing index...")
+    code = 'x = [1, 2]; y = {"a": x}; z = y["a"][1]'
+    assert traced(code, [("index", 1)]) == (
+        "trace.index: object(1)['a'] -> list(2)\n" "trace.index: list(2)[1] -> 2\n"
+    )
+    assert traced(code, [("index", 2)]) == (
+        "trace.index: {'a': [1, 2]}['a'] -> [1, 2]\n" "trace.index: [1, 2][1] -> 2\n"
+    )
+
+
+def test_assign():
+    print("testing assign...")
+    code = 'x = [1, 2]; x[1] = 3; y = {}; y["a"] = x'
+    assert traced(code, [("assign", 1)]) == (
+        "trace.assign: x = list(2)\n"
+        "trace.assign: list(2)[1] = 3\n"
+        "trace.assign: y = object(0)\n"
+        "trace.assign: object(0)['a'] = list(2)\n"
+    )
+    # the target is shown as it was before the assignment
+    assert traced("x = [1]; x[0] = 2", [("assign", 2), ("index", 1)]) == (
+        "trace.assign: x = [1]\n" "trace.assign: [1][0] = 2\n"
+    )
+
+
+def test_traced_evaluation_unchanged():
+    print("testing traced evaluation unchanged...")
+    from differential import check_programs
+
+    def run_traced(ast, environment):
+        global output
+        saved = output
+        output = io.StringIO()
+        enable("index", 2)
+        enable("assign", 2)
+        try:
+            return evaluate(ast, environment)
+        finally:
+            disable("index")
+            disable("assign")
+            output = saved
+
+    check_programs(run_traced)
+
+
+def test_parse_setting():
+    print("testing parse setting...")
+    assert parse_setting("index") == ("index", 1)
+    assert parse_setting("assign=2") == ("assign", 2)
+    for setting, message in [("call", "Unknown trace channel [call]"), ("index=3", "Unknown trace level [3]")]:
+        try:
+            parse_setting(setting)
+            assert False, f"Should have refused {setting}"
+        except AssertionError as e:
+            assert str(e) == message, str(e)
+
+
+if __name__ == "__main__":
+    test_disabled()
+    test_index()
+    test_assign()
+    test_traced_evaluation_unchanged()
+    test_parse_setting()
+    print("done.")
@@ -0,0 +1,328 @@
+from compiler import *
+from resolver import UNBOUND, top_frame, call_frame, lookup_unbound
+import compiler
+import sink
+from evaluator import check_range
+from objects import Object, is_object, load_field, store_field
+from lists import List, is_list, make_list, store_item
+
+# Runs bytecode from compiler.py on a value stack.
+#
+# Calls do not recurse in Python: the caller's state is pushed on a frame stack
+# and the callee's code runs in the same loop, so the depth of trivial calls is
+# limited by memory rather than by Python's recursion limit. Locals live in
+# the slots of the call's Frame (see resolver.py); globals in the environment.
+
+
+def execute(code, environment):
+    """Runs compiled program code; returns (value, return_chain) like evaluate()."""
+    try:
+        return interpret(code, environment)
+    finally:
+        # the optimizer's temporaries go when the program does, however it ends
+        for name in code.temporaries:
+            environment.pop(name, None)
+
+
+def interpret(code, environment):
+    frames = []
+    instructions = code.instructions
+    constants = code.constants
+    names = code.names
+    sites = code.sites
+    frame = top_frame(environment)
+    values = frame.values
+    stack = []
+    pc = 0
+    while True:
+        opcode = instructions[pc]
+        argument = instructions[pc + 1]
+        pc += 2
+        # the most frequent instructions are tested first
+        if opcode == LOAD_LOCAL:
+            value = values[argument]
+            if value is UNBOUND:
+                value = lookup_unbound(frame, argument)
+            stack.append(value)
+        elif opcode == STORE_LOCAL:
+            values[argument] = stack.pop()
+        elif opcode == LOAD_NAME:
+            identifier = names[argument]
+            scope = environment
+            while identifier not in scope:
+                assert "$parent" in scope, f"Unknown identifier: '{identifier}'."
+                scope = scope["$parent"]
+            stack.append(scope[identifier])
+        elif opcode == LOAD_CONST:
+            stack.append(constants[argument])
+        elif opcode == STORE_NAME:
+            environment[names[argument]] = stack.pop()
+        elif opcode == JUMP_IF_FALSE:
+            if not stack.pop():
+                pc = argument
+        elif opcode == JUMP:
+            pc = argument
+        elif opcode == FOR_ITER:
+            counter = next(stack[-1], None)
+            if counter is None:
+                stack.pop()
+                pc = argument
+            else:
+                stack.append(counter)
+        elif opcode == ADD:
+            right = stack.pop()
+            stack[-1] = stack[-1] + right
+        elif opcode == SUBTRACT:
+            right = stack.pop()
+            stack[-1] = stack[-1] - right
+        elif opcode == MULTIPLY:
+            right = stack.pop()
+            stack[-1] = stack[-1] * right
+        elif opcode == LESS:
+            right = stack.pop()
+            stack[-1] = stack[-1] < right
+        elif opcode == POP:
+            stack.pop()
+        elif opcode == CALL:
+            if argument:
+                arguments = stack[-argument:]
+                del stack[-argument:]
+            else:
+                arguments = []
+            function = stack.pop()
+            assert type(function) is Function, f"{function} is not a function"
+            frames.append((code, stack, pc, frame))
+            code = function.code
+            frame = call_frame(code.parameters, code.slots, arguments, function.frame)
+            instructions = code.instructions
+            constants = code.constants
+            names = code.names
+            sites = code.sites
+            values = frame.values
+            stack = []
+            pc = 0
+        elif opcode == RETURN:
+            value = stack.pop()
+            if not frames:
+                # a return statement at the top level of the program
+                return value, True
+            code, stack, pc, frame = frames.pop()
+            instructions = code.instructions
+            constants = code.constants
+            names = code.names
+            sites = code.sites
+            values = frame.values
+            stack.append(value)
+        elif opcode == LOAD_OUTER:
+            depth, slot = code.addresses[argument]
+            outer = frame
+            for _ in range(depth):
+                outer = outer.parent
+            value = outer.values[slot]
+            if value is UNBOUND:
+                value = lookup_unbound(outer, slot)
+            stack.append(value)
+        elif opcode == MAKE_FUNCTION:
+            stack.append(Function(constants[argument], frame))
+        elif opcode == GET_RANGE:
+            stop = stack.pop()
+            check_range(stack[-1], stop)
+            stack[-1] = iter(range(stack[-1], stop))
+        elif opcode == GREATER:
+            right = stack.pop()
+            stack[-1] = stack[-1] > right
+        elif opcode == LESS_EQUAL:
+            right = stack.pop()
+            stack[-1] = stack[-1] <= right
+        elif opcode == GREATER_EQUAL:
+            right = stack.pop()
+            stack[-1] = stack[-1] >= right
+        elif opcode == EQUAL:
+            right = stack.pop()
+            stack[-1] = stack[-1] == right
+        elif opcode == NOT_EQUAL:
+            right = stack.pop()
+            stack[-1] = stack[-1] != right
+        elif opcode == DIVIDE:
+            right = stack.pop()
+            assert right != 0, "Division by zero"
+            stack[-1] = stack[-1] / right
+        elif opcode == JUMP_IF_FALSE_OR_POP:
+            if stack[-1]:
+                stack.pop()
+            else:
+                pc = argument
+        elif opcode == JUMP_IF_TRUE_OR_POP:
+            if stack[-1]:
+                pc = argument
+            else:
+                stack.pop()
+        elif opcode == LOAD_FIELD:
+            base = stack[-1]
+            site = sites[argument]
+            if base.__class__ is Object and base.shape is site.shape:
+                stack[-1] = base.values[site.slot]
+            else:
+                stack[-1] = load_field(base, site)
+        elif opcode == STORE_FIELD:
+            value = stack.pop()
+            base = stack.pop()
+            site = sites[argument]
+            if base.__class__ is Object and base.shape is site.shape:
+                base.values[site.slot] = value
+            else:
+                store_field(base, site, value)
+        elif opcode == INDEX:
+            index = stack.pop()
+            base = stack[-1]
+            if index == None:
+                continue
+            if type(index) in [int, float]:
+                assert int(index) == index
+                if base.__class__ is List:
+                    # every storage indexes alike
+                    base = base.items
+                else:
+                    assert type(base) == list
+                assert len(base) > index
+            else:
+                assert type(index) == str, f"Unknown index type [{index}]"
+                assert is_object(base)
+            stack[-1] = base[index]
+        elif opcode == STORE_INDEX:
+            value = stack.pop()
+            index = stack.pop()
+            base = stack.pop()
+            if base.__class__ is List:
+                # the value may have changed the storage
+                items = base.items
+                if items.__class__ is list:
+                    items[index] = value
+                else:
+                    store_item(base, index, value)
+            else:
+                base[index] = value
+        elif opcode == CHECK_TARGET:
+            index = stack[-1]
+            base = stack[-2]
+            assert type(index) in [int, float, str], f"Unknown index type [{index}]"
+            if type(index) in [int, float]:
+                assert int(index) == index
+                assert is_list(base)
+                assert len(base) > index
+            else:
+                assert is_object(base)
+        elif opcode == CHECK_OBJECT:
+            assert is_object(stack[-1])
+        elif opcode == CHECK_FUNCTION:
+            function = stack[-1]
+            assert type(function) is Function, f"{function} is not a function"
+        elif opcode == NEGATE:
+            stack[-1] = -stack[-1]
+        elif opcode == NOT:
+            stack[-1] = not stack[-1]
+        elif opcode == BUILD_LIST:
+            if argument:
+                items = stack[-argument:]
+                del stack[-argument:]
+            else:
+                items = []
+            stack.append(make_list(items))
+        elif opcode == BUILD_OBJECT:
+            object = Object()
+            if argument:
+                items = stack[-2 * argument :]
+                del stack[-2 * argument :]
+                for key, value in zip(items[::2], items[1::2]):
+                    assert type(key) is str, "Object key must be a string"
+                    object[key] = value
+            stack.append(object)
+        elif opcode == PRINT:
+            if argument:
+                stack.append(sink.output.write_value(stack.pop()))
+            else:
+                stack.append(sink.output.write_newline())
+        elif opcode == HALT:
+            return stack.pop(), False
+        else:
+            assert False, f"Unknown opcode [{opcode}]"
+
+
+def run(ast, environment):
+    return execute(compiler.compile(ast), environment)
+
+
+def test_execute_expressions():
+    print("testing execute expressions...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    assert run(parse(tokenize("1 + 2 * 3")), {}) == (7, False)
+    assert run(parse(tokenize('x.a[1] + y')), {"x": {"a": [1, 2]}, "y": 3}) == (5, False)
+    assert run(parse(tokenize('[1, {"b": 2}, -3]')), {}) == ([1, {"b": 2}, -3], False)
+
+
+def test_execute_statements():
+    print("testing execute statements...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    environment = {}
+    assert run(parse(tokenize("x = 0; while (x < 3) { x = x + 1 }")), environment) == (
+        None,
+        False,
+    )
+    assert environment == {"x": 3}
+    assert run(parse(tokenize("return 4; 5")), {}) == (4, True)
+
+
+def test_execute_deep_recursion():
+    print("testing execute deep recursion...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    code = """
+        function count(n) {
+            if (n == 0) { return 0 };
+            return 1 + count(n - 1)
+        };
+        count(20000)
+    """
+    # far deeper than evaluate() could go with Python's recursion limit
+    assert run(parse(tokenize(code)), {}) == (20000, False)
+
+
+def test_execute_closures():
+    print("testing execute closures...")
+    from tokenizer import tokenize
+    from parser import parse
+
+    # functions see the variables where they were defined, not their caller's
+    code = "y = 1; function g() { return y }; function f(y) { return g() }; f(5)"
+    assert run(parse(tokenize(code)), {}) == (1, False)
+    code = """
+        function counter() {
+            count = 0;
+            function next(step) { return count + step };
+            return next
+        };
+        next = counter();
+        [next(1), next(2)]
+    """
+    assert run(parse(tokenize(code)), {}) == ([1, 2], False)
+
+
+def test_execute_same_as_evaluate():
+    print("testing execute same as evaluate...")
+    from differential import check_programs
+
+    check_programs(run)
+
+
+if __name__ == "__main__":
+    test_execute_expressions()
+    test_execute_statements()
+    test_execute_deep_recursion()
+    test_execute_closures()
+    test_execute_same_as_evaluate()
+    print("done.")